@@ -23,4 +23,11 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(HTTPBea
     username = AuthService.verify_token(token)
     if not username:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or missing token")
-    return {"username": username} 
\ No newline at end of file
+    return {"username": username} 
+
+def get_optional_user(credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False))):
+    # Like get_current_user, but anonymous requests get None instead of a 401
+    if credentials is None:
+        return None
+    username = AuthService.verify_token(credentials.credentials)
+    return {"username": username} if username else None
@@ -0,0 +1,152 @@
+"""Non-blocking, sampled, structured logging.
+
+Log calls only build a ``LogRecord`` and push it onto a queue; a background
+thread formats and writes it, so a slow stderr or log collector never stalls
+the event loop. Hot-path loggers log with ``%``-style arguments (formatted
+lazily, on the listener thread) and pass summaries such as counts as
+``extra`` fields instead of whole collections.
+
+Per-category throttling applies to records below WARNING. A category is a
+logger name and covers its children:
+
+- ``LOG_SAMPLE="app.websockets.handlers=0.1"`` keeps one record in ten.
+- ``LOG_RATE_LIMIT="app.websockets=100"`` keeps at most 100 records/second.
+
+``LOG_FORMAT=json`` emits one JSON object per line, with the ``extra``
+fields as top-level keys; the default text format appends them as
+``key=value`` pairs.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DEFAULT_RATE_LIMITS = {"app.websockets": 200.0}
+
+# Attributes every LogRecord has; anything else came from ``extra``
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def _parse(spec: Optional[str]) -> Dict[str, float]:
+    """Parse ``"name=value,name=value"`` into a dict."""
+    result = {}
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            result[name.strip()] = float(value)
+    return result
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _RESERVED and not k.startswith("_")}
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ThrottleFilter(logging.Filter):
+    """Sample and rate-limit records below WARNING, per category."""
+
+    def __init__(self, sample: Dict[str, float], rate_limits: Dict[str, float]):
+        super().__init__()
+        self.sample = sample
+        self.rate_limits = rate_limits
+        # category -> [tokens, last refill]
+        self._buckets: Dict[str, list] = {}
+        self.dropped = 0
+
+    def _category(self, name: str, table: Dict[str, float]) -> Optional[str]:
+        # Longest configured prefix of the logger name
+        while name:
+            if name in table:
+                return name
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.sample.get(self._category(record.name, self.sample))
+        if rate is not None and random.random() >= rate:
+            self.dropped += 1
+            return False
+        category = self._category(record.name, self.rate_limits)
+        if category is None:
+            return True
+        limit = self.rate_limits[category]
+        now = time.monotonic()
+        bucket = self._buckets.setdefault(category, [limit, now])
+        bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit)
+        bucket[1] = now
+        if bucket[0] < 1:
+            self.dropped += 1
+            return False
+        bucket[0] -= 1
+        return True
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # The stock handler formats the message on the calling thread; the
+    # listener lives in this process, so hand the record over untouched.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> Optional[QueueListener]:
+    """Route the root logger through a queue. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return _listener
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+
+    handler = _DeferredQueueHandler(queue.SimpleQueue())
+    rate_limits = {**DEFAULT_RATE_LIMITS, **_parse(os.getenv("LOG_RATE_LIMIT"))}
+    handler.addFilter(ThrottleFilter(_parse(os.getenv("LOG_SAMPLE")), rate_limits))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
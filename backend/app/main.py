@@ -1,15 +1,17 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.websockets.manager import manager
+from app.websockets.presence import presence
 from app.models.message import Message
-from app.routes import chat, groups, auth
-import logging
+from app.routes import chat, groups, auth, metrics
+from app.metrics import loop_lag
+from app.services.change_log import change_log
+from app.services.database import db
+from app.services.password_hasher import hasher
+from app.logging_config import setup_logging, stop_logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (queued, see app/logging_config.py)
+setup_logging()
 
 app = FastAPI()
 
@@ -24,10 +26,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Before-Cursor", "X-After-Cursor", "X-Next-Cursor"],
 )
 
 
 # Include routers
 app.include_router(chat.router, tags=["chat"])
 app.include_router(groups.router)
-app.include_router(auth.router) 
\ No newline at end of file
+app.include_router(auth.router)
+app.include_router(metrics.router)
+
+
+@app.on_event("startup")
+async def on_startup():
+    await db.ensure_indexes()
+    await manager.start()
+    await presence.start()
+    await change_log.start()
+    await loop_lag.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await loop_lag.stop()
+    await change_log.stop()
+    await presence.stop()
+    await manager.stop()
+    await db.close()
+    hasher.close()
+    stop_logging()
+ 
\ No newline at end of file
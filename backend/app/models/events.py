@@ -0,0 +1,56 @@
+from pydantic import AfterValidator, BaseModel, Field
+from typing import Annotated, List, Optional
+
+# User, group and message IDs are compared normalized everywhere
+NormalizedId = Annotated[str, AfterValidator(lambda v: v.strip().lower())]
+
+# Payloads of the events clients send over /ws/{user_id}, keyed by "type"
+# in app.websockets.handlers. Unknown fields are ignored.
+
+class MessageEvent(BaseModel):
+    receiver_id: NormalizedId
+    content: str
+
+class GroupMessageEvent(BaseModel):
+    groupId: NormalizedId
+    content: str
+
+class GroupMemberEvent(BaseModel):
+    # add_member / remove_member / promote_admin
+    groupId: NormalizedId
+    by: NormalizedId
+    userId: NormalizedId
+
+class ExitGroupEvent(BaseModel):
+    groupId: NormalizedId
+    userId: NormalizedId
+
+class CreateGroupEvent(BaseModel):
+    groupName: Optional[str] = None
+    creator: Optional[NormalizedId] = None
+    members: Optional[List[NormalizedId]] = None
+
+class ReactionEvent(BaseModel):
+    # like / delete
+    message_id: str
+    is_group: bool = False
+    group_id: Optional[NormalizedId] = None
+
+class Reaction(BaseModel):
+    message_id: str
+    action: str  # like / unlike / delete
+    is_group: bool = False
+
+class ReplayReactionsEvent(BaseModel):
+    reactions: List[Reaction] = []
+
+class PresenceSnapshotEvent(BaseModel):
+    cursor: Optional[str] = None
+
+class SyncEvent(BaseModel):
+    # Last change log seq the client has applied
+    since: int = Field(ge=0)
+
+class MarkReadEvent(BaseModel):
+    chat_id: NormalizedId  # the other user, or the group id
+    is_group: bool = False
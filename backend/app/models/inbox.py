@@ -0,0 +1,15 @@
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel
+
+class InboxEntry(BaseModel):
+    """One chat in a user's inbox: its latest message and unread count."""
+    chat_id: str  # the other user for direct chats, the group id for groups
+    is_group: bool = False
+    last_message_id: Optional[str] = None
+    last_sender_id: Optional[str] = None
+    preview: str = ""  # start of the latest message; empty once it is deleted
+    last_deleted: bool = False
+    updated_at: datetime  # time of the latest message; orders the inbox
+    unread: int = 0
+    read_at: Optional[datetime] = None  # last mark_read
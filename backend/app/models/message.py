@@ -2,6 +2,11 @@ from datetime import datetime
 from typing import Optional, List
 from pydantic import BaseModel, Field
 
+def make_conversation_id(user_id: str, other_user_id: str) -> str:
+    """Canonical key for a direct conversation: the sorted pair of participants."""
+    first, second = sorted([user_id, other_user_id])
+    return f"{first}:{second}"
+
 class Message(BaseModel):
     sender_id: str
     receiver_id: str
@@ -9,6 +14,7 @@ class Message(BaseModel):
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     likes: List[str] = Field(default_factory=list)  # List of user IDs who liked the message
     deleted_by: List[str] = Field(default_factory=list)  # List of user IDs who deleted the message
+    conversation_id: Optional[str] = None  # Set by Database.save_message
 
 class MessageInDB(Message):
     id: Optional[str] = Field(None, alias="_id") 
\ No newline at end of file
@@ -1,14 +1,22 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from fastapi.responses import StreamingResponse
 from fastapi.websockets import WebSocket
 from app.models.user import UserCreate, UserLogin
 from app.services.auth_service import AuthService
+from app.services.password_hasher import HasherBusy, hasher
 from app.dependencies import get_current_user
 from app.services.database import db
+from app.services.storage import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from app.websockets.manager import manager
 from pydantic import BaseModel
+from typing import Optional
+import os
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
+# Usernames allowed to export the full user directory
+ADMIN_USERS = {u.strip().lower() for u in os.environ.get("ADMIN_USERS", "").split(",") if u.strip()}
+
 
 
 @router.post("/register")
@@ -18,19 +26,44 @@ async def register(user: UserCreate):
         return {"success": True, "user_id": user_id}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except HasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
 @router.post("/login")
 async def login(user: UserLogin):
-    user_in_db = await AuthService.authenticate(user)
+    try:
+        user_in_db = await AuthService.authenticate(user)
+    except HasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
     if not user_in_db:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = AuthService.create_access_token({"sub": user_in_db.username})
     return {"access_token": token, "token_type": "bearer", "username": user_in_db.username}
 
 @router.get("/users")
-async def get_users(current_user: dict = Depends(get_current_user)):
-    users = await db.db.users.find({}, {"username": 1, "_id": 0}).to_list(length=1000)
-    return [u["username"] for u in users]
+async def get_users(
+    response: Response,
+    q: str = "",
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
+    # One page of usernames starting with q; pass X-Next-Cursor back as after
+    usernames = await db.search_users(q, after=after, limit=limit)
+    if len(usernames) == limit:
+        response.headers["X-Next-Cursor"] = usernames[-1]
+    return usernames
+
+@router.get("/users/export")
+async def export_users(q: str = "", current_user: dict = Depends(get_current_user)):
+    # Streamed, one username per line, so memory stays flat however many users exist
+    if current_user["username"] not in ADMIN_USERS:
+        raise HTTPException(status_code=403, detail="Admins only")
+
+    async def lines():
+        async for username in db.iter_usernames(q):
+            yield username + "\n"
+    return StreamingResponse(lines(), media_type="text/plain")
 
 @router.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str, token: str = Query(...)):
@@ -49,12 +82,16 @@ class ResetPasswordRequest(BaseModel):
 
 @router.post("/reset-password")
 async def reset_password(req: ResetPasswordRequest):
-    user_doc = await db.db.users.find_one({"username": req.username.strip().lower()})
+    user_doc = await db.get_user(req.username.strip().lower())
     if not user_doc:
         raise HTTPException(status_code=404, detail="User not found")
     if user_doc.get("pin") != req.pin:
         raise HTTPException(status_code=403, detail="Invalid PIN")
-    from app.services.auth_service import pwd_context
-    new_hash = pwd_context.hash(req.new_password)
-    await db.db.users.update_one({"username": req.username.strip().lower()}, {"$set": {"password_hash": new_hash}})
+    try:
+        new_hash = await hasher.hash(req.new_password)
+    except HasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    await db.set_password_hash(req.username.strip().lower(), new_hash)
+    # Sessions signed in with the old password end here
+    AuthService.revoke_user_tokens(req.username.strip().lower())
     return {"success": True} 
\ No newline at end of file
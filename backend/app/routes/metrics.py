@@ -0,0 +1,92 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.metrics import Exposition, db_operations, loop_lag
+from app.services.auth_service import token_cache
+from app.services.change_log import change_log
+from app.services.database import db
+from app.services.password_hasher import hasher
+from app.websockets.events import registry
+from app.websockets.manager import manager
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text format; all values are for this worker process
+    out = Exposition()
+
+    sessions = sum(len(s) for s in manager.active_connections.values())
+    out.family("chat_ws_active_sockets", "gauge", "Open WebSocket sessions")
+    out.sample("chat_ws_active_sockets", sessions)
+    out.family("chat_ws_online_users", "gauge", "Users with at least one open session")
+    out.sample("chat_ws_online_users", len(manager.online_users))
+    out.family("chat_ws_outbound_queued_frames", "gauge", "Frames waiting in outbound queues")
+    out.sample("chat_ws_outbound_queued_frames", sum(
+        conn.depth for s in manager.active_connections.values() for conn in s.values()
+    ))
+    out.family("chat_ws_send_failures_total", "counter", "Socket writes that failed or timed out")
+    out.sample("chat_ws_send_failures_total", manager.send_failures)
+    out.family("chat_ws_dropped_frames_total", "counter", "Ephemeral frames dropped by full queues")
+    out.sample("chat_ws_dropped_frames_total", manager.dropped_frames)
+    out.family("chat_ws_evictions_total", "counter", "Slow consumers disconnected by full queues")
+    out.sample("chat_ws_evictions_total", manager.evictions)
+
+    out.family("chat_event_handler_seconds", "histogram", "Receive to fan-out latency per event type")
+    for event_type, stats in registry.stats.items():
+        out.histogram("chat_event_handler_seconds", stats.latency, {"event": event_type})
+    out.family("chat_event_errors_total", "counter", "Handler errors per event type")
+    for event_type, stats in registry.stats.items():
+        out.sample("chat_event_errors_total", stats.errors, {"event": event_type})
+    out.family("chat_event_invalid_total", "counter", "Rejected payloads per event type")
+    for event_type, stats in registry.stats.items():
+        out.sample("chat_event_invalid_total", stats.invalid, {"event": event_type})
+    out.family("chat_event_unknown_total", "counter", "Events with an unknown type")
+    out.sample("chat_event_unknown_total", registry.unknown)
+
+    out.family("chat_change_log_pending", "gauge", "Change log entries waiting to be written")
+    out.sample("chat_change_log_pending", change_log.pending)
+    out.family("chat_change_log_write_failures_total", "counter", "Change log writes that failed and were retried")
+    out.sample("chat_change_log_write_failures_total", change_log.write_failures)
+
+    out.family("chat_db_operation_seconds", "histogram", "Database method latency")
+    for operation, stats in db_operations.items():
+        if stats.latency.count:
+            out.histogram("chat_db_operation_seconds", stats.latency, {"operation": operation})
+    out.family("chat_db_errors_total", "counter", "Database method errors")
+    for operation, stats in db_operations.items():
+        if stats.latency.count:
+            out.sample("chat_db_errors_total", stats.errors, {"operation": operation})
+
+    # Storage-side caches (group documents, directory pages); backend dependent
+    caches = db.cache_stats()
+    out.family("chat_cache_hits_total", "counter", "Storage cache hits")
+    for name, stats in caches.items():
+        out.sample("chat_cache_hits_total", stats["hits"], {"cache": name})
+    out.family("chat_cache_misses_total", "counter", "Storage cache misses")
+    for name, stats in caches.items():
+        out.sample("chat_cache_misses_total", stats["misses"], {"cache": name})
+
+    tokens = token_cache.stats()
+    out.family("chat_token_cache_hits_total", "counter", "Token verifications served from cache")
+    out.sample("chat_token_cache_hits_total", tokens["hits"])
+    out.family("chat_token_cache_misses_total", "counter", "Token verifications that decoded the JWT")
+    out.sample("chat_token_cache_misses_total", tokens["misses"])
+    out.family("chat_token_cache_entries", "gauge", "Cached verified tokens")
+    out.sample("chat_token_cache_entries", tokens["size"])
+
+    out.family("chat_password_hash_waiting", "gauge", "Password operations queued for a worker")
+    out.sample("chat_password_hash_waiting", hasher.waiting)
+    out.family("chat_password_hash_running", "gauge", "Password operations running")
+    out.sample("chat_password_hash_running", hasher.running)
+    out.family("chat_password_hash_rejected_total", "counter", "Password operations refused with 503")
+    out.sample("chat_password_hash_rejected_total", hasher.rejected)
+    out.family("chat_password_rehashed_total", "counter", "Stored hashes upgraded on login")
+    out.sample("chat_password_rehashed_total", hasher.rehashed)
+    out.family("chat_password_hash_wait_seconds", "histogram", "Time queued before a worker was free")
+    out.histogram("chat_password_hash_wait_seconds", hasher.wait_time)
+    out.family("chat_password_hash_seconds", "histogram", "Time spent hashing or verifying")
+    out.histogram("chat_password_hash_seconds", hasher.run_time)
+
+    out.family("chat_event_loop_lag_seconds", "histogram", "How late the event loop wakes a sleeping task")
+    out.histogram("chat_event_loop_lag_seconds", loop_lag.latency)
+    return out.render()
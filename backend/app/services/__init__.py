@@ -1,3 +1,9 @@
-from .database import db
+__all__ = ['db']
 
-__all__ = ['db'] 
\ No newline at end of file
+
+def __getattr__(name):
+    # Imported on first use so the memory and SQLite backends load without motor
+    if name == "db":
+        from .database import db
+        return db
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
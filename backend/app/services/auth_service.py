@@ -1,15 +1,119 @@
-from passlib.context import CryptContext
 from jose import jwt, JWTError
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import Optional
 from app.services.database import db
 from app.models.user import UserCreate, UserLogin, UserInDB
+from app.services.password_hasher import hasher
+import hashlib
 import os
+import threading
+import time
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 week
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", "300"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+class TokenCache:
+    """Size-bounded LRU of verified tokens.
+
+    Keys are SHA-256 digests, so raw tokens are never held in memory longer
+    than the request. An entry lives until the token's ``exp`` or ``ttl``
+    seconds, whichever comes first; ``invalidate``/``invalidate_user`` evict
+    revoked tokens. Sync dependencies call ``verify_token`` from FastAPI's
+    threadpool, so every access holds ``_lock``.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, username: str, exp: Optional[float]):
+        deadline = time.time() + self.ttl
+        if exp is not None:
+            deadline = min(deadline, float(exp))
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (username, deadline)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    def invalidate_user(self, username: str):
+        # O(size), but only runs on password changes and explicit revocation
+        with self._lock:
+            for key in [k for k, (user, _) in self._entries.items() if user == username]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+class TokenDenylist:
+    """Revoked tokens, checked whenever a token is verified without the cache.
+
+    Single tokens are kept (as digests) until they would have expired anyway;
+    revoking a user rejects every token issued before that second (``iat``).
+    Held in this process only: with several workers, each one must be told.
+    """
+
+    def __init__(self):
+        self._tokens: dict = {}  # digest -> exp
+        self._users: dict = {}  # username -> tokens issued earlier are revoked
+        self._lock = threading.Lock()
+
+    def revoke(self, token: str, exp: Optional[float]):
+        with self._lock:
+            now = time.time()
+            self._tokens = {k: e for k, e in self._tokens.items() if e > now}
+            if exp is None:
+                exp = now + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+            self._tokens[TokenCache._key(token)] = float(exp)
+
+    def revoke_user(self, username: str):
+        # Whole seconds, like iat, so a login right after a reset stays valid
+        with self._lock:
+            self._users[username] = int(time.time())
+
+    def is_revoked(self, token: str, username: str, issued_at: Optional[float]) -> bool:
+        with self._lock:
+            if TokenCache._key(token) in self._tokens:
+                return True
+            not_before = self._users.get(username)
+        return not_before is not None and (issued_at is None or issued_at < not_before)
+
+
+token_cache = TokenCache()
+token_denylist = TokenDenylist()
 
 class AuthService:
     @staticmethod
@@ -17,26 +121,25 @@ class AuthService:
         # Normalize username
         username = user.username.strip().lower()
         # Check if user exists
-        existing = await db.db.users.find_one({"username": username})
+        existing = await db.get_user(username)
         if existing:
             raise ValueError("Username already exists")
-        password_hash = pwd_context.hash(user.password)
-        user_doc = {
-            "username": username,
-            "password_hash": password_hash,
-            "pin": user.pin,
-        }
-        result = await db.db.users.insert_one(user_doc)
-        return str(result.inserted_id)
+        password_hash = await hasher.hash(user.password)
+        return await db.create_user(username, password_hash, user.pin)
 
     @staticmethod
     async def authenticate(user: UserLogin):
         username = user.username.strip().lower()
-        user_doc = await db.db.users.find_one({"username": username})
+        user_doc = await db.get_user(username)
         if not user_doc:
             return None
-        if not pwd_context.verify(user.password, user_doc["password_hash"]):
+        ok, new_hash = await hasher.verify_and_update(user.password, user_doc["password_hash"])
+        if not ok:
             return None
+        if new_hash is not None:
+            # Stored hash predates the current cost settings; upgrade it now
+            await db.set_password_hash(username, new_hash, expected=user_doc["password_hash"])
+            user_doc["password_hash"] = new_hash
         return UserInDB(**user_doc)
 
     @staticmethod
@@ -46,17 +149,40 @@ class AuthService:
         if "sub" in to_encode:
             to_encode["sub"] = to_encode["sub"].strip().lower()
         expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-        to_encode.update({"exp": expire})
+        to_encode.update({"exp": expire, "iat": datetime.utcnow()})
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return encoded_jwt
 
     @staticmethod
     def verify_token(token: str):
+        username = token_cache.get(token)
+        if username is not None:
+            return username
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             username = payload.get("sub")
             if username is None:
                 return None
-            return username.strip().lower()
+            username = username.strip().lower()
+            if token_denylist.is_revoked(token, username, payload.get("iat")):
+                return None
+            token_cache.put(token, username, payload.get("exp"))
+            return username
         except JWTError:
-            return None 
\ No newline at end of file
+            return None
+
+    @staticmethod
+    def revoke_token(token: str):
+        try:
+            exp = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("exp")
+        except JWTError:
+            return  # Invalid or expired: already rejected
+        token_denylist.revoke(token, exp)
+        token_cache.invalidate(token)
+
+    @staticmethod
+    def revoke_user_tokens(username: str):
+        """Reject every token issued to ``username`` until now, e.g. after a password reset."""
+        token_denylist.revoke_user(username)
+        token_cache.invalidate_user(username)
+ 
\ No newline at end of file
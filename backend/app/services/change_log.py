@@ -0,0 +1,131 @@
+"""Writes the ``sync`` change log off the fanout path.
+
+Each worker reserves a block of ``CHANGE_BLOCK_SIZE`` seqs at a time and
+hands them out without touching the database, so ``record`` only awaits
+storage once per block. Entries are queued and written in the background
+every ``CHANGE_FLUSH_INTERVAL`` seconds, each write also moving this
+worker's floor (its lowest seq that may still be written) up; a block left
+idle for ``CHANGE_BLOCK_IDLE`` seconds is released so it does not hold the
+watermark back. Clients only ever see seqs at or below
+``Storage.change_watermark``, so an entry committed late is never skipped.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from app.services.database import db
+from app.services.storage import CHANGE_LOG_TTL, CHANGE_WRITER_LEASE, Storage
+
+logger = logging.getLogger(__name__)
+
+CHANGE_BLOCK_SIZE = int(os.getenv("CHANGE_BLOCK_SIZE", "100"))
+CHANGE_FLUSH_INTERVAL = float(os.getenv("CHANGE_FLUSH_INTERVAL", "0.05"))
+CHANGE_BLOCK_IDLE = float(os.getenv("CHANGE_BLOCK_IDLE", "1.0"))
+# How often entries older than CHANGE_LOG_TTL are dropped
+CHANGE_PRUNE_INTERVAL = float(os.getenv("CHANGE_PRUNE_INTERVAL", "600"))
+
+
+class ChangeLog:
+    def __init__(self, storage: Storage, block_size: int = CHANGE_BLOCK_SIZE,
+                 flush_interval: float = CHANGE_FLUSH_INTERVAL, block_idle: float = CHANGE_BLOCK_IDLE):
+        self.storage = storage
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.block_idle = block_idle
+        self.writer_id = uuid.uuid4().hex
+        # Reserved block, [next, end); empty when next == end
+        self._next = self._end = 0
+        # Whether storage holds a floor for this writer
+        self._registered = False
+        self._pending: List[dict] = []
+        self._lock = asyncio.Lock()
+        self._last_record = 0.0
+        self._renewed = 0.0
+        self._pruned = 0.0
+        self._task: Optional[asyncio.Task] = None
+        # Counters for /metrics
+        self.write_failures = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        async with self._lock:
+            await self._write(release=True)
+
+    async def record(self, audience: Iterable[str], payload: dict) -> int:
+        """Queue ``payload`` for the log of every user in ``audience``; returns its seq."""
+        while self._next >= self._end:
+            await self._reserve()
+        seq = self._next
+        self._next += 1
+        self._pending.append({
+            "seq": seq, "audience": sorted(set(audience)), "payload": dict(payload),
+            "created_at": datetime.utcnow(),
+        })
+        self._last_record = time.monotonic()
+        return seq
+
+    async def _reserve(self):
+        async with self._lock:
+            if self._next < self._end:
+                return
+            # The new block moves our floor past everything queued so far
+            await self._write()
+            if self._pending:
+                raise RuntimeError("Change log entries could not be written")
+            first = await self.storage.reserve_change_seqs(self.writer_id, self.block_size)
+            self._next, self._end = first, first + self.block_size
+            self._registered = True
+            self._renewed = time.monotonic()
+
+    async def _write(self, release: bool = False):
+        """Write queued entries; call with the lock held."""
+        entries, self._pending = self._pending, []
+        if not entries and not self._registered:
+            return
+        if release:
+            # Nothing may be queued under a floor that is going away
+            self._next = self._end
+        # Entries queued from here on get seqs at or above _next
+        floor = None if release else self._next
+        try:
+            await self.storage.write_changes(self.writer_id, entries, floor)
+        except Exception as e:
+            logger.error(f"Writing {len(entries)} change log entries failed: {e!r}")
+            self.write_failures += 1
+            self._pending[:0] = entries
+            return
+        self._registered = not release
+        self._renewed = time.monotonic()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            now = time.monotonic()
+            if self._pending or (self._registered and now - self._renewed > CHANGE_WRITER_LEASE / 2):
+                async with self._lock:
+                    await self._write()
+            elif self._registered and now - self._last_record > self.block_idle:
+                async with self._lock:
+                    if not self._pending:
+                        await self._write(release=True)
+            if now - self._pruned > CHANGE_PRUNE_INTERVAL:
+                self._pruned = now
+                try:
+                    await self.storage.prune_changes(datetime.utcnow() - timedelta(seconds=CHANGE_LOG_TTL))
+                except Exception as e:
+                    logger.error(f"Pruning the change log failed: {e!r}")
+
+
+change_log = ChangeLog(db)
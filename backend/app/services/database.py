@@ -1,20 +1,232 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from app.models.message import Message, MessageInDB
-from typing import List, Union
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from app.models.message import Message, MessageInDB, make_conversation_id
+from typing import AsyncIterator, Dict, FrozenSet, List, Optional, Union
+from collections import OrderedDict
 from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime
 import logging
+import re
+import time
 from app.models.group_pydantic import Group, GroupMessage
+from app.models.inbox import InboxEntry
+from app.services.write_batcher import WriteBatcher
+from app.services.recent_messages import RecentMessages
+from app.metrics import db_operations, instrument
+from app.services.storage import (
+    CHANGE_WRITER_LEASE, DEFAULT_PAGE_SIZE, apply_delete, create_storage, decode_cursor, decode_inbox_cursor,
+    inbox_deliveries, inbox_key, inbox_preview, inbox_unread_targets,
+)
+from datetime import timedelta
 from dotenv import load_dotenv
 import os
 
 logger = logging.getLogger(__name__)
 
+# Every index the app relies on, per collection. Applied idempotently at
+# startup by Database.ensure_indexes; names are left to Mongo's defaults so
+# re-applying matches indexes created by earlier versions.
+INDEXES = {
+    "messages": [
+        IndexModel([("conversation_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]),
+        # get_contacts: distinct partners per direction, answered from the index alone
+        IndexModel([("sender_id", ASCENDING), ("receiver_id", ASCENDING)]),
+        IndexModel([("receiver_id", ASCENDING), ("sender_id", ASCENDING)]),
+    ],
+    "group_messages": [
+        IndexModel([("group_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "groups": [
+        IndexModel([("id", ASCENDING)]),
+        IndexModel([("members", ASCENDING)]),  # multikey
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True),
+    ],
+    "changes": [
+        IndexModel([("audience", ASCENDING), ("seq", ASCENDING)]),  # multikey
+        IndexModel([("seq", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING)]),  # pruned by prune_changes, not a TTL index
+    ],
+    "inbox": [
+        IndexModel([("user_id", ASCENDING), ("key", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("updated_at", ASCENDING), ("key", ASCENDING)]),
+        IndexModel([("last_message_id", ASCENDING)]),
+    ],
+}
+
+# Representative query per hot access path, explained by index_report
+INDEX_PROBES = {
+    "messages": [({"conversation_id": "a:b"}, [("timestamp", -1), ("_id", -1)]),
+                 ({"sender_id": "a"}, None), ({"receiver_id": "a"}, None)],
+    "group_messages": [({"group_id": "g"}, [("timestamp", -1), ("_id", -1)])],
+    "groups": [({"id": "g"}, None), ({"members": "a"}, None)],
+    "users": [({"username": "a"}, None), ({"username": {"$regex": "^a"}}, [("username", 1)])],
+    "changes": [({"audience": "a", "seq": {"$gt": 0}}, [("seq", 1)])],
+    "inbox": [({"user_id": "a"}, [("updated_at", -1), ("key", -1)]), ({"last_message_id": "m"}, None)],
+}
+
+# Fields history reads never send to the client; deleted_by is filtered
+# server-side for the viewer, so other users' entries are not exposed
+HISTORY_PROJECTION = {"conversation_id": 0, "group_id": 0, "deleted_by": 0}
+
+GROUP_CACHE_SIZE = int(os.getenv("GROUP_CACHE_SIZE", "4096"))
+GROUP_CACHE_TTL = float(os.getenv("GROUP_CACHE_TTL", "30"))
+
+DIRECTORY_CACHE_SIZE = int(os.getenv("DIRECTORY_CACHE_SIZE", "512"))
+DIRECTORY_CACHE_TTL = float(os.getenv("DIRECTORY_CACHE_TTL", "60"))
+
+def page_query(query: dict, before: Optional[str], after: Optional[str], datetime_timestamps: bool = True) -> tuple:
+    """Extend ``query`` with a cursor bound.
+
+    Returns ``(query, sort_direction)``. Pages without ``after`` are read
+    newest-first (the latest page, or the one just older than ``before``) and
+    must be reversed by the caller to keep history in ascending order.
+    """
+    if before and after:
+        raise ValueError("Use either before or after, not both")
+    cursor = before or after
+    if not cursor:
+        return query, -1
+    timestamp, object_id = decode_cursor(cursor, datetime_timestamps)
+    op = "$lt" if before else "$gt"
+    bound = {"$or": [
+        {"timestamp": {op: timestamp}},
+        {"timestamp": timestamp, "_id": {op: object_id}},
+    ]}
+    return {"$and": [query, bound]}, (-1 if before else 1)
+
+class GroupCache:
+    """Size-bounded LRU of group documents with a TTL.
+
+    Each entry also keeps the member list as a frozenset for O(1) membership
+    checks. Writes made through this process update the entry directly; the
+    TTL bounds staleness for writes made by other workers.
+    """
+
+    def __init__(self, maxsize: int = GROUP_CACHE_SIZE, ttl: float = GROUP_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, group_id: str) -> Optional[tuple]:
+        """Return ``(group, members)`` or None on a miss or expired entry."""
+        entry = self._entries.get(group_id)
+        if entry is None or entry[2] < time.monotonic():
+            if entry is not None:
+                del self._entries[group_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(group_id)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, group: Group):
+        self._entries[group.id] = (group, frozenset(group.members), time.monotonic() + self.ttl)
+        self._entries.move_to_end(group.id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, group_id: str):
+        self._entries.pop(group_id, None)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+class DirectoryCache:
+    """LRU of user directory pages keyed by ``(prefix, after, limit)``.
+
+    Cleared whenever a user registers through this process; the TTL bounds
+    staleness for registrations handled by other workers.
+    """
+
+    def __init__(self, maxsize: int = DIRECTORY_CACHE_SIZE, ttl: float = DIRECTORY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[List[str]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: tuple, usernames: List[str]):
+        self._entries[key] = (usernames, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+@instrument(db_operations)
 class Database:
+    """MongoDB storage backend (see ``app.services.storage``)."""
+
     def __init__(self, url: str = None):
         load_dotenv()
         mongo_url = url or os.getenv("MONGO_URI")
         self.client = AsyncIOMotorClient(mongo_url)
         self.db = self.client.chat_app
+        self.group_cache = GroupCache()
+        self.directory_cache = DirectoryCache()
+        self.recent = RecentMessages()
+        # Optional group commit for message inserts
+        self.batcher = WriteBatcher(self.db) if os.getenv("WRITE_BATCHING") == "1" else None
+
+    async def _insert(self, collection: str, doc: dict) -> ObjectId:
+        if self.batcher is not None:
+            return await self.batcher.insert(collection, doc)
+        result = await self.db[collection].insert_one(doc)
+        return result.inserted_id
+
+    async def close(self):
+        """Flush batched writes; call on shutdown."""
+        if self.batcher is not None:
+            await self.batcher.flush()
+
+    def cache_stats(self) -> Dict[str, dict]:
+        return {"group": self.group_cache.stats(), "directory": self.directory_cache.stats(),
+                "recent": self.recent.stats()}
+
+    # --- USERS ---
+    async def get_user(self, username: str) -> Optional[dict]:
+        return await self.db.users.find_one({"username": username})
+
+    async def create_user(self, username: str, password_hash: str, pin: str) -> str:
+        try:
+            result = await self.db.users.insert_one(
+                {"username": username, "password_hash": password_hash, "pin": pin}
+            )
+        except DuplicateKeyError:
+            raise ValueError("Username already exists")
+        self.directory_cache.clear()
+        return str(result.inserted_id)
+
+    async def set_password_hash(self, username: str, password_hash: str, expected: Optional[str] = None) -> bool:
+        """Replace the stored hash; with ``expected``, only if it is still that value."""
+        query = {"username": username}
+        if expected is not None:
+            query["password_hash"] = expected
+        result = await self.db.users.update_one(query, {"$set": {"password_hash": password_hash}})
+        return result.matched_count == 1
 
     async def save_message(self, message: Message) -> MessageInDB:
         try:
@@ -24,10 +236,13 @@ class Database:
             # Ensure proper initialization of arrays
             message_dict.setdefault("likes", [])
             message_dict.setdefault("deleted_by", [])
+            message_dict["conversation_id"] = make_conversation_id(message.sender_id, message.receiver_id)
             
             # Insert the message
-            result = await self.db.messages.insert_one(message_dict)
-            message_dict["_id"] = str(result.inserted_id)
+            message_dict["_id"] = str(await self._insert("messages", message_dict))
+            stored = {**message_dict, "timestamp": _bson_datetime(message_dict["timestamp"])}
+            self.recent.add(self._recent_key(message_dict, False), stored)
+            await self._deliver(stored, False)
             
             # Return the saved message with its ID
             return MessageInDB(**message_dict)
@@ -35,135 +250,191 @@ class Database:
             logger.error(f"Error saving message: {str(e)}")
             raise
 
-    async def get_messages(self, user_id: str, other_user_id: str) -> List[MessageInDB]:
+    async def get_messages(self, user_id: str, other_user_id: str, before: Optional[str] = None,
+                           after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> List[MessageInDB]:
+        """One page of a conversation as seen by ``user_id``, oldest first."""
         try:
-            cursor = self.db.messages.find({
-                "$or": [
-                    {"sender_id": user_id, "receiver_id": other_user_id},
-                    {"sender_id": other_user_id, "receiver_id": user_id}
-                ]
-            }).sort("timestamp", 1)
-            
-            messages = []
-            async for document in cursor:
-                # Check if message is globally deleted or personally deleted
-                deleted_by = document.get("deleted_by", [])
-                if "*" not in deleted_by and user_id not in deleted_by:
-                    document["_id"] = str(document["_id"])
-                    messages.append(MessageInDB(**document))
-            return messages
+            return await self._read_history(
+                self.db.messages, {"conversation_id": make_conversation_id(user_id, other_user_id)},
+                MessageInDB, user_id, before, after, limit,
+                cache_key=("dm", make_conversation_id(user_id, other_user_id)),
+            )
         except Exception as e:
             logger.error(f"Error retrieving messages: {str(e)}")
             raise
 
-    async def toggle_like(self, message_id: str, user_id: str, is_group_message: bool = False) -> Union[MessageInDB, GroupMessage]:
-        try:
-            # Convert string ID to ObjectId
-            object_id = ObjectId(message_id)
-            
-            # Choose the correct collection
-            collection = self.db.group_messages if is_group_message else self.db.messages
-            
-            # Find the message
-            message = await collection.find_one({"_id": object_id})
-            if not message:
-                logger.error(f"Message {message_id} not found")
-                raise ValueError("Message not found")
+    def _message_collection(self, is_group_message: bool):
+        return self.db.group_messages if is_group_message else self.db.messages
 
-            # Check if message is deleted
-            deleted_by = message.get("deleted_by", [])
-            if "*" in deleted_by or user_id in deleted_by:
-                logger.error(f"Cannot like deleted message {message_id}")
-                raise ValueError("Cannot like deleted message")
+    @staticmethod
+    def _as_message(doc: dict, is_group_message: bool) -> Union[MessageInDB, GroupMessage]:
+        doc["_id"] = str(doc["_id"])
+        return GroupMessage(**doc) if is_group_message else MessageInDB(**doc)
 
-            likes = message.get("likes", [])
-            if user_id in likes:
-                likes.remove(user_id)
-            else:
-                likes.append(user_id)
+    @staticmethod
+    def _recent_key(doc: dict, is_group_message: bool) -> tuple:
+        if is_group_message:
+            return "group", doc["group_id"]
+        return "dm", doc.get("conversation_id") or make_conversation_id(doc["sender_id"], doc["receiver_id"])
 
-            # Update the message
-            await collection.update_one(
-                {"_id": object_id},
-                {"$set": {"likes": likes}}
-            )
+    def _updated(self, doc: dict, is_group_message: bool) -> Union[MessageInDB, GroupMessage]:
+        # A like/delete result: refresh the recent window, then build the model
+        message = self._as_message(doc, is_group_message)
+        self.recent.update(self._recent_key(doc, is_group_message), doc)
+        return message
+
+    async def _explain_missing(self, collection, object_id: ObjectId, message_id: str, action: str):
+        # Only reached when the atomic update matched nothing
+        if await collection.find_one({"_id": object_id}, {"_id": 1}) is None:
+            logger.error(f"Message {message_id} not found")
+            raise ValueError("Message not found")
+        logger.error(f"Cannot {action} deleted message {message_id}")
+        raise ValueError(f"Cannot {action} deleted message")
 
-            message["likes"] = likes
-            message["_id"] = str(message["_id"])
-            return GroupMessage(**message) if is_group_message else MessageInDB(**message)
+    async def toggle_like(self, message_id: str, user_id: str, is_group_message: bool = False) -> Union[MessageInDB, GroupMessage]:
+        """Add or remove ``user_id``'s like in one atomic round trip."""
+        try:
+            object_id = ObjectId(message_id)
+            collection = self._message_collection(is_group_message)
+            likes = {"$ifNull": ["$likes", []]}
+            message = await collection.find_one_and_update(
+                {"_id": object_id, "deleted_by": {"$nin": ["*", user_id]}},
+                [{"$set": {"likes": {"$cond": [
+                    {"$in": [user_id, likes]},
+                    {"$filter": {"input": likes, "cond": {"$ne": ["$$this", user_id]}}},
+                    {"$concatArrays": [likes, [user_id]]},
+                ]}}}],
+                return_document=ReturnDocument.AFTER,
+            )
+            if message is None:
+                await self._explain_missing(collection, object_id, message_id, "like")
+            return self._updated(message, is_group_message)
             
         except Exception as e:
             logger.error(f"Error toggling like for message {message_id}: {str(e)}")
             raise
 
     async def delete_message(self, message_id: str, user_id: str, is_group_message: bool = False) -> Union[MessageInDB, GroupMessage]:
+        """Delete in one atomic round trip.
+
+        The sender deletes for everyone: the message becomes a tombstone with
+        ``deleted_by == ["*"]`` and its content and likes cleared. Anyone else
+        hides it for themselves and drops their like. Tombstones stay until
+        the ``purge_tombstones`` migration removes them (see
+        ``app.services.migrations``).
+        """
         try:
-            # Convert string ID to ObjectId
             object_id = ObjectId(message_id)
-            
-            # Choose the correct collection
-            collection = self.db.group_messages if is_group_message else self.db.messages
-            
-            # Find the message
-            message = await collection.find_one({"_id": object_id})
-            if not message:
+            collection = self._message_collection(is_group_message)
+            # The previous state tells whether this call made the tombstone;
+            # apply_delete gives the same result as the pipeline
+            message = await collection.find_one_and_update(
+                {"_id": object_id}, _delete_pipeline(user_id), return_document=ReturnDocument.BEFORE
+            )
+            if message is None:
                 logger.error(f"Message {message_id} not found")
                 raise ValueError("Message not found")
-
-            deleted_by = message.get("deleted_by", [])
-            likes = message.get("likes", [])
-            
-            # If the user is the sender, delete for everyone
-            if message["sender_id"] == user_id:
-                logger.info(f"Sender {user_id} deleting message {message_id} for everyone")
-                # Delete the message completely
-                await collection.delete_one({"_id": object_id})
-                message["deleted_by"] = ["*"]  # Mark as globally deleted for the response
-            else:
-                # If receiver wants to delete just for themselves
-                if user_id not in deleted_by:
-                    logger.info(f"Receiver {user_id} deleting message {message_id} for themselves")
-                    deleted_by.append(user_id)
-                    
-                    # Remove user's like if they had liked the message
-                    if user_id in likes:
-                        likes.remove(user_id)
-                        logger.info(f"Removed like from user {user_id} for message {message_id}")
-                    
-                    await collection.update_one(
-                        {"_id": object_id},
-                        {"$set": {
-                            "deleted_by": deleted_by,
-                            "likes": likes
-                        }}
-                    )
-                    message["deleted_by"] = deleted_by
-                    message["likes"] = likes
-
-            message["_id"] = str(message["_id"])
-            return GroupMessage(**message) if is_group_message else MessageInDB(**message)
+            tombstoned = apply_delete(message, user_id)
+            logger.info(f"User {user_id} deleted message {message_id} (deleted_by={message.get('deleted_by')})")
+            await self._inbox_deleted(message, user_id, is_group_message, tombstoned)
+            return self._updated(message, is_group_message)
             
         except Exception as e:
             logger.error(f"Error deleting message {message_id}: {str(e)}")
             raise
 
+    async def apply_reactions(self, user_id: str, reactions: List[dict]) -> List[Union[MessageInDB, GroupMessage]]:
+        """Apply many queued reactions, e.g. replayed by a client after reconnecting.
+
+        Each reaction is ``{"message_id", "action", "is_group"}`` with action
+        ``like``, ``unlike`` or ``delete``. Likes are explicit set/unset rather
+        than toggles so replaying the same queue twice is harmless. Costs one
+        ``bulk_write`` plus one read per collection; returns the updated
+        messages (unknown or malformed IDs are skipped).
+        """
+        by_collection: Dict[bool, Dict[ObjectId, list]] = {False: {}, True: {}}
+        deleted = set()
+        for reaction in reactions:
+            try:
+                object_id = ObjectId(reaction.get("message_id"))
+            except (InvalidId, TypeError):
+                continue
+            action = reaction.get("action")
+            if action == "like":
+                update = {"$addToSet": {"likes": user_id}}
+                query = {"_id": object_id, "deleted_by": {"$nin": ["*", user_id]}}
+            elif action == "unlike":
+                update = {"$pull": {"likes": user_id}}
+                query = {"_id": object_id}
+            elif action == "delete":
+                update = _delete_pipeline(user_id)
+                query = {"_id": object_id}
+                deleted.add(object_id)
+            else:
+                continue
+            by_collection[bool(reaction.get("is_group"))].setdefault(object_id, []).append(UpdateOne(query, update))
+
+        updated = []
+        for is_group_message, ops_by_id in by_collection.items():
+            if not ops_by_id:
+                continue
+            collection = self._message_collection(is_group_message)
+            # Tombstones from before the replay must not be counted again
+            deleting = [object_id for object_id in ops_by_id if object_id in deleted]
+            tombstones = set()
+            if deleting:
+                tombstones = {doc["_id"] async for doc in collection.find(
+                    {"_id": {"$in": deleting}, "deleted_by": "*"}, {"_id": 1})}
+            # ordered=True keeps per-message reactions in the order they were queued
+            await collection.bulk_write([op for ops in ops_by_id.values() for op in ops], ordered=True)
+            async for doc in collection.find({"_id": {"$in": list(ops_by_id)}}):
+                if doc["_id"] in deleted:
+                    tombstoned = doc["_id"] not in tombstones and "*" in (doc.get("deleted_by") or [])
+                    await self._inbox_deleted(doc, user_id, is_group_message, tombstoned)
+                updated.append(self._updated(doc, is_group_message))
+        return updated
+
     # --- GROUPS ---
     async def create_group(self, group: Group) -> Group:
         group_dict = group.model_dump()
         result = await self.db.groups.insert_one(group_dict)
         group_dict["_id"] = str(result.inserted_id)
-        return Group(**group_dict)
+        saved = Group(**group_dict)
+        self.group_cache.put(saved)
+        return saved
 
-    async def get_group(self, group_id: str) -> Group:
+    async def _load_group(self, group_id: str) -> Optional[tuple]:
+        cached = self.group_cache.get(group_id)
+        if cached is not None:
+            return cached
         doc = await self.db.groups.find_one({"id": group_id})
         if not doc:
             return None
-        return Group(**doc)
+        self.group_cache.put(Group(**doc))
+        return self.group_cache.get(group_id)
+
+    async def get_group(self, group_id: str) -> Group:
+        cached = await self._load_group(group_id)
+        if cached is None:
+            return None
+        # Callers mutate the returned group before update_group; keep the cache intact
+        return cached[0].model_copy(deep=True)
+
+    async def get_group_members(self, group_id: str) -> Optional[FrozenSet[str]]:
+        """Member set of a group (cached), or None if it does not exist."""
+        cached = await self._load_group(group_id)
+        return cached[1] if cached is not None else None
 
     async def update_group(self, group_id: str, update: dict) -> Group:
-        await self.db.groups.update_one({"id": group_id}, {"$set": update})
-        doc = await self.db.groups.find_one({"id": group_id})
-        return Group(**doc)
+        doc = await self.db.groups.find_one_and_update(
+            {"id": group_id}, {"$set": update}, return_document=ReturnDocument.AFTER
+        )
+        if not doc:
+            self.group_cache.invalidate(group_id)
+            return None
+        group = Group(**doc)
+        self.group_cache.put(group)
+        return group
 
     async def get_user_groups(self, username: str) -> list:
         cursor = self.db.groups.find({"members": username})
@@ -172,19 +443,328 @@ class Database:
             groups.append(Group(**doc))
         return groups
 
+    async def get_contacts(self, username: str) -> set:
+        """Users who share a conversation or a group with ``username``."""
+        contacts = set()
+        async for doc in self.db.groups.find({"members": username}, {"members": 1, "_id": 0}):
+            contacts.update(doc.get("members", []))
+        contacts.update(await self.db.messages.distinct("receiver_id", {"sender_id": username}))
+        contacts.update(await self.db.messages.distinct("sender_id", {"receiver_id": username}))
+        contacts.discard(username)
+        return contacts
+
+    # --- USER DIRECTORY ---
+    @staticmethod
+    def _directory_query(prefix: str, after: Optional[str]) -> dict:
+        # Anchored, escaped regex on the indexed field becomes an index range scan
+        query = {}
+        if prefix:
+            query["$regex"] = "^" + re.escape(prefix)
+        if after:
+            query["$gt"] = after
+        return {"username": query} if query else {}
+
+    async def search_users(self, prefix: str = "", after: Optional[str] = None,
+                           limit: int = DEFAULT_PAGE_SIZE) -> List[str]:
+        """One page of usernames starting with ``prefix``, in username order.
+
+        ``after`` is the last username of the previous page. Pages are
+        cached in ``directory_cache``.
+        """
+        prefix = prefix.strip().lower()
+        key = (prefix, after, limit)
+        cached = self.directory_cache.get(key)
+        if cached is not None:
+            return cached
+        cursor = self.db.users.find(
+            self._directory_query(prefix, after), {"username": 1, "_id": 0}
+        ).sort("username", ASCENDING).limit(limit)
+        usernames = [doc["username"] async for doc in cursor]
+        self.directory_cache.put(key, usernames)
+        return usernames
+
+    async def iter_usernames(self, prefix: str = "", batch_size: int = 1000) -> AsyncIterator[str]:
+        """Every matching username in order, fetched in batches (for exports)."""
+        cursor = self.db.users.find(
+            self._directory_query(prefix.strip().lower(), None), {"username": 1, "_id": 0}
+        ).sort("username", ASCENDING).batch_size(batch_size)
+        async for doc in cursor:
+            yield doc["username"]
+
     # --- GROUP MESSAGES ---
     async def save_group_message(self, message: GroupMessage) -> GroupMessage:
         msg_dict = message.model_dump()
-        result = await self.db.group_messages.insert_one(msg_dict)
-        msg_dict["_id"] = str(result.inserted_id)
+        msg_dict["_id"] = str(await self._insert("group_messages", msg_dict))
+        self.recent.add(self._recent_key(msg_dict, True), msg_dict)
+        await self._deliver(msg_dict, True, await self.get_group_members(message.group_id) or ())
         return GroupMessage(**msg_dict)
 
-    async def get_group_messages(self, group_id: str) -> list:
-        cursor = self.db.group_messages.find({"group_id": group_id}).sort("timestamp", 1)
+    async def get_group_messages(self, group_id: str, viewer: Optional[str] = None, before: Optional[str] = None,
+                                 after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> list:
+        """One page of a group's history, oldest first, hiding ``viewer``'s own deletes."""
+        return await self._read_history(
+            self.db.group_messages, {"group_id": group_id}, GroupMessage, viewer, before, after, limit,
+            datetime_timestamps=False, fill={"group_id": group_id}, cache_key=("group", group_id),
+        )
+
+    async def _read_history(self, collection, query: dict, model, viewer: Optional[str], before: Optional[str],
+                            after: Optional[str], limit: int, datetime_timestamps: bool = True,
+                            fill: Optional[dict] = None, cache_key: Optional[tuple] = None) -> list:
+        """Shared history read for direct and group messages.
+
+        Messages deleted for everyone or by ``viewer`` are excluded by the
+        query itself, so they are never transferred or parsed. Fields the
+        client already knows (the conversation/group key) or no longer needs
+        (``deleted_by``: it may still list other users who hid the message,
+        but that filtering is done here for ``viewer``) are projected away; ``fill`` puts back required model fields.
+        See ``page_query`` for cursors. Pages inside the recent window of
+        ``cache_key`` are served from ``self.recent`` without a query.
+        """
+        hidden = ["*", viewer] if viewer else ["*"]
+        base_query = query
+        query, direction = page_query({**query, "deleted_by": {"$nin": hidden}}, before, after, datetime_timestamps)
+        if cache_key is not None and self.recent.enabled:
+            before_key = decode_cursor(before, datetime_timestamps) if before else None
+            after_key = decode_cursor(after, datetime_timestamps) if after else None
+            docs = self.recent.page(cache_key, viewer, before_key, after_key, limit)
+            if docs is None and not before and not after and limit <= self.recent.window:
+                # Latest page of a conversation without a window: load one
+                await self._seed_recent(collection, base_query, cache_key)
+                docs = self.recent.page(cache_key, viewer, None, None, limit)
+            if docs is not None:
+                return [model(**{**{k: v for k, v in doc.items() if k not in HISTORY_PROJECTION}, **(fill or {})})
+                        for doc in docs]
+        cursor = collection.find(query, HISTORY_PROJECTION).sort(
+            [("timestamp", direction), ("_id", direction)]
+        ).limit(limit)
         messages = []
         async for doc in cursor:
             doc["_id"] = str(doc["_id"])  # Ensure _id is included as a string
-            messages.append(GroupMessage(**doc))  # Parse as GroupMessage
+            if fill:
+                doc.update(fill)
+            messages.append(model(**doc))
+        if direction == -1:
+            messages.reverse()
         return messages
 
-db = Database() 
\ No newline at end of file
+    async def _seed_recent(self, collection, query: dict, cache_key: tuple):
+        # One extra document tells whether anything older exists
+        window = self.recent.window
+        self.recent.begin_seed(cache_key)
+        try:
+            docs = await collection.find(query).sort([("timestamp", -1), ("_id", -1)]).limit(window + 1).to_list(window + 1)
+        except BaseException:
+            self.recent.end_seed(cache_key)
+            raise
+        for doc in docs:
+            doc["_id"] = str(doc["_id"])
+        self.recent.seed(cache_key, docs[:window], has_older=len(docs) > window)
+
+    # --- CHANGE LOG ---
+    async def reserve_change_seqs(self, writer_id: str, count: int) -> int:
+        """Reserve ``count`` consecutive seqs for ``writer_id``; returns the first.
+
+        The writer's floor is registered before the counter moves, at a bound
+        no reserved seq can be below, so ``change_watermark`` never passes it.
+        """
+        counter = await self.db.counters.find_one({"_id": "changes"})
+        await self.db.change_writers.update_one(
+            {"_id": writer_id},
+            {"$set": {"floor": (counter["seq"] if counter else 0) + 1,
+                      "expires_at": datetime.utcnow() + timedelta(seconds=CHANGE_WRITER_LEASE)}},
+            upsert=True,
+        )
+        counter = await self.db.counters.find_one_and_update(
+            {"_id": "changes"}, {"$inc": {"seq": count}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"] - count + 1
+
+    async def write_changes(self, writer_id: str, entries: List[dict], floor: Optional[int]):
+        """Store ``entries``, then move the writer's floor (None releases its block)."""
+        if entries:
+            try:
+                await self.db.changes.insert_many(entries, ordered=False)
+            except BulkWriteError as e:
+                # A retried batch: entries already stored are fine
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+        if floor is None:
+            await self.db.change_writers.delete_one({"_id": writer_id})
+        else:
+            await self.db.change_writers.update_one({"_id": writer_id}, {"$set": {
+                "floor": floor, "expires_at": datetime.utcnow() + timedelta(seconds=CHANGE_WRITER_LEASE),
+            }}, upsert=True)
+
+    async def change_watermark(self) -> int:
+        """Highest seq below which every entry is committed."""
+        # The counter is read first: a writer registering after this read
+        # only ever gets seqs above it
+        counter = await self.db.counters.find_one({"_id": "changes"})
+        watermark = counter["seq"] if counter else 0
+        async for writer in self.db.change_writers.find({"expires_at": {"$gt": datetime.utcnow()}}, {"floor": 1}):
+            watermark = min(watermark, writer["floor"] - 1)
+        return watermark
+
+    async def get_changes(self, user_id: str, since: int, upto: int, limit: int) -> Optional[List[dict]]:
+        """Up to ``limit`` of ``user_id``'s changes in ``(since, upto]``, each its
+        payload plus ``seq``; None if entries after ``since`` were pruned."""
+        counter = await self.db.counters.find_one({"_id": "changes"})
+        if since < (counter or {}).get("pruned", 0):
+            return None
+        cursor = self.db.changes.find(
+            {"audience": user_id, "seq": {"$gt": since, "$lte": upto}}, {"seq": 1, "payload": 1, "_id": 0}
+        ).sort("seq", ASCENDING).limit(limit)
+        return [{**doc["payload"], "seq": doc["seq"]} async for doc in cursor]
+
+    async def prune_changes(self, before: datetime):
+        """Drop entries created before ``before``, recording the highest seq dropped first."""
+        newest = await self.db.changes.find_one({"created_at": {"$lt": before}}, {"seq": 1},
+                                                sort=[("seq", -1)])
+        if newest is None:
+            return
+        await self.db.counters.update_one({"_id": "changes"}, {"$max": {"pruned": newest["seq"]}}, upsert=True)
+        await self.db.changes.delete_many({"seq": {"$lte": newest["seq"]}})
+
+    # --- INBOX ---
+    async def _deliver(self, doc: dict, is_group_message: bool, members=()):
+        """Bring the participants' inbox entries up to date with a new message."""
+        fields, targets = inbox_deliveries(doc, is_group_message, members)
+        ops = [
+            UpdateOne(
+                {"user_id": user_id, "key": inbox_key(chat_id, is_group_message)},
+                {"$set": {**fields, "chat_id": chat_id, "is_group": is_group_message}, "$inc": {"unread": unread}},
+                upsert=True,
+            )
+            for user_id, chat_id, unread in targets
+        ]
+        try:
+            await self.db.inbox.bulk_write(ops, ordered=False)
+        except Exception as e:
+            # The message itself is stored; only its inbox summary is stale
+            logger.error(f"Error updating inboxes for message {doc['_id']}: {e}")
+
+    async def _inbox_deleted(self, doc: dict, user_id: str, is_group_message: bool, tombstoned: bool):
+        try:
+            if tombstoned:
+                members = (await self.get_group_members(doc["group_id"]) or ()) if is_group_message else ()
+                sent_at, targets = inbox_unread_targets(doc, is_group_message, members)
+                if targets:
+                    await self.db.inbox.bulk_write([UpdateOne(
+                        {"user_id": owner, "key": key, "unread": {"$gt": 0},
+                         "$or": [{"read_at": None}, {"read_at": {"$lt": sent_at}}]},
+                        {"$inc": {"unread": -1}},
+                    ) for owner, key in targets], ordered=False)
+            # Wherever this was the latest message, show the newest one still
+            # visible: for everyone after a sender's delete, otherwise only
+            # for the user who hid it
+            everyone = "*" in (doc.get("deleted_by") or [])
+            query = {"last_message_id": str(doc["_id"])}
+            if not everyone:
+                query["user_id"] = user_id
+            if await self.db.inbox.find_one(query, {"_id": 1}) is None:
+                return
+            _, chat_id = self._recent_key(doc, is_group_message)
+            latest = await self._message_collection(is_group_message).find_one(
+                {"group_id" if is_group_message else "conversation_id": chat_id,
+                 "deleted_by": {"$nin": ["*"] if everyone else ["*", user_id]}},
+                sort=[("timestamp", -1), ("_id", -1)],
+            )
+            await self.db.inbox.update_many(query, {"$set": inbox_preview(latest)})
+        except Exception as e:
+            logger.error(f"Error updating inboxes for deleted message {doc['_id']}: {e}")
+
+    async def get_inbox(self, user_id: str, before: Optional[str] = None,
+                        limit: int = DEFAULT_PAGE_SIZE) -> List[InboxEntry]:
+        """One page of ``user_id``'s chats, most recently active first."""
+        query = {"user_id": user_id}
+        if before:
+            updated_at, key = decode_inbox_cursor(before)
+            query["$or"] = [{"updated_at": {"$lt": updated_at}}, {"updated_at": updated_at, "key": {"$lt": key}}]
+        cursor = self.db.inbox.find(query, {"_id": 0}).sort([("updated_at", -1), ("key", -1)]).limit(limit)
+        return [InboxEntry(**doc) async for doc in cursor]
+
+    async def mark_read(self, user_id: str, chat_id: str, is_group: bool = False) -> Optional[InboxEntry]:
+        doc = await self.db.inbox.find_one_and_update(
+            {"user_id": user_id, "key": inbox_key(chat_id, is_group)},
+            {"$set": {"unread": 0, "read_at": datetime.utcnow()}},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+        )
+        return InboxEntry(**doc) if doc else None
+
+    async def get_inbox_entries(self, chats: Dict[str, str], is_group: bool) -> Dict[str, InboxEntry]:
+        """``user_id -> chat_id`` in, each user's entry for that chat out (missing ones left out)."""
+        if not chats:
+            return {}
+        cursor = self.db.inbox.find({"$or": [
+            {"user_id": user_id, "key": inbox_key(chat_id, is_group)} for user_id, chat_id in chats.items()
+        ]}, {"_id": 0})
+        return {doc["user_id"]: InboxEntry(**doc) async for doc in cursor}
+
+    # --- INDEXES ---
+    async def ensure_indexes(self):
+        """Create every index in ``INDEXES``; existing ones are left alone.
+
+        A failure (e.g. duplicate usernames blocking the unique index) is
+        logged and does not stop the remaining indexes or startup.
+        """
+        for collection, models in INDEXES.items():
+            for model in models:
+                try:
+                    await self.db[collection].create_indexes([model])
+                except OperationFailure as e:
+                    logger.error(f"Could not create index {model.document['key']} on {collection}: {e}")
+
+    async def index_report(self) -> dict:
+        """Missing and unused indexes plus the query plan of each probe."""
+        report = {}
+        for collection, models in INDEXES.items():
+            coll = self.db[collection]
+            existing = await coll.index_information()
+            existing_keys = {tuple(info["key"]): name for name, info in existing.items()}
+            missing = [
+                model.document["name"] for model in models
+                if tuple(model.document["key"].items()) not in existing_keys
+            ]
+            usage = await coll.aggregate([{"$indexStats": {}}]).to_list(length=None)
+            unused = [u["name"] for u in usage if u["name"] != "_id_" and u["accesses"]["ops"] == 0]
+            plans = []
+            for query, sort in INDEX_PROBES.get(collection, []):
+                cursor = coll.find(query)
+                if sort:
+                    cursor = cursor.sort(sort)
+                explain = await cursor.explain()
+                winning = explain["queryPlanner"]["winningPlan"]
+                # Slot-based engine nests the classic plan under queryPlan
+                plans.append({"query": query, "plan": _summarize_plan(winning.get("queryPlan", winning))})
+            report[collection] = {"missing": missing, "unused": unused, "plans": plans}
+        return report
+
+def _delete_pipeline(user_id: str) -> list:
+    """Update pipeline shared by delete_message and apply_reactions."""
+    is_sender = {"$eq": ["$sender_id", user_id]}
+    return [{"$set": {
+        "deleted_by": {"$cond": [
+            is_sender, ["*"], {"$setUnion": [{"$ifNull": ["$deleted_by", []]}, [user_id]]},
+        ]},
+        "likes": {"$cond": [
+            is_sender, [], {"$filter": {"input": {"$ifNull": ["$likes", []]}, "cond": {"$ne": ["$$this", user_id]}}},
+        ]},
+        "content": {"$cond": [is_sender, "", "$content"]},
+    }}]
+
+def _bson_datetime(value: datetime) -> datetime:
+    """``value`` at the millisecond precision MongoDB stores."""
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+def _summarize_plan(plan: dict) -> str:
+    """Flatten a winning plan into e.g. ``FETCH <- IXSCAN(members_1)``."""
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if "indexName" in plan:
+            stage += f"({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return " <- ".join(stages)
+
+db = create_storage()
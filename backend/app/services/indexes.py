@@ -0,0 +1,34 @@
+"""Index maintenance commands.
+
+Run from the backend directory::
+
+    python -m app.services.indexes report   # missing/unused indexes and query plans
+    python -m app.services.indexes apply    # create everything in INDEXES
+"""
+import argparse
+import asyncio
+import logging
+
+from app.services.database import db
+
+
+async def report():
+    result = await db.index_report()
+    for collection, info in result.items():
+        print(f"{collection}:")
+        print(f"  missing: {', '.join(info['missing']) or '-'}")
+        print(f"  unused:  {', '.join(info['unused']) or '-'}")
+        for probe in info["plans"]:
+            print(f"  {probe['query']}: {probe['plan']}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Inspect or apply storage indexes")
+    parser.add_argument("command", choices=["report", "apply"])
+    args = parser.parse_args()
+    asyncio.run(report() if args.command == "report" else db.ensure_indexes())
+
+
+if __name__ == "__main__":
+    main()
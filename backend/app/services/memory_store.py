@@ -0,0 +1,423 @@
+"""In-memory storage backend (``STORAGE_BACKEND=memory``).
+
+Keeps the same indexes the Mongo backend relies on, as plain structures:
+each conversation and each group has a list of message keys sorted by
+``(timestamp, ObjectId)``, so a history page is a bisect plus a short
+scan; groups are indexed by member and direct messages by participant,
+usernames are kept sorted for prefix search, and each user's inbox is kept
+sorted by recency. Everything lives in this
+process and is lost on restart.
+"""
+import bisect
+import time
+from datetime import datetime
+from collections import defaultdict, deque
+from typing import AsyncIterator, Dict, FrozenSet, List, Optional, Set, Tuple, Union
+
+from bson import ObjectId
+
+from app.metrics import db_operations, instrument
+from app.models.group_pydantic import Group, GroupMessage
+from app.models.inbox import InboxEntry
+from app.models.message import Message, MessageInDB, make_conversation_id
+from app.services.storage import (
+    CHANGE_WRITER_LEASE, DEFAULT_PAGE_SIZE, apply_delete, decode_cursor, apply_like, decode_inbox_cursor, inbox_deliveries, inbox_key,
+    inbox_preview, inbox_unread_targets, is_hidden,
+)
+
+# History reads leave these out, like HISTORY_PROJECTION in the Mongo backend
+_HISTORY_OMIT = ("conversation_id", "deleted_by")
+
+
+class _ChangeIndex:
+    """One user's change log entries, indexed by seq.
+
+    Writers commit out of order, so seqs are kept sorted with ``insort``;
+    reads bisect to ``since`` and pruning cuts a prefix.
+    """
+
+    __slots__ = ("seqs", "payloads")
+
+    def __init__(self):
+        self.seqs: List[int] = []
+        self.payloads: List[dict] = []
+
+    def add(self, seq: int, payload: dict):
+        if not self.seqs or seq > self.seqs[-1]:
+            self.seqs.append(seq)
+            self.payloads.append(payload)
+        else:
+            i = bisect.bisect_left(self.seqs, seq)
+            self.seqs.insert(i, seq)
+            self.payloads.insert(i, payload)
+
+    def read(self, since: int, upto: int, limit: int) -> List[dict]:
+        start = bisect.bisect_right(self.seqs, since)
+        end = min(bisect.bisect_right(self.seqs, upto), start + limit)
+        return [{**self.payloads[i], "seq": self.seqs[i]} for i in range(start, end)]
+
+    def prune(self, upto: int):
+        cut = bisect.bisect_right(self.seqs, upto)
+        del self.seqs[:cut]
+        del self.payloads[:cut]
+
+
+class _History:
+    """Message keys of one conversation or group, sorted by ``(timestamp, ObjectId)``."""
+
+    __slots__ = ("keys",)
+
+    def __init__(self):
+        self.keys: List[Tuple] = []
+
+    def add(self, key: Tuple):
+        # Almost always the newest message, so this is an append in practice
+        if not self.keys or key > self.keys[-1]:
+            self.keys.append(key)
+        else:
+            bisect.insort(self.keys, key)
+
+    def page(self, docs: Dict[str, dict], viewer: Optional[str], before: Optional[Tuple],
+             after: Optional[Tuple], limit: int) -> List[dict]:
+        """Up to ``limit`` visible docs, oldest first (see ``page_query``)."""
+        found = []
+        if after is not None:
+            for key in self.keys[bisect.bisect_right(self.keys, after):]:
+                doc = docs[str(key[1])]
+                if not is_hidden(doc, viewer):
+                    found.append(doc)
+                    if len(found) == limit:
+                        break
+            return found
+        end = bisect.bisect_left(self.keys, before) if before is not None else len(self.keys)
+        for i in range(end - 1, -1, -1):
+            doc = docs[str(self.keys[i][1])]
+            if not is_hidden(doc, viewer):
+                found.append(doc)
+                if len(found) == limit:
+                    break
+        found.reverse()
+        return found
+
+
+@instrument(db_operations)
+class MemoryStorage:
+    def __init__(self):
+        self._messages: Dict[str, dict] = {}
+        self._group_messages: Dict[str, dict] = {}
+        self._conversations: Dict[str, _History] = defaultdict(_History)
+        self._group_histories: Dict[str, _History] = defaultdict(_History)
+        self._partners: Dict[str, Set[str]] = defaultdict(set)
+        self._groups: Dict[str, Group] = {}
+        self._groups_by_member: Dict[str, Set[str]] = defaultdict(set)
+        self._users: Dict[str, dict] = {}
+        self._usernames: List[str] = []
+        # Change log: (seq, created, audience) in seq order, plus per-user (seq, payload)
+        self._seq = 0
+        self._pruned = 0
+        self._change_writers: Dict[str, Tuple[int, float]] = {}
+        # (created_at, seq, audience) in write order, for pruning from the front
+        self._changes: deque = deque()
+        self._changes_by_user: Dict[str, _ChangeIndex] = defaultdict(_ChangeIndex)
+        # Inbox entries per user and key, each user's (updated_at, key) in
+        # order, and the entries each message is currently the latest of
+        self._inbox: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        self._inbox_order: Dict[str, List[Tuple]] = defaultdict(list)
+        self._inbox_latest: Dict[str, Set[Tuple[str, str]]] = defaultdict(set)
+
+    # --- LIFECYCLE ---
+    async def ensure_indexes(self):
+        pass
+
+    async def index_report(self) -> dict:
+        return {}
+
+    async def close(self):
+        pass
+
+    def cache_stats(self) -> Dict[str, dict]:
+        return {}
+
+    # --- USERS ---
+    async def get_user(self, username: str) -> Optional[dict]:
+        user = self._users.get(username)
+        return dict(user) if user else None
+
+    async def create_user(self, username: str, password_hash: str, pin: str) -> str:
+        if username in self._users:
+            raise ValueError("Username already exists")
+        user_id = str(ObjectId())
+        self._users[username] = {"_id": user_id, "username": username, "password_hash": password_hash, "pin": pin}
+        bisect.insort(self._usernames, username)
+        return user_id
+
+    async def set_password_hash(self, username: str, password_hash: str, expected: Optional[str] = None) -> bool:
+        user = self._users.get(username)
+        if user is None or (expected is not None and user["password_hash"] != expected):
+            return False
+        user["password_hash"] = password_hash
+        return True
+
+    def _directory(self, prefix: str, after: Optional[str]):
+        start = bisect.bisect_left(self._usernames, prefix)
+        if after is not None:
+            start = max(start, bisect.bisect_right(self._usernames, after))
+        for username in self._usernames[start:]:
+            if not username.startswith(prefix):
+                return
+            yield username
+
+    async def search_users(self, prefix: str = "", after: Optional[str] = None,
+                           limit: int = DEFAULT_PAGE_SIZE) -> List[str]:
+        page = []
+        for username in self._directory(prefix.strip().lower(), after):
+            page.append(username)
+            if len(page) == limit:
+                break
+        return page
+
+    async def iter_usernames(self, prefix: str = "", batch_size: int = 1000) -> AsyncIterator[str]:
+        for username in list(self._directory(prefix.strip().lower(), None)):
+            yield username
+
+    # --- DIRECT MESSAGES ---
+    async def save_message(self, message: Message) -> MessageInDB:
+        doc = message.model_dump()
+        doc["conversation_id"] = make_conversation_id(message.sender_id, message.receiver_id)
+        object_id = ObjectId()
+        doc["_id"] = str(object_id)
+        self._messages[doc["_id"]] = doc
+        self._conversations[doc["conversation_id"]].add((doc["timestamp"], object_id))
+        self._partners[message.sender_id].add(message.receiver_id)
+        self._partners[message.receiver_id].add(message.sender_id)
+        self._deliver(doc, False)
+        return MessageInDB(**doc)
+
+    async def get_messages(self, user_id: str, other_user_id: str, before: Optional[str] = None,
+                           after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> List[MessageInDB]:
+        history = self._conversations.get(make_conversation_id(user_id, other_user_id))
+        return self._read_history(history, self._messages, MessageInDB, user_id, before, after, limit, True)
+
+    @staticmethod
+    def _read_history(history: Optional[_History], docs: Dict[str, dict], model, viewer: Optional[str],
+                      before: Optional[str], after: Optional[str], limit: int, datetime_timestamps: bool) -> list:
+        if before and after:
+            raise ValueError("Use either before or after, not both")
+        if history is None:
+            return []
+        before_key = decode_cursor(before, datetime_timestamps) if before else None
+        after_key = decode_cursor(after, datetime_timestamps) if after else None
+        return [
+            model(**{k: v for k, v in doc.items() if k not in _HISTORY_OMIT})
+            for doc in history.page(docs, viewer, before_key, after_key, limit)
+        ]
+
+    # --- REACTIONS ---
+    def _find(self, message_id: str, is_group_message: bool) -> dict:
+        doc = (self._group_messages if is_group_message else self._messages).get(message_id)
+        if doc is None:
+            raise ValueError("Message not found")
+        return doc
+
+    @staticmethod
+    def _as_message(doc: dict, is_group_message: bool) -> Union[MessageInDB, GroupMessage]:
+        return GroupMessage(**doc) if is_group_message else MessageInDB(**doc)
+
+    async def toggle_like(self, message_id: str, user_id: str, is_group_message: bool = False) -> Union[MessageInDB, GroupMessage]:
+        doc = self._find(message_id, is_group_message)
+        if not apply_like(doc, user_id):
+            raise ValueError("Cannot like deleted message")
+        return self._as_message(doc, is_group_message)
+
+    async def delete_message(self, message_id: str, user_id: str, is_group_message: bool = False) -> Union[MessageInDB, GroupMessage]:
+        doc = self._find(message_id, is_group_message)
+        tombstoned = apply_delete(doc, user_id)
+        self._inbox_deleted(doc, user_id, is_group_message, tombstoned)
+        return self._as_message(doc, is_group_message)
+
+    async def apply_reactions(self, user_id: str, reactions: List[dict]) -> List[Union[MessageInDB, GroupMessage]]:
+        touched: Dict[Tuple[bool, str], dict] = {}
+        for reaction in reactions:
+            is_group_message = bool(reaction.get("is_group"))
+            action = reaction.get("action")
+            try:
+                doc = self._find(reaction.get("message_id"), is_group_message)
+            except ValueError:
+                continue
+            if action in ("like", "unlike"):
+                apply_like(doc, user_id, action)
+            elif action == "delete":
+                tombstoned = apply_delete(doc, user_id)
+                self._inbox_deleted(doc, user_id, is_group_message, tombstoned)
+            else:
+                continue
+            touched[(is_group_message, doc["_id"])] = doc
+        return [self._as_message(doc, is_group) for (is_group, _), doc in touched.items()]
+
+    # --- GROUPS ---
+    def _index_members(self, group_id: str, old: List[str], new: List[str]):
+        for username in set(old) - set(new):
+            self._groups_by_member[username].discard(group_id)
+        for username in new:
+            self._groups_by_member[username].add(group_id)
+
+    async def create_group(self, group: Group) -> Group:
+        previous = self._groups.get(group.id)
+        self._groups[group.id] = group.model_copy(deep=True)
+        self._index_members(group.id, previous.members if previous else [], group.members)
+        return group.model_copy(deep=True)
+
+    async def get_group(self, group_id: str) -> Optional[Group]:
+        group = self._groups.get(group_id)
+        return group.model_copy(deep=True) if group else None
+
+    async def get_group_members(self, group_id: str) -> Optional[FrozenSet[str]]:
+        group = self._groups.get(group_id)
+        return frozenset(group.members) if group else None
+
+    async def update_group(self, group_id: str, update: dict) -> Optional[Group]:
+        group = self._groups.get(group_id)
+        if group is None:
+            return None
+        updated = group.model_copy(update=update, deep=True)
+        self._groups[group_id] = updated
+        self._index_members(group_id, group.members, updated.members)
+        return updated.model_copy(deep=True)
+
+    async def get_user_groups(self, username: str) -> list:
+        return [self._groups[g].model_copy(deep=True) for g in self._groups_by_member.get(username, ())]
+
+    async def get_contacts(self, username: str) -> set:
+        contacts = set(self._partners.get(username, ()))
+        for group_id in self._groups_by_member.get(username, ()):
+            contacts.update(self._groups[group_id].members)
+        contacts.discard(username)
+        return contacts
+
+    # --- GROUP MESSAGES ---
+    async def save_group_message(self, message: GroupMessage) -> GroupMessage:
+        doc = message.model_dump()
+        object_id = ObjectId()
+        doc["_id"] = str(object_id)
+        doc.pop("id", None)
+        self._group_messages[doc["_id"]] = doc
+        self._group_histories[doc["group_id"]].add((doc["timestamp"], object_id))
+        group = self._groups.get(doc["group_id"])
+        self._deliver(doc, True, group.members if group else ())
+        return GroupMessage(**doc)
+
+    async def get_group_messages(self, group_id: str, viewer: Optional[str] = None, before: Optional[str] = None,
+                                 after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> list:
+        return self._read_history(self._group_histories.get(group_id), self._group_messages,
+                                  GroupMessage, viewer, before, after, limit, False)
+
+    # --- CHANGE LOG ---
+    async def reserve_change_seqs(self, writer_id: str, count: int) -> int:
+        self._change_writers[writer_id] = (self._seq + 1, time.monotonic() + CHANGE_WRITER_LEASE)
+        self._seq += count
+        return self._seq - count + 1
+
+    async def write_changes(self, writer_id: str, entries: List[dict], floor: Optional[int]):
+        for entry in entries:
+            self._changes.append((entry["created_at"], entry["seq"], entry["audience"]))
+            for user_id in entry["audience"]:
+                self._changes_by_user[user_id].add(entry["seq"], dict(entry["payload"]))
+        if floor is None:
+            self._change_writers.pop(writer_id, None)
+        else:
+            self._change_writers[writer_id] = (floor, time.monotonic() + CHANGE_WRITER_LEASE)
+
+    async def change_watermark(self) -> int:
+        now = time.monotonic()
+        floors = [floor for floor, expires_at in self._change_writers.values() if expires_at > now]
+        return min([self._seq] + [floor - 1 for floor in floors])
+
+    async def get_changes(self, user_id: str, since: int, upto: int, limit: int) -> Optional[List[dict]]:
+        if since < self._pruned:
+            return None
+        entries = self._changes_by_user.get(user_id)
+        return entries.read(since, upto, limit) if entries else []
+
+    async def prune_changes(self, before: datetime):
+        pruned = self._pruned
+        expired = set()
+        while self._changes and self._changes[0][0] < before:
+            _, seq, audience = self._changes.popleft()
+            pruned = max(pruned, seq)
+            expired.update(audience)
+        self._pruned = pruned
+        for user_id in expired:
+            entries = self._changes_by_user[user_id]
+            entries.prune(pruned)
+            if not entries.seqs:
+                del self._changes_by_user[user_id]
+
+    # --- INBOX ---
+    def _deliver(self, doc: dict, is_group_message: bool, members=()):
+        fields, targets = inbox_deliveries(doc, is_group_message, members)
+        for user_id, chat_id, unread in targets:
+            key = inbox_key(chat_id, is_group_message)
+            order = self._inbox_order[user_id]
+            entry = self._inbox[user_id].get(key)
+            if entry is None:
+                entry = self._inbox[user_id][key] = {"chat_id": chat_id, "is_group": is_group_message, "unread": 0}
+            else:
+                del order[bisect.bisect_left(order, (entry["updated_at"], key))]
+                self._unindex_latest(user_id, key, entry)
+            entry.update(fields)
+            entry["unread"] += unread
+            bisect.insort(order, (entry["updated_at"], key))
+            self._inbox_latest[entry["last_message_id"]].add((user_id, key))
+
+    def _unindex_latest(self, user_id: str, key: str, entry: dict):
+        self._inbox_latest[entry["last_message_id"]].discard((user_id, key))
+        if not self._inbox_latest[entry["last_message_id"]]:
+            del self._inbox_latest[entry["last_message_id"]]
+
+    def _inbox_deleted(self, doc: dict, user_id: str, is_group_message: bool, tombstoned: bool):
+        if tombstoned:
+            group = self._groups.get(doc["group_id"]) if is_group_message else None
+            sent_at, targets = inbox_unread_targets(doc, is_group_message, group.members if group else ())
+            for owner, key in targets:
+                entry = self._inbox.get(owner, {}).get(key)
+                if entry and entry["unread"] > 0 and (entry.get("read_at") is None or entry["read_at"] < sent_at):
+                    entry["unread"] -= 1
+        # Everyone's entry after a sender's delete, otherwise only the hider's
+        everyone = "*" in doc["deleted_by"]
+        owners = [(owner, key) for owner, key in self._inbox_latest.get(doc["_id"], ()) if everyone or owner == user_id]
+        if not owners:
+            return
+        if is_group_message:
+            history, docs = self._group_histories.get(doc["group_id"]), self._group_messages
+        else:
+            history, docs = self._conversations.get(doc["conversation_id"]), self._messages
+        latest = history.page(docs, None if everyone else user_id, None, None, 1) if history else []
+        fields = inbox_preview(latest[0] if latest else None)
+        for owner, key in owners:
+            entry = self._inbox[owner][key]
+            self._unindex_latest(owner, key, entry)
+            entry.update(fields)
+            self._inbox_latest[entry["last_message_id"]].add((owner, key))
+
+    async def get_inbox(self, user_id: str, before: Optional[str] = None,
+                        limit: int = DEFAULT_PAGE_SIZE) -> List[InboxEntry]:
+        order = self._inbox_order.get(user_id, [])
+        end = bisect.bisect_left(order, decode_inbox_cursor(before)) if before else len(order)
+        entries = self._inbox.get(user_id, {})
+        return [InboxEntry(**entries[key]) for _, key in reversed(order[max(0, end - limit):end])]
+
+    async def mark_read(self, user_id: str, chat_id: str, is_group: bool = False) -> Optional[InboxEntry]:
+        entry = self._inbox.get(user_id, {}).get(inbox_key(chat_id, is_group))
+        if entry is None:
+            return None
+        entry["unread"] = 0
+        entry["read_at"] = datetime.utcnow()
+        return InboxEntry(**entry)
+
+    async def get_inbox_entries(self, chats: Dict[str, str], is_group: bool) -> Dict[str, InboxEntry]:
+        found = {}
+        for user_id, chat_id in chats.items():
+            entry = self._inbox.get(user_id, {}).get(inbox_key(chat_id, is_group))
+            if entry is not None:
+                found[user_id] = InboxEntry(**entry)
+        return found
@@ -0,0 +1,147 @@
+"""Data migrations for the Mongo collections.
+
+Run from the backend directory, e.g.::
+
+    python -m app.services.migrations backfill_conversation_id --batch-size 1000
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.models.message import make_conversation_id
+from app.services.database import Database, db
+from app.services.storage import inbox_deliveries, inbox_key
+
+logger = logging.getLogger(__name__)
+
+# Tombstones of messages sent more than this many days ago are purged
+TOMBSTONE_RETENTION_DAYS = float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+
+
+async def backfill_conversation_id(batch_size: int = 1000) -> int:
+    """Set ``conversation_id`` on direct messages stored before it existed.
+
+    Documents are processed in ``_id`` order in batches of ``batch_size``.
+    Only documents still missing the field are selected, so the command can
+    be interrupted and re-run at any time; it resumes where it stopped.
+    Returns the number of documents updated.
+    """
+    updated = 0
+    last_id = None
+    while True:
+        query = {"conversation_id": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db.db.messages.find(
+            query, {"sender_id": 1, "receiver_id": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        ops = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": {
+                "conversation_id": make_conversation_id(doc["sender_id"], doc["receiver_id"])
+            }})
+            for doc in batch
+        ]
+        result = await db.db.messages.bulk_write(ops, ordered=False)
+        updated += result.modified_count
+        last_id = batch[-1]["_id"]
+        logger.info(f"Backfilled conversation_id on {updated} messages (last _id {last_id})")
+    return updated
+
+
+async def backfill_inbox(batch_size: int = 1000) -> int:
+    """Create inbox entries for conversations and groups that predate the inbox.
+
+    Each entry gets the chat's latest message with an unread count of 0.
+    Entries that already exist are left alone (``$setOnInsert``), so live
+    traffic is never overwritten and the command can be re-run safely.
+    Run ``backfill_conversation_id`` first. Returns the number of entries
+    created.
+    """
+    created = 0
+    ops = []
+
+    async def flush():
+        nonlocal created
+        if ops:
+            result = await db.db.inbox.bulk_write(ops, ordered=False)
+            created += result.upserted_count
+            ops.clear()
+            logger.info(f"Backfilled {created} inbox entries")
+
+    sources = [(db.db.messages, "conversation_id", False), (db.db.group_messages, "group_id", True)]
+    for collection, key, is_group in sources:
+        # Newest message per chat; the descending sort walks the history index backwards
+        latest = collection.aggregate([
+            {"$sort": {key: -1, "timestamp": -1, "_id": -1}},
+            {"$group": {"_id": f"${key}", "doc": {"$first": "$$ROOT"}}},
+        ], allowDiskUse=True)
+        async for row in latest:
+            doc = row["doc"]
+            members = (await db.get_group_members(doc["group_id"]) or ()) if is_group else ()
+            fields, targets = inbox_deliveries(doc, is_group, members)
+            if "*" in (doc.get("deleted_by") or []):
+                fields.update(preview="", last_deleted=True)
+            for user_id, chat_id, _ in targets:
+                ops.append(UpdateOne(
+                    {"user_id": user_id, "key": inbox_key(chat_id, is_group)},
+                    {"$setOnInsert": {**fields, "chat_id": chat_id, "is_group": is_group, "unread": 0}},
+                    upsert=True,
+                ))
+            if len(ops) >= batch_size:
+                await flush()
+    await flush()
+    return created
+
+
+async def purge_tombstones(batch_size: int = 1000) -> int:
+    """Remove messages deleted for everyone (``deleted_by == ["*"]``).
+
+    History reads never return tombstones and inbox entries keep their own
+    preview, so once a tombstone is past ``TOMBSTONE_RETENTION_DAYS`` (by
+    its ``_id``, i.e. when the message was sent) nothing needs it. Meant to
+    be run periodically, e.g. from cron; it can be interrupted and re-run.
+    Returns the number of messages removed.
+    """
+    removed = 0
+    cutoff = ObjectId.from_datetime(datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS))
+    for collection in (db.db.messages, db.db.group_messages):
+        while True:
+            batch = await collection.find(
+                {"_id": {"$lt": cutoff}, "deleted_by": "*"}, {"_id": 1}
+            ).limit(batch_size).to_list(length=batch_size)
+            if not batch:
+                break
+            result = await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+            removed += result.deleted_count
+            logger.info(f"Purged {removed} tombstones")
+    return removed
+
+
+MIGRATIONS = {
+    "backfill_conversation_id": backfill_conversation_id,
+    "backfill_inbox": backfill_inbox,
+    "purge_tombstones": purge_tombstones,
+}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Run a data migration")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    if not isinstance(db, Database):
+        parser.error("migrations only apply to the mongo storage backend (STORAGE_BACKEND=mongo)")
+    count = asyncio.run(MIGRATIONS[args.migration](batch_size=args.batch_size))
+    print(f"{args.migration}: {count} documents updated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""bcrypt hashing off the event loop.
+
+Each bcrypt call takes ~100-300 ms of CPU. Running it inline in an ``async``
+route stalls every WebSocket for that long, so ``PasswordHasher`` runs it in
+a worker pool instead. ``PASSWORD_HASH_POOL`` selects the pool: ``thread`` by
+default, since bcrypt releases the GIL, or ``process``. At most
+``PASSWORD_HASH_WORKERS`` hashes run at once, and at most
+``PASSWORD_HASH_MAX_PENDING`` may wait. Past that, callers get
+``HasherBusy`` straight away instead of queueing behind a login storm.
+
+The cost is set by ``BCRYPT_ROUNDS``. Hashes made with fewer rounds are
+upgraded the next time their owner logs in (see ``verify_and_update``).
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from app.metrics import Histogram
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "100"))
+
+# min_rounds makes passlib flag weaker stored hashes as needing an update
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+
+class HasherBusy(Exception):
+    """Too many password operations already queued."""
+
+
+# Module-level so they can be pickled for a process pool
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+class PasswordHasher:
+    def __init__(self, pool: str = PASSWORD_HASH_POOL, workers: int = PASSWORD_HASH_WORKERS,
+                 max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.pool = pool
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.pool == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            self._slots = asyncio.Semaphore(self.workers)
+        return self._executor
+
+    async def _run(self, fn, *args):
+        executor = self._get_executor()
+        if self.waiting >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusy("Too many password operations in progress, try again shortly")
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        self.wait_time.observe(started - queued)
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.run_time.observe(time.perf_counter() - started)
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify_and_update(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        """Check ``password``; the second item is a replacement hash when the
+        stored one uses outdated parameters, else None."""
+        ok, new_hash = await self._run(_verify_and_update, password, password_hash)
+        if new_hash is not None:
+            self.rehashed += 1
+        return ok, new_hash
+
+    def stats(self) -> dict:
+        return {"waiting": self.waiting, "running": self.running, "completed": self.completed,
+                "rejected": self.rejected, "rehashed": self.rehashed}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+hasher = PasswordHasher()
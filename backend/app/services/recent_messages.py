@@ -0,0 +1,190 @@
+"""Recent-message windows for history reads.
+
+Opening a chat almost always asks for the latest page, and the messages in
+it mostly just went through ``save_message``. ``RecentMessages`` keeps the
+last ``RECENT_WINDOW`` messages of each conversation or group that was
+read recently. Writes made through this process keep those windows current,
+so the next history page inside a window is served without a query.
+
+A window holds every message, deleted ones included, so each viewer's
+hidden messages can be filtered out per request. Windows are evicted
+least-recently-used as whole conversations once the total passes
+``RECENT_MAX_MESSAGES`` and expire after ``RECENT_TTL`` seconds.
+
+Writes that land while a window is being loaded (between ``begin_seed``
+and ``seed``) are buffered and merged into it, so a window never misses a
+message the query did not see yet. Windows are only kept current by this
+process's writes, so they must be off when several workers share the data.
+``RECENT_WINDOW`` sets the window size; when it is unset the cache is on
+only for a single worker, meaning ``WS_BROKER`` is the default ``memory`` and
+``WEB_CONCURRENCY`` is at most 1. A worker cannot see a plain
+``uvicorn --workers N`` from the inside, so run several workers as
+``WEB_CONCURRENCY=N uvicorn ...`` (uvicorn and gunicorn take their worker
+count from it) or set ``RECENT_WINDOW=0``.
+"""
+import bisect
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from bson import ObjectId
+
+MULTI_WORKER = os.getenv("WS_BROKER", "memory") != "memory" or int(os.getenv("WEB_CONCURRENCY") or "1") > 1
+RECENT_WINDOW = int(os.getenv("RECENT_WINDOW") or ("0" if MULTI_WORKER else "100"))
+RECENT_MAX_MESSAGES = int(os.getenv("RECENT_MAX_MESSAGES", "200000"))
+RECENT_TTL = float(os.getenv("RECENT_TTL", "30"))
+
+
+def _key(doc: dict) -> Tuple:
+    return doc["timestamp"], ObjectId(doc["_id"])
+
+
+def _visible(doc: dict, viewer: Optional[str]) -> bool:
+    deleted_by = doc.get("deleted_by") or []
+    return "*" not in deleted_by and (viewer is None or viewer not in deleted_by)
+
+
+class _Window:
+    __slots__ = ("keys", "docs", "has_older", "expires")
+
+    def __init__(self, docs: List[dict], has_older: bool, expires: float):
+        # Oldest first, ordered like history: (timestamp, _id)
+        self.docs = sorted(docs, key=_key)
+        self.keys = [_key(doc) for doc in self.docs]
+        self.has_older = has_older
+        self.expires = expires
+
+
+class RecentMessages:
+    def __init__(self, window: int = RECENT_WINDOW, max_messages: int = RECENT_MAX_MESSAGES, ttl: float = RECENT_TTL):
+        self.window = window
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._windows: "OrderedDict[Hashable, _Window]" = OrderedDict()
+        # Keys being loaded: [loads in flight, {doc key: (doc, is_new)}]
+        self._seeding: Dict[Hashable, list] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def _get(self, key: Hashable) -> Optional[_Window]:
+        window = self._windows.get(key)
+        if window is not None and window.expires < time.monotonic():
+            self._drop(key)
+            return None
+        return window
+
+    def _drop(self, key: Hashable):
+        window = self._windows.pop(key, None)
+        if window is not None:
+            self.size -= len(window.docs)
+
+    def begin_seed(self, key: Hashable):
+        """Start buffering writes to ``key`` while its window is being loaded."""
+        if self.enabled:
+            self._seeding.setdefault(key, [0, {}])[0] += 1
+
+    def end_seed(self, key: Hashable) -> dict:
+        """Stop one load of ``key`` (also on failure); returns the writes buffered for it."""
+        pending = self._seeding.get(key)
+        if pending is None:
+            return {}
+        pending[0] -= 1
+        if pending[0] == 0:
+            del self._seeding[key]
+        return pending[1]
+
+    def _buffer(self, key: Hashable, doc: dict, is_new: bool):
+        pending = self._seeding.get(key)
+        if pending is not None:
+            # A like after the add still counts as new
+            previous = pending[1].get(_key(doc))
+            pending[1][_key(doc)] = (doc, is_new or (previous is not None and previous[1]))
+
+    def seed(self, key: Hashable, docs: List[dict], has_older: bool):
+        """Install the newest ``docs`` of a conversation (all of it if not
+        ``has_older``), plus writes buffered since ``begin_seed``."""
+        buffered = self.end_seed(key)
+        if not self.enabled:
+            return
+        if buffered:
+            by_key = {_key(doc): doc for doc in docs}
+            for doc_key, (doc, is_new) in buffered.items():
+                if is_new or doc_key in by_key:
+                    by_key[doc_key] = doc
+            docs = [by_key[k] for k in sorted(by_key)]
+        self._drop(key)
+        self._windows[key] = _Window(docs[-self.window:], has_older or len(docs) > self.window,
+                                     time.monotonic() + self.ttl)
+        self.size += len(self._windows[key].docs)
+        while self.size > self.max_messages and len(self._windows) > 1:
+            self._drop(next(iter(self._windows)))
+
+    def add(self, key: Hashable, doc: dict):
+        """Record a newly saved message; only conversations with a window are tracked."""
+        self._buffer(key, doc, True)
+        window = self._get(key)
+        if window is None:
+            return
+        doc_key = _key(doc)
+        # Saves finish nearly in order, so this is almost always an append
+        index = bisect.bisect(window.keys, doc_key)
+        if index and window.keys[index - 1] == doc_key:
+            return  # already loaded by a concurrent seed
+        window.keys.insert(index, doc_key)
+        window.docs.insert(index, doc)
+        self.size += 1
+        if len(window.docs) > self.window:
+            del window.keys[0], window.docs[0]
+            window.has_older = True
+            self.size -= 1
+
+    def update(self, key: Hashable, doc: dict):
+        """Replace a cached message after a like or delete."""
+        self._buffer(key, doc, False)
+        window = self._get(key)
+        if window is None:
+            return
+        index = bisect.bisect_left(window.keys, _key(doc))
+        if index < len(window.keys) and window.keys[index] == _key(doc):
+            window.docs[index] = doc
+
+    def page(self, key: Hashable, viewer: Optional[str], before: Optional[Tuple], after: Optional[Tuple],
+             limit: int) -> Optional[List[dict]]:
+        """The history page for these cursor keys, oldest first, or None when
+        the window cannot answer it on its own."""
+        window = self._get(key) if self.enabled else None
+        if window is None:
+            self.misses += 1
+            return None
+        if after is not None:
+            if window.has_older and (not window.keys or after < window.keys[0]):
+                # Messages between the cursor and the window may be missing
+                self.misses += 1
+                return None
+            start = bisect.bisect_right(window.keys, after)
+            found = [doc for doc in window.docs[start:] if _visible(doc, viewer)][:limit]
+        else:
+            end = bisect.bisect_left(window.keys, before) if before is not None else len(window.keys)
+            found = []
+            for doc in reversed(window.docs[:end]):
+                if _visible(doc, viewer):
+                    found.append(doc)
+                    if len(found) == limit:
+                        break
+            if len(found) < limit and window.has_older:
+                self.misses += 1
+                return None
+            found.reverse()
+        self._windows.move_to_end(key)
+        self.hits += 1
+        return found
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": self.size,
+                "conversations": len(self._windows)}
@@ -0,0 +1,606 @@
+"""Embedded SQLite storage backend (``STORAGE_BACKEND=sqlite``).
+
+Uses the stdlib ``sqlite3`` module on one dedicated thread: every operation
+runs there in its own ``BEGIN IMMEDIATE`` transaction, so it never blocks
+the event loop and read-modify-write operations (likes, deletes) stay atomic
+even with several processes sharing the file. Lists (likes, deleted_by,
+group members/admins) are stored as JSON; ``group_members`` mirrors group
+membership for indexed lookups. The change log is ``changes`` (one row per
+event) plus ``change_audience`` rows for the per-user lookup; the seq
+counter and the highest pruned seq live in ``change_state`` and each
+writer's reserved block in ``change_writers``. ``inbox`` holds one row
+per user and chat, written in the same transaction as the message.
+"""
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, FrozenSet, List, Optional, Union
+
+from bson import ObjectId
+
+from app.metrics import db_operations, instrument
+from app.models.group_pydantic import Group, GroupMessage
+from app.models.inbox import InboxEntry
+from app.models.message import Message, MessageInDB, make_conversation_id
+from app.services.storage import (
+    CHANGE_WRITER_LEASE, DEFAULT_PAGE_SIZE, apply_delete, decode_cursor, apply_like, decode_inbox_cursor, inbox_deliveries, inbox_key, inbox_preview,
+    inbox_unread_targets,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    id TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    pin TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    sender_id TEXT NOT NULL,
+    receiver_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    likes TEXT NOT NULL DEFAULT '[]',
+    deleted_by TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender_id);
+CREATE INDEX IF NOT EXISTS messages_receiver ON messages (receiver_id);
+CREATE TABLE IF NOT EXISTS group_messages (
+    id TEXT PRIMARY KEY,
+    group_id TEXT NOT NULL,
+    sender_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    likes TEXT NOT NULL DEFAULT '[]',
+    deleted_by TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS group_messages_group ON group_messages (group_id, timestamp, id);
+CREATE TABLE IF NOT EXISTS groups (
+    id TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS group_members (
+    group_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (group_id, username)
+);
+CREATE INDEX IF NOT EXISTS group_members_username ON group_members (username);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_created_at ON changes (created_at);
+CREATE TABLE IF NOT EXISTS change_audience (
+    username TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (username, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS change_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    seq INTEGER NOT NULL,
+    pruned INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO change_state (id, seq, pruned) SELECT 1, COALESCE(MAX(seq), 0), 0 FROM changes;
+CREATE TABLE IF NOT EXISTS change_writers (
+    id TEXT PRIMARY KEY,
+    floor INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inbox (
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    is_group INTEGER NOT NULL,
+    last_message_id TEXT,
+    last_sender_id TEXT,
+    preview TEXT NOT NULL DEFAULT '',
+    last_deleted INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL,
+    unread INTEGER NOT NULL DEFAULT 0,
+    read_at TEXT,
+    PRIMARY KEY (user_id, key)
+);
+CREATE INDEX IF NOT EXISTS inbox_recent ON inbox (user_id, updated_at, key);
+CREATE INDEX IF NOT EXISTS inbox_last_message ON inbox (last_message_id);
+"""
+
+# Representative query per hot access path, explained by index_report
+INDEX_PROBES = {
+    "messages": ["SELECT id FROM messages WHERE conversation_id = 'a:b' ORDER BY timestamp DESC, id DESC"],
+    "group_messages": ["SELECT id FROM group_messages WHERE group_id = 'g' ORDER BY timestamp DESC, id DESC"],
+    "group_members": ["SELECT group_id FROM group_members WHERE username = 'a'"],
+    "users": ["SELECT username FROM users WHERE username >= 'a' AND username < 'b' ORDER BY username"],
+    "changes": ["SELECT seq FROM changes WHERE created_at < 0"],
+    "change_audience": ["SELECT seq FROM change_audience WHERE username = 'a' AND seq > 0 ORDER BY seq"],
+    "inbox": ["SELECT key FROM inbox WHERE user_id = 'a' ORDER BY updated_at DESC, key DESC",
+              "SELECT key FROM inbox WHERE last_message_id = 'm'"],
+}
+# Fixed width, so text order is time order (isoformat drops zero microseconds)
+_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+_HIDDEN = "EXISTS (SELECT 1 FROM json_each(deleted_by) WHERE value = '*' OR value = ?)"
+
+
+def _timestamp(value) -> str:
+    return value.strftime(_TIMESTAMP_FORMAT) if isinstance(value, datetime) else value
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _prefix_upper(prefix: str) -> str:
+    """Smallest string greater than every string starting with ``prefix``."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+@instrument(db_operations)
+class SQLiteStorage:
+    def __init__(self, path: str = "chat.db"):
+        self.path = path
+        # One thread owns the connection; sqlite3 objects are not thread-safe
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    # --- PLUMBING ---
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    async def _run(self, fn, *args):
+        def call():
+            with self._transaction() as conn:
+                return fn(conn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    # --- LIFECYCLE ---
+    async def ensure_indexes(self):
+        # The schema, indexes included, is created with the connection
+        await self._run(lambda conn: None)
+
+    async def index_report(self) -> dict:
+        def report(conn):
+            existing = {row["name"] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            expected = {line.split()[5] for line in SCHEMA.splitlines() if line.startswith("CREATE INDEX")}
+            result = {}
+            for table, probes in INDEX_PROBES.items():
+                plans = []
+                for query in probes:
+                    steps = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}")]
+                    plans.append({"query": query, "plan": " <- ".join(steps)})
+                result[table] = {
+                    "missing": sorted(n for n in expected - existing if n.startswith(table)),
+                    "unused": [],  # SQLite keeps no index usage statistics
+                    "plans": plans,
+                }
+            return result
+        return await self._run(report)
+
+    async def close(self):
+        def shutdown():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, shutdown)
+        self._executor.shutdown(wait=False)
+
+    def cache_stats(self) -> Dict[str, dict]:
+        return {}
+
+    # --- USERS ---
+    async def get_user(self, username: str) -> Optional[dict]:
+        def get(conn):
+            row = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+            if row is None:
+                return None
+            user = dict(row)
+            user["_id"] = user.pop("id")
+            return user
+        return await self._run(get)
+
+    async def create_user(self, username: str, password_hash: str, pin: str) -> str:
+        user_id = str(ObjectId())
+
+        def insert(conn):
+            try:
+                conn.execute("INSERT INTO users (username, id, password_hash, pin) VALUES (?, ?, ?, ?)",
+                             (username, user_id, password_hash, pin))
+            except sqlite3.IntegrityError:
+                raise ValueError("Username already exists")
+            return user_id
+        return await self._run(insert)
+
+    async def set_password_hash(self, username: str, password_hash: str, expected: Optional[str] = None) -> bool:
+        def update(conn):
+            sql, params = "UPDATE users SET password_hash = ? WHERE username = ?", [password_hash, username]
+            if expected is not None:
+                sql += " AND password_hash = ?"
+                params.append(expected)
+            return conn.execute(sql, params).rowcount == 1
+        return await self._run(update)
+
+    @staticmethod
+    def _directory_query(prefix: str, after: Optional[str]) -> tuple:
+        clauses, params = [], []
+        if prefix:
+            clauses.append("username >= ? AND username < ?")
+            params += [prefix, _prefix_upper(prefix)]
+        if after:
+            clauses.append("username > ?")
+            params.append(after)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return f"SELECT username FROM users{where} ORDER BY username", params
+
+    async def search_users(self, prefix: str = "", after: Optional[str] = None,
+                           limit: int = DEFAULT_PAGE_SIZE) -> List[str]:
+        sql, params = self._directory_query(prefix.strip().lower(), after)
+        rows = await self._run(lambda conn: conn.execute(sql + " LIMIT ?", params + [limit]).fetchall())
+        return [row["username"] for row in rows]
+
+    async def iter_usernames(self, prefix: str = "", batch_size: int = 1000) -> AsyncIterator[str]:
+        # Keyset pagination: each batch is its own short transaction
+        after = None
+        while True:
+            batch = await self.search_users(prefix, after=after, limit=batch_size)
+            for username in batch:
+                yield username
+            if len(batch) < batch_size:
+                return
+            after = batch[-1]
+
+    # --- MESSAGES (shared) ---
+    @staticmethod
+    def _table(is_group_message: bool) -> str:
+        return "group_messages" if is_group_message else "messages"
+
+    @staticmethod
+    def _row_to_doc(row: sqlite3.Row) -> dict:
+        doc = dict(row)
+        doc["_id"] = doc.pop("id")
+        doc["likes"] = json.loads(doc["likes"])
+        doc["deleted_by"] = json.loads(doc["deleted_by"])
+        return doc
+
+    @staticmethod
+    def _as_message(doc: dict, is_group_message: bool) -> Union[MessageInDB, GroupMessage]:
+        if is_group_message:
+            return GroupMessage(**doc)
+        return MessageInDB(**{**doc, "timestamp": datetime.fromisoformat(doc["timestamp"])})
+
+    def _read_history(self, conn, table: str, key: str, value: str, viewer: Optional[str],
+                      before: Optional[str], after: Optional[str], limit: int, datetime_timestamps: bool) -> List[dict]:
+        """One page of ``table`` where ``key = value``, oldest first (see ``page_query``)."""
+        if before and after:
+            raise ValueError("Use either before or after, not both")
+        sql = f"SELECT * FROM {table} WHERE {key} = ? AND NOT {_HIDDEN}"
+        params = [value, viewer or "*"]
+        cursor = before or after
+        direction = "ASC" if after else "DESC"
+        if cursor:
+            timestamp, object_id = decode_cursor(cursor, datetime_timestamps)
+            op = ">" if after else "<"
+            sql += f" AND (timestamp {op} ? OR (timestamp = ? AND id {op} ?))"
+            params += [_timestamp(timestamp), _timestamp(timestamp), str(object_id)]
+        sql += f" ORDER BY timestamp {direction}, id {direction} LIMIT ?"
+        docs = [self._row_to_doc(row) for row in conn.execute(sql, params + [limit])]
+        if direction == "DESC":
+            docs.reverse()
+        for doc in docs:
+            # Same fields as the Mongo backend's HISTORY_PROJECTION leaves
+            doc.pop("conversation_id", None)
+            doc["deleted_by"] = []
+        return docs
+
+    # --- DIRECT MESSAGES ---
+    async def save_message(self, message: Message) -> MessageInDB:
+        doc = message.model_dump()
+        doc["conversation_id"] = make_conversation_id(message.sender_id, message.receiver_id)
+        doc["_id"] = str(ObjectId())
+
+        def insert(conn):
+            conn.execute(
+                "INSERT INTO messages (id, conversation_id, sender_id, receiver_id, content, timestamp, likes, deleted_by)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (doc["_id"], doc["conversation_id"], doc["sender_id"], doc["receiver_id"], doc["content"],
+                 _timestamp(doc["timestamp"]), json.dumps(doc["likes"]), json.dumps(doc["deleted_by"])),
+            )
+            self._deliver(conn, doc, False)
+        await self._run(insert)
+        return MessageInDB(**doc)
+
+    async def get_messages(self, user_id: str, other_user_id: str, before: Optional[str] = None,
+                           after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> List[MessageInDB]:
+        docs = await self._run(self._read_history, "messages", "conversation_id",
+                               make_conversation_id(user_id, other_user_id), user_id, before, after, limit, True)
+        return [self._as_message(doc, False) for doc in docs]
+
+    # --- REACTIONS ---
+    def _update(self, conn, message_id: str, is_group_message: bool, change) -> Optional[dict]:
+        """Read, change and write back one message inside the current transaction."""
+        table = self._table(is_group_message)
+        row = conn.execute(f"SELECT * FROM {table} WHERE id = ?", (message_id,)).fetchone()
+        if row is None:
+            return None
+        doc = self._row_to_doc(row)
+        change(doc)
+        conn.execute(f"UPDATE {table} SET content = ?, likes = ?, deleted_by = ? WHERE id = ?",
+                     (doc["content"], json.dumps(doc["likes"]), json.dumps(doc["deleted_by"]), message_id))
+        return doc
+
+    async def toggle_like(self, message_id: str, user_id: str, is_group_message: bool = False) -> Union[MessageInDB, GroupMessage]:
+        def change(doc):
+            if not apply_like(doc, user_id):
+                raise ValueError("Cannot like deleted message")
+
+        def toggle(conn):
+            doc = self._update(conn, message_id, is_group_message, change)
+            if doc is None:
+                raise ValueError("Message not found")
+            return doc
+        return self._as_message(await self._run(toggle), is_group_message)
+
+    async def delete_message(self, message_id: str, user_id: str, is_group_message: bool = False) -> Union[MessageInDB, GroupMessage]:
+        def delete(conn):
+            tombstoned = []
+            doc = self._update(conn, message_id, is_group_message,
+                               lambda d: tombstoned.append(apply_delete(d, user_id)))
+            if doc is None:
+                raise ValueError("Message not found")
+            self._inbox_deleted(conn, doc, user_id, is_group_message, tombstoned[0])
+            return doc
+        return self._as_message(await self._run(delete), is_group_message)
+
+    async def apply_reactions(self, user_id: str, reactions: List[dict]) -> List[Union[MessageInDB, GroupMessage]]:
+        def apply(conn):
+            touched = {}
+            for reaction in reactions:
+                is_group_message = bool(reaction.get("is_group"))
+                action = reaction.get("action")
+                tombstoned = []
+                if action in ("like", "unlike"):
+                    change = lambda d, a=action: apply_like(d, user_id, a)  # noqa: E731
+                elif action == "delete":
+                    change = lambda d: tombstoned.append(apply_delete(d, user_id))  # noqa: E731
+                else:
+                    continue
+                doc = self._update(conn, str(reaction.get("message_id")), is_group_message, change)
+                if doc is not None:
+                    if action == "delete":
+                        self._inbox_deleted(conn, doc, user_id, is_group_message, tombstoned[0])
+                    touched[(is_group_message, doc["_id"])] = doc
+            return touched
+        touched = await self._run(apply)
+        return [self._as_message(doc, is_group) for (is_group, _), doc in touched.items()]
+
+    # --- GROUPS ---
+    @staticmethod
+    def _write_group(conn, group: Group):
+        conn.execute("INSERT OR REPLACE INTO groups (id, doc) VALUES (?, ?)", (group.id, group.model_dump_json()))
+        conn.execute("DELETE FROM group_members WHERE group_id = ?", (group.id,))
+        conn.executemany("INSERT OR IGNORE INTO group_members (group_id, username) VALUES (?, ?)",
+                         [(group.id, m) for m in group.members])
+
+    @staticmethod
+    def _read_group(conn, group_id: str) -> Optional[Group]:
+        row = conn.execute("SELECT doc FROM groups WHERE id = ?", (group_id,)).fetchone()
+        return Group.model_validate_json(row["doc"]) if row else None
+
+    async def create_group(self, group: Group) -> Group:
+        await self._run(self._write_group, group)
+        return group.model_copy(deep=True)
+
+    async def get_group(self, group_id: str) -> Optional[Group]:
+        return await self._run(self._read_group, group_id)
+
+    async def get_group_members(self, group_id: str) -> Optional[FrozenSet[str]]:
+        group = await self.get_group(group_id)
+        return frozenset(group.members) if group else None
+
+    async def update_group(self, group_id: str, update: dict) -> Optional[Group]:
+        def apply(conn):
+            group = self._read_group(conn, group_id)
+            if group is None:
+                return None
+            group = group.model_copy(update=update)
+            self._write_group(conn, group)
+            return group
+        return await self._run(apply)
+
+    async def get_user_groups(self, username: str) -> list:
+        rows = await self._run(lambda conn: conn.execute(
+            "SELECT g.doc FROM groups g JOIN group_members m ON m.group_id = g.id WHERE m.username = ?",
+            (username,),
+        ).fetchall())
+        return [Group.model_validate_json(row["doc"]) for row in rows]
+
+    async def get_contacts(self, username: str) -> set:
+        rows = await self._run(lambda conn: conn.execute(
+            "SELECT receiver_id AS contact FROM messages WHERE sender_id = ?"
+            " UNION SELECT sender_id FROM messages WHERE receiver_id = ?"
+            " UNION SELECT other.username FROM group_members mine"
+            " JOIN group_members other ON other.group_id = mine.group_id WHERE mine.username = ?",
+            (username, username, username),
+        ).fetchall())
+        contacts = {row["contact"] for row in rows}
+        contacts.discard(username)
+        return contacts
+
+    # --- GROUP MESSAGES ---
+    async def save_group_message(self, message: GroupMessage) -> GroupMessage:
+        doc = message.model_dump()
+        doc.pop("id", None)
+        doc["_id"] = str(ObjectId())
+
+        def insert(conn):
+            conn.execute(
+                "INSERT INTO group_messages (id, group_id, sender_id, content, timestamp, likes, deleted_by)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (doc["_id"], doc["group_id"], doc["sender_id"], doc["content"], doc["timestamp"],
+                 json.dumps(doc["likes"]), json.dumps(doc["deleted_by"])),
+            )
+            members = [row["username"] for row in
+                       conn.execute("SELECT username FROM group_members WHERE group_id = ?", (doc["group_id"],))]
+            self._deliver(conn, doc, True, members)
+        await self._run(insert)
+        return GroupMessage(**doc)
+
+    async def get_group_messages(self, group_id: str, viewer: Optional[str] = None, before: Optional[str] = None,
+                                 after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> list:
+        docs = await self._run(self._read_history, "group_messages", "group_id", group_id,
+                               viewer, before, after, limit, False)
+        return [self._as_message(doc, True) for doc in docs]
+
+    # --- CHANGE LOG ---
+    async def reserve_change_seqs(self, writer_id: str, count: int) -> int:
+        def reserve(conn):
+            conn.execute("UPDATE change_state SET seq = seq + ? WHERE id = 1", (count,))
+            seq = conn.execute("SELECT seq FROM change_state WHERE id = 1").fetchone()["seq"]
+            conn.execute("INSERT OR REPLACE INTO change_writers (id, floor, expires_at) VALUES (?, ?, ?)",
+                         (writer_id, seq - count + 1, time.time() + CHANGE_WRITER_LEASE))
+            return seq - count + 1
+        return await self._run(reserve)
+
+    async def write_changes(self, writer_id: str, entries: List[dict], floor: Optional[int]):
+        def write(conn):
+            conn.executemany("INSERT OR IGNORE INTO changes (seq, payload, created_at) VALUES (?, ?, ?)", [
+                (entry["seq"], json.dumps(entry["payload"], default=_json_default), entry["created_at"].timestamp())
+                for entry in entries
+            ])
+            conn.executemany("INSERT OR IGNORE INTO change_audience (username, seq) VALUES (?, ?)",
+                             [(username, entry["seq"]) for entry in entries for username in entry["audience"]])
+            if floor is None:
+                conn.execute("DELETE FROM change_writers WHERE id = ?", (writer_id,))
+            else:
+                conn.execute("INSERT OR REPLACE INTO change_writers (id, floor, expires_at) VALUES (?, ?, ?)",
+                             (writer_id, floor, time.time() + CHANGE_WRITER_LEASE))
+        await self._run(write)
+
+    async def change_watermark(self) -> int:
+        def read(conn):
+            seq = conn.execute("SELECT seq FROM change_state WHERE id = 1").fetchone()["seq"]
+            floor = conn.execute("SELECT MIN(floor) AS floor FROM change_writers WHERE expires_at > ?",
+                                 (time.time(),)).fetchone()["floor"]
+            return seq if floor is None else min(seq, floor - 1)
+        return await self._run(read)
+
+    async def get_changes(self, user_id: str, since: int, upto: int, limit: int) -> Optional[List[dict]]:
+        def read(conn):
+            if since < conn.execute("SELECT pruned FROM change_state WHERE id = 1").fetchone()["pruned"]:
+                return None
+            rows = conn.execute(
+                "SELECT c.seq, c.payload FROM change_audience a JOIN changes c ON c.seq = a.seq"
+                " WHERE a.username = ? AND a.seq > ? AND a.seq <= ? ORDER BY a.seq LIMIT ?",
+                (user_id, since, upto, limit),
+            ).fetchall()
+            return [{**json.loads(row["payload"]), "seq": row["seq"]} for row in rows]
+        return await self._run(read)
+
+    async def prune_changes(self, before: datetime):
+        def prune(conn):
+            pruned = conn.execute("SELECT MAX(seq) AS seq FROM changes WHERE created_at < ?",
+                                  (before.timestamp(),)).fetchone()["seq"]
+            if pruned is None:
+                return
+            conn.execute("UPDATE change_state SET pruned = MAX(pruned, ?) WHERE id = 1", (pruned,))
+            conn.execute("DELETE FROM change_audience WHERE seq <= ?", (pruned,))
+            conn.execute("DELETE FROM changes WHERE seq <= ?", (pruned,))
+        await self._run(prune)
+
+    # --- INBOX ---
+    @staticmethod
+    def _deliver(conn, doc: dict, is_group_message: bool, members=()):
+        fields, targets = inbox_deliveries(doc, is_group_message, members)
+        conn.executemany(
+            "INSERT INTO inbox (user_id, key, chat_id, is_group, last_message_id, last_sender_id, preview,"
+            " last_deleted, updated_at, unread) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)"
+            " ON CONFLICT (user_id, key) DO UPDATE SET last_message_id = excluded.last_message_id,"
+            " last_sender_id = excluded.last_sender_id, preview = excluded.preview, last_deleted = 0,"
+            " updated_at = excluded.updated_at, unread = unread + excluded.unread",
+            [(user_id, inbox_key(chat_id, is_group_message), chat_id, is_group_message, fields["last_message_id"],
+              fields["last_sender_id"], fields["preview"], _timestamp(fields["updated_at"]), unread)
+             for user_id, chat_id, unread in targets],
+        )
+
+    def _inbox_deleted(self, conn, doc: dict, user_id: str, is_group_message: bool, tombstoned: bool):
+        if tombstoned:
+            members = ()
+            if is_group_message:
+                members = [row["username"] for row in conn.execute(
+                    "SELECT username FROM group_members WHERE group_id = ?", (doc["group_id"],))]
+            sent_at, targets = inbox_unread_targets(doc, is_group_message, members)
+            conn.executemany(
+                "UPDATE inbox SET unread = unread - 1 WHERE user_id = ? AND key = ? AND unread > 0"
+                " AND (read_at IS NULL OR read_at < ?)",
+                [(owner, key, _timestamp(sent_at)) for owner, key in targets],
+            )
+        # Everyone's entry after a sender's delete, otherwise only the hider's
+        everyone = "*" in doc["deleted_by"]
+        where, params = "last_message_id = ?", [doc["_id"]]
+        if not everyone:
+            where, params = where + " AND user_id = ?", params + [user_id]
+        if conn.execute(f"SELECT 1 FROM inbox WHERE {where} LIMIT 1", params).fetchone() is None:
+            return
+        if is_group_message:
+            latest = self._read_history(conn, "group_messages", "group_id", doc["group_id"],
+                                        None if everyone else user_id, None, None, 1, False)
+        else:
+            latest = self._read_history(conn, "messages", "conversation_id", doc["conversation_id"],
+                                        None if everyone else user_id, None, None, 1, True)
+        fields = inbox_preview(latest[0] if latest else None)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn.execute(f"UPDATE inbox SET {assignments} WHERE {where}", list(fields.values()) + params)
+
+    @staticmethod
+    def _as_inbox_entry(row: sqlite3.Row) -> InboxEntry:
+        return InboxEntry(**{**dict(row), "is_group": bool(row["is_group"]), "last_deleted": bool(row["last_deleted"])})
+
+    async def get_inbox(self, user_id: str, before: Optional[str] = None,
+                        limit: int = DEFAULT_PAGE_SIZE) -> List[InboxEntry]:
+        sql, params = "SELECT * FROM inbox WHERE user_id = ?", [user_id]
+        if before:
+            updated_at, key = decode_inbox_cursor(before)
+            sql += " AND (updated_at < ? OR (updated_at = ? AND key < ?))"
+            params += [_timestamp(updated_at), _timestamp(updated_at), key]
+        sql += " ORDER BY updated_at DESC, key DESC LIMIT ?"
+        rows = await self._run(lambda conn: conn.execute(sql, params + [limit]).fetchall())
+        return [self._as_inbox_entry(row) for row in rows]
+
+    async def mark_read(self, user_id: str, chat_id: str, is_group: bool = False) -> Optional[InboxEntry]:
+        def update(conn):
+            key = inbox_key(chat_id, is_group)
+            conn.execute("UPDATE inbox SET unread = 0, read_at = ? WHERE user_id = ? AND key = ?",
+                         (_timestamp(datetime.utcnow()), user_id, key))
+            return conn.execute("SELECT * FROM inbox WHERE user_id = ? AND key = ?", (user_id, key)).fetchone()
+        row = await self._run(update)
+        return self._as_inbox_entry(row) if row else None
+
+    async def get_inbox_entries(self, chats: Dict[str, str], is_group: bool) -> Dict[str, InboxEntry]:
+        def read(conn):
+            return [row for user_id, chat_id in chats.items() for row in conn.execute(
+                "SELECT * FROM inbox WHERE user_id = ? AND key = ?", (user_id, inbox_key(chat_id, is_group)))]
+        return {row["user_id"]: self._as_inbox_entry(row) for row in await self._run(read)}
@@ -0,0 +1,258 @@
+"""Storage backend interface.
+
+``Storage`` lists every operation the app performs on persistent data;
+``app.services.database.db`` is whichever implementation
+``STORAGE_BACKEND`` selects:
+
+- ``mongo`` (default): ``Database`` in ``database.py``, Motor/MongoDB.
+- ``memory``: ``MemoryStorage`` in ``memory_store.py``; indexed in-process
+  structures for benchmarks, development and small single-process setups.
+  Nothing survives a restart.
+- ``sqlite``: ``SQLiteStorage`` in ``sqlite_store.py``; an embedded database
+  file (``SQLITE_PATH``) for small edge deployments.
+
+The functions below implement the reaction rules on plain message dicts, so
+the non-Mongo backends share one definition of them (the Mongo backend
+expresses the same rules as update pipelines).
+
+Every backend also keeps a change log for ``sync``: each event a client
+would have received live is stored once with a global ``seq`` and the
+usernames it was sent to. Writers (``app.services.change_log``) reserve
+blocks of seqs with ``reserve_change_seqs`` and write entries in the
+background, so seqs are not committed in order. Each writer's lowest seq
+that may still be written (its floor) is stored with its block, and
+``change_watermark`` is the highest seq below every live writer's floor:
+everything at or below it is committed, and only those entries are served.
+``prune_changes`` drops old entries and records the highest seq dropped; a
+client whose ``seq`` is below that gets ``None`` from ``get_changes`` and
+must reload history instead.
+
+Inboxes are kept the same way on every backend: one entry per user and
+chat, updated by ``save_message``/``save_group_message`` (preview, time,
+unread count) and by deletes, so listing a user's chats never reads message
+history. ``inbox_deliveries`` computes those updates. Deleting a chat's
+latest message moves its preview to the newest message still visible (one
+history read); deleting for everyone also takes the message out of the
+unread count of recipients who had not read it, judged by the entry's
+``read_at`` (set by ``mark_read``).
+"""
+import os
+from datetime import datetime
+from typing import (
+    AsyncIterator, Dict, FrozenSet, Iterable, List, Optional, Protocol, Tuple, Union, runtime_checkable,
+)
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+
+from app.models.group_pydantic import Group, GroupMessage
+from app.models.inbox import InboxEntry
+from app.models.message import Message, MessageInDB
+
+STORAGE_BACKENDS = ("mongo", "memory", "sqlite")
+CHANGE_LOG_TTL = int(os.getenv("CHANGE_LOG_TTL", str(7 * 24 * 3600)))
+# A writer whose block was not renewed for this long is presumed dead
+CHANGE_WRITER_LEASE = float(os.getenv("CHANGE_WRITER_LEASE", "30"))
+INBOX_PREVIEW_LENGTH = int(os.getenv("INBOX_PREVIEW_LENGTH", "100"))
+
+# History pages
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+@runtime_checkable
+class Storage(Protocol):
+    # --- lifecycle ---
+    async def ensure_indexes(self) -> None: ...
+    async def index_report(self) -> dict: ...
+    async def close(self) -> None: ...
+    def cache_stats(self) -> Dict[str, dict]: ...
+
+    # --- users ---
+    async def get_user(self, username: str) -> Optional[dict]: ...
+    async def create_user(self, username: str, password_hash: str, pin: str) -> str: ...
+    async def set_password_hash(self, username: str, password_hash: str,
+                                expected: Optional[str] = None) -> bool: ...
+    async def search_users(self, prefix: str = "", after: Optional[str] = None,
+                           limit: int = ...) -> List[str]: ...
+    def iter_usernames(self, prefix: str = "", batch_size: int = 1000) -> AsyncIterator[str]: ...
+
+    # --- direct messages ---
+    async def save_message(self, message: Message) -> MessageInDB: ...
+    async def get_messages(self, user_id: str, other_user_id: str, before: Optional[str] = None,
+                           after: Optional[str] = None, limit: int = ...) -> List[MessageInDB]: ...
+
+    # --- reactions ---
+    async def toggle_like(self, message_id: str, user_id: str,
+                          is_group_message: bool = False) -> Union[MessageInDB, GroupMessage]: ...
+    async def delete_message(self, message_id: str, user_id: str,
+                             is_group_message: bool = False) -> Union[MessageInDB, GroupMessage]: ...
+    async def apply_reactions(self, user_id: str,
+                              reactions: List[dict]) -> List[Union[MessageInDB, GroupMessage]]: ...
+
+    # --- groups ---
+    async def create_group(self, group: Group) -> Group: ...
+    async def get_group(self, group_id: str) -> Optional[Group]: ...
+    async def get_group_members(self, group_id: str) -> Optional[FrozenSet[str]]: ...
+    async def update_group(self, group_id: str, update: dict) -> Optional[Group]: ...
+    async def get_user_groups(self, username: str) -> list: ...
+    async def get_contacts(self, username: str) -> set: ...
+
+    # --- group messages ---
+    async def save_group_message(self, message: GroupMessage) -> GroupMessage: ...
+    async def get_group_messages(self, group_id: str, viewer: Optional[str] = None, before: Optional[str] = None,
+                                 after: Optional[str] = None, limit: int = ...) -> list: ...
+
+    # --- change log ---
+    async def reserve_change_seqs(self, writer_id: str, count: int) -> int: ...
+    async def write_changes(self, writer_id: str, entries: List[dict], floor: Optional[int]) -> None: ...
+    async def change_watermark(self) -> int: ...
+    async def get_changes(self, user_id: str, since: int, upto: int, limit: int) -> Optional[List[dict]]: ...
+    async def prune_changes(self, before: datetime) -> None: ...
+
+    # --- inbox ---
+    async def get_inbox(self, user_id: str, before: Optional[str] = None,
+                        limit: int = ...) -> List[InboxEntry]: ...
+    async def mark_read(self, user_id: str, chat_id: str, is_group: bool = False) -> Optional[InboxEntry]: ...
+    async def get_inbox_entries(self, chats: Dict[str, str], is_group: bool) -> Dict[str, InboxEntry]: ...
+
+
+def encode_cursor(timestamp: Union[datetime, str], message_id: str) -> str:
+    """Opaque history cursor: message timestamp plus ObjectId tie-break."""
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat()
+    return f"{timestamp}|{message_id}"
+
+
+def decode_cursor(cursor: str, datetime_timestamps: bool = True) -> tuple:
+    """Inverse of ``encode_cursor``; raises ValueError on malformed input.
+
+    Direct messages store ``timestamp`` as a date and group messages as an
+    ISO string, so the timestamp is parsed to match.
+    """
+    try:
+        timestamp, message_id = cursor.rsplit("|", 1)
+        if datetime_timestamps:
+            timestamp = datetime.fromisoformat(timestamp)
+        return timestamp, ObjectId(message_id)
+    except (ValueError, InvalidId):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def is_hidden(doc: dict, viewer: Optional[str]) -> bool:
+    """Deleted for everyone, or by ``viewer``."""
+    deleted_by = doc.get("deleted_by") or []
+    return "*" in deleted_by or (viewer is not None and viewer in deleted_by)
+
+
+def apply_like(doc: dict, user_id: str, action: str = "toggle") -> bool:
+    """Apply ``like``/``unlike``/``toggle`` to ``doc`` in place.
+
+    Likes on messages hidden from ``user_id`` are refused (returns False),
+    except ``unlike``, which always applies.
+    """
+    likes = doc.setdefault("likes", [])
+    if action != "unlike" and is_hidden(doc, user_id):
+        return False
+    if user_id in likes and action in ("toggle", "unlike"):
+        likes.remove(user_id)
+    elif user_id not in likes and action in ("toggle", "like"):
+        likes.append(user_id)
+    return True
+
+
+def apply_delete(doc: dict, user_id: str) -> bool:
+    """The sender deletes for everyone (tombstone); anyone else hides it for themselves.
+
+    Returns True only when this call turned the message into a tombstone.
+    """
+    if doc.get("sender_id") == user_id:
+        tombstoned = "*" not in (doc.get("deleted_by") or [])
+        doc["deleted_by"], doc["content"], doc["likes"] = ["*"], "", []
+        return tombstoned
+    deleted_by = doc.setdefault("deleted_by", [])
+    if user_id not in deleted_by:
+        deleted_by.append(user_id)
+    doc["likes"] = [u for u in doc.get("likes") or [] if u != user_id]
+    return False
+
+
+def inbox_key(chat_id: str, is_group: bool) -> str:
+    """Unique per user's inbox: group ids and usernames may collide."""
+    return f"{'group' if is_group else 'dm'}:{chat_id}"
+
+
+def inbox_cursor(entry: InboxEntry) -> str:
+    """Opaque inbox cursor: the entry's time plus its key as tie-break."""
+    return f"{entry.updated_at.isoformat()}|{inbox_key(entry.chat_id, entry.is_group)}"
+
+
+def decode_inbox_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Inverse of ``inbox_cursor``; raises ValueError on malformed input."""
+    try:
+        updated_at, key = cursor.split("|", 1)
+        return datetime.fromisoformat(updated_at), key
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def inbox_preview(latest: Optional[dict]) -> dict:
+    """Inbox fields showing ``latest``, or a cleared preview if the chat has no visible message left."""
+    if latest is None:
+        return {"preview": "", "last_deleted": True}
+    return {
+        "last_message_id": str(latest["_id"]),
+        "last_sender_id": latest["sender_id"],
+        "preview": latest["content"][:INBOX_PREVIEW_LENGTH],
+        "last_deleted": False,
+    }
+
+
+def inbox_deliveries(doc: dict, is_group: bool, members: Iterable[str] = ()) -> Tuple[dict, List[tuple]]:
+    """Inbox changes for a newly saved message ``doc``.
+
+    Returns the fields every affected entry gets, and ``(user_id, chat_id,
+    unread increment)`` per participant: the sender's own entry is updated
+    without counting the message as unread.
+    """
+    timestamp = doc["timestamp"]
+    fields = {
+        **inbox_preview(doc),
+        "updated_at": datetime.fromisoformat(timestamp) if isinstance(timestamp, str) else timestamp,
+    }
+    sender = doc["sender_id"]
+    if is_group:
+        targets = [(member, doc["group_id"], int(member != sender)) for member in set(members) | {sender}]
+    elif doc["receiver_id"] == sender:
+        targets = [(sender, sender, 0)]
+    else:
+        targets = [(sender, doc["receiver_id"], 0), (doc["receiver_id"], sender, 1)]
+    return fields, targets
+
+
+def inbox_unread_targets(doc: dict, is_group: bool, members: Iterable[str] = ()) -> Tuple[datetime, List[tuple]]:
+    """Time of ``doc`` and the ``(user_id, inbox key)`` entries that counted it as unread.
+
+    Used when it is deleted for everyone: entries still holding unread
+    messages and last read before that time give one back.
+    """
+    fields, targets = inbox_deliveries(doc, is_group, members)
+    return fields["updated_at"], [(user_id, inbox_key(chat_id, is_group))
+                                  for user_id, chat_id, unread in targets if unread]
+
+
+def create_storage(backend: Optional[str] = None) -> Storage:
+    """Build the backend named by ``backend`` or ``STORAGE_BACKEND``."""
+    load_dotenv()
+    backend = (backend or os.getenv("STORAGE_BACKEND", "mongo")).lower()
+    if backend == "mongo":
+        from app.services.database import Database
+        return Database()
+    if backend == "memory":
+        from app.services.memory_store import MemoryStorage
+        return MemoryStorage()
+    if backend == "sqlite":
+        from app.services.sqlite_store import SQLiteStorage
+        return SQLiteStorage(os.getenv("SQLITE_PATH", "chat.db"))
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected one of {', '.join(STORAGE_BACKENDS)}")
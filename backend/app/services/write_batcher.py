@@ -0,0 +1,86 @@
+"""Group-commit batching for message inserts.
+
+Concurrent ``insert`` calls within a short window are written together with
+one ``insert_many(ordered=False)``. IDs are assigned client-side so every
+caller gets its own ``_id`` back as soon as the batch is acknowledged.
+Enabled with ``WRITE_BATCHING=1``; see ``benchmarks/write_batching.py``.
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, List, Set, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY", "0.005"))
+
+
+class WriteBatcher:
+    def __init__(self, db, max_batch: int = WRITE_BATCH_SIZE, max_delay: float = WRITE_BATCH_DELAY):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.documents = 0
+        self._pending: Dict[str, List[Tuple[dict, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._writes: Set[asyncio.Task] = set()
+
+    async def insert(self, collection: str, doc: dict) -> ObjectId:
+        """Queue ``doc`` and wait until its batch is written; returns its ``_id``."""
+        loop = asyncio.get_running_loop()
+        doc.setdefault("_id", ObjectId())
+        future = loop.create_future()
+        pending = self._pending.setdefault(collection, [])
+        pending.append((doc, future))
+        if len(pending) >= self.max_batch:
+            self._flush(collection)
+        elif collection not in self._timers:
+            self._timers[collection] = loop.call_later(self.max_delay, self._flush, collection)
+        return await future
+
+    def _flush(self, collection: str):
+        timer = self._timers.pop(collection, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(collection, None)
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._write(collection, batch))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, collection: str, batch: List[Tuple[dict, asyncio.Future]]):
+        failed: Dict[int, Exception] = {}
+        try:
+            await self.db[collection].insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = ValueError(error.get("errmsg", "Insert failed"))
+        except Exception as e:
+            logger.error(f"Batched insert into {collection} failed: {e}")
+            failed = {i: e for i in range(len(batch))}
+        self.batches += 1
+        self.documents += len(batch)
+        for i, (doc, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in failed:
+                future.set_exception(failed[i])
+            else:
+                future.set_result(doc["_id"])
+
+    async def flush(self):
+        """Write everything still queued and wait for in-flight batches."""
+        for collection in list(self._pending):
+            self._flush(collection)
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "documents": self.documents,
+                "pending": sum(len(p) for p in self._pending.values())}
@@ -0,0 +1,298 @@
+"""Delivery brokers that let several worker processes share one chat.
+
+Every worker keeps its own ``ConnectionManager`` holding only the sockets it
+accepted. Frames are published to a topic and the broker hands them to each
+worker that has a recipient connected; the worker then delivers to its own
+sockets only.
+
+Topics:
+    ``user:<id>``   frames for every session of one user
+    ``group:<id>``  frames for a set of group members (routed by recipient)
+    ``users``       frames for any other explicit recipient list
+    ``broadcast``   frames for every connected user
+
+Which users are online is shared the same way: a worker holding a
+``user:<id>`` subscription has a session of that user, and the hub tells
+every worker whether each user is connected to some *other* worker
+(``online_elsewhere``), so presence is global rather than per process.
+
+``InProcessBroker`` is the single-worker default. ``UnixSocketBroker`` talks to
+a hub process over a Unix domain socket so several uvicorn workers on one
+machine can be run side by side::
+
+    python -m app.websockets.broker /tmp/chat-broker.sock
+    WS_BROKER=unix WS_BROKER_PATH=/tmp/chat-broker.sock uvicorn app.main:app --workers 4
+"""
+import abc
+import asyncio
+import logging
+import os
+import sys
+from typing import Callable, Dict, List, Optional, Set
+
+from app.websockets.codec import Frame, decode, encode
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_TOPIC = "broadcast"
+USERS_TOPIC = "users"
+
+# Frames are newline-delimited JSON; allow large group payloads per line
+STREAM_LIMIT = 16 * 1024 * 1024
+
+# deliver(frame, recipients, ephemeral) -> {"delivered": n, "failed": n};
+# recipients=None means every locally connected user
+DeliverCallback = Callable[[Frame, Optional[List[str]], bool], Dict[str, int]]
+# presence(user_id, online_elsewhere): another worker gained or lost the user
+PresenceCallback = Callable[[str, bool], None]
+
+
+def user_topic(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def group_topic(group_id: str) -> str:
+    return f"group:{group_id}"
+
+
+class Broker(abc.ABC):
+    """Interface every broker implements."""
+
+    on_presence: Optional[PresenceCallback] = None
+
+    @abc.abstractmethod
+    async def start(self, deliver: DeliverCallback):
+        """Begin handing frames published for this worker to ``deliver``."""
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, topic: str):
+        """Start receiving frames for ``topic`` on this worker."""
+
+    def unsubscribe(self, topic: str):
+        """Stop receiving frames for ``topic`` on this worker."""
+
+    @abc.abstractmethod
+    async def publish(self, topic: str, message: Frame, recipients: Optional[List[str]] = None,
+                      ephemeral: bool = False) -> Dict[str, int]:
+        """Deliver ``message`` everywhere; returns this worker's local counts."""
+
+    def online_elsewhere(self, user_id: str) -> bool:
+        """Whether ``user_id`` has a session on another worker."""
+        return False
+
+
+class InProcessBroker(Broker):
+    """Single-process broker: publishing is local delivery."""
+
+    def __init__(self):
+        self._deliver: Optional[DeliverCallback] = None
+
+    async def start(self, deliver: DeliverCallback):
+        self._deliver = deliver
+
+    async def publish(self, topic, message, recipients=None, ephemeral=False):
+        return self._deliver(message, recipients, ephemeral)
+
+
+class UnixSocketBroker(Broker):
+    """Worker side of the Unix socket hub.
+
+    Frames are delivered to local sockets straight away and forwarded to the
+    hub, which relays them to the other workers that subscribed to one of the
+    recipients' user topics. The connection is re-established (and the
+    subscriptions replayed) if the hub restarts.
+    """
+
+    def __init__(self, path: str, reconnect_delay: float = 1.0):
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self._deliver: Optional[DeliverCallback] = None
+        self._topics: Set[str] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        # Users the hub reports as connected to another worker
+        self._remote_users: Set[str] = set()
+
+    async def start(self, deliver: DeliverCallback):
+        self._deliver = deliver
+        self._task = asyncio.create_task(self._run())
+
+    def online_elsewhere(self, user_id: str) -> bool:
+        return user_id in self._remote_users
+
+    def _set_remote(self, user_id: str, elsewhere: bool):
+        if elsewhere == (user_id in self._remote_users):
+            return
+        if elsewhere:
+            self._remote_users.add(user_id)
+        else:
+            self._remote_users.discard(user_id)
+        if self.on_presence is not None:
+            self.on_presence(user_id, elsewhere)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    def _send(self, frame: dict):
+        if self._writer is None:
+            return
+        self._writer.write(encode(frame) + b"\n")
+
+    def subscribe(self, topic):
+        self._topics.add(topic)
+        self._send({"op": "sub", "topic": topic})
+
+    def unsubscribe(self, topic):
+        self._topics.discard(topic)
+        self._send({"op": "unsub", "topic": topic})
+
+    async def publish(self, topic, message, recipients=None, ephemeral=False):
+        counts = self._deliver(message, recipients, ephemeral)
+        if self._writer is not None:
+            self._send({"op": "pub", "topic": topic, "message": message.text,
+                        "recipients": recipients, "ephemeral": ephemeral})
+            try:
+                await self._writer.drain()
+            except ConnectionError as e:
+                logger.error(f"Broker hub write failed: {e!r}")
+        return counts
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path, limit=STREAM_LIMIT)
+                logger.info(f"Connected to broker hub at {self.path}")
+                # A restarted hub re-reports everyone; drop what it no longer knows
+                for user_id in list(self._remote_users):
+                    self._set_remote(user_id, False)
+                for topic in self._topics:
+                    self._send({"op": "sub", "topic": topic})
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    frame = decode(line)
+                    if frame.get("op") == "presence":
+                        self._set_remote(frame["user"], frame["elsewhere"])
+                        continue
+                    self._deliver(Frame.from_text(frame["message"]), frame.get("recipients"), frame.get("ephemeral", False))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broker hub connection error: {e!r}")
+            self._writer = None
+            await asyncio.sleep(self.reconnect_delay)
+
+
+class BrokerHub:
+    """Relay between ``UnixSocketBroker`` workers.
+
+    Keeps topic -> worker subscriptions. A published frame goes once to each
+    other worker holding at least one recipient (``user:`` subscriptions are
+    used to resolve group recipients), or to every other worker for
+    ``broadcast``. When the set of workers holding a ``user:`` topic changes,
+    each worker is told if its view of that user (``elsewhere``) changed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.subscriptions: Dict[str, Set[asyncio.StreamWriter]] = {}
+        self.workers: Set[asyncio.StreamWriter] = set()
+        # Per worker: users the worker was last told are online elsewhere
+        self.remote_users: Dict[asyncio.StreamWriter, Set[str]] = {}
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path, limit=STREAM_LIMIT)
+        logger.info(f"Broker hub listening on {self.path}")
+        async with server:
+            await server.serve_forever()
+
+    def _targets(self, origin, topic: str, recipients: Optional[List[str]]) -> Set[asyncio.StreamWriter]:
+        if topic == BROADCAST_TOPIC:
+            targets = set(self.workers)
+        elif recipients is not None:
+            targets = set()
+            for uid in recipients:
+                targets |= self.subscriptions.get(user_topic(uid), set())
+        else:
+            targets = set(self.subscriptions.get(topic, set()))
+        targets.discard(origin)
+        return targets
+
+    def _update_presence(self, topic: str):
+        if not topic.startswith("user:"):
+            return
+        user_id = topic[len("user:"):]
+        holders = self.subscriptions.get(topic, set())
+        for worker in self.workers:
+            elsewhere = bool(holders - {worker})
+            known = self.remote_users.setdefault(worker, set())
+            if elsewhere != (user_id in known):
+                if elsewhere:
+                    known.add(user_id)
+                else:
+                    known.discard(user_id)
+                worker.write(encode({"op": "presence", "user": user_id, "elsewhere": elsewhere}) + b"\n")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.workers.add(writer)
+        # Tell the new worker about everyone already connected elsewhere
+        self.remote_users[writer] = set()
+        for topic in self.subscriptions:
+            self._update_presence(topic)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                frame = decode(line)
+                op = frame.get("op")
+                if op == "sub":
+                    self.subscriptions.setdefault(frame["topic"], set()).add(writer)
+                    self._update_presence(frame["topic"])
+                elif op == "unsub":
+                    self._unsubscribe(frame["topic"], writer)
+                    self._update_presence(frame["topic"])
+                elif op == "pub":
+                    for target in self._targets(writer, frame["topic"], frame.get("recipients")):
+                        target.write(line)
+        except Exception as e:
+            logger.error(f"Broker hub worker error: {e!r}")
+        finally:
+            self.workers.discard(writer)
+            self.remote_users.pop(writer, None)
+            for topic in list(self.subscriptions):
+                if writer in self.subscriptions[topic]:
+                    self._unsubscribe(topic, writer)
+                    self._update_presence(topic)
+            writer.close()
+
+    def _unsubscribe(self, topic: str, writer: asyncio.StreamWriter):
+        subscribers = self.subscriptions.get(topic)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.subscriptions[topic]
+
+
+def create_broker() -> Broker:
+    """Build the broker selected by ``WS_BROKER`` (``memory`` or ``unix``)."""
+    kind = os.getenv("WS_BROKER", "memory")
+    if kind == "unix":
+        return UnixSocketBroker(os.getenv("WS_BROKER_PATH", "/tmp/chat-broker.sock"))
+    if kind != "memory":
+        raise ValueError(f"Unknown WS_BROKER: {kind}")
+    return InProcessBroker()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    hub_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("WS_BROKER_PATH", "/tmp/chat-broker.sock")
+    asyncio.run(BrokerHub(hub_path).serve())
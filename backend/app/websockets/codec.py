@@ -0,0 +1,117 @@
+"""Wire encoding for WebSocket frames.
+
+JSON text is the default protocol. It uses orjson when installed and falls
+back to the stdlib ``json`` module otherwise. Clients that negotiate the
+``msgpack`` subprotocol get the same events as binary MessagePack frames
+(when the ``msgpack`` package is installed). Every encoder handles
+``datetime`` and ``ObjectId`` values the same way (ISO string / hex string),
+so ``model_dump()`` output can be encoded as is and both protocols carry an
+identical schema.
+"""
+import json
+from datetime import date, datetime
+from typing import Any, Union
+
+from bson import ObjectId
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional protocol
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def encode(payload: Any) -> bytes:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+else:
+    def encode(payload: Any) -> bytes:
+        return json.dumps(payload, default=_default, separators=(",", ":")).encode()
+
+    def decode(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+def encode_text(payload: Any) -> str:
+    return encode(payload).decode()
+
+
+def encode_binary(payload: Any) -> bytes:
+    return msgpack.packb(payload, default=_default, use_bin_type=True)
+
+
+def decode_binary(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+def negotiate(offered) -> Union[str, None]:
+    """Pick the subprotocol to accept from the client's offer (None = JSON)."""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in offered:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+class Frame:
+    """An outgoing event, encoded at most once per protocol however many
+    sockets get it.
+
+    A frame may also be built from already-encoded JSON text (e.g. relayed by
+    the broker); the payload is then only decoded if a binary socket needs it.
+    """
+
+    __slots__ = ("_payload", "_text", "_binary")
+
+    def __init__(self, payload: Any):
+        self._payload = payload
+        self._text = None
+        self._binary = None
+
+    @classmethod
+    def from_text(cls, text: str) -> "Frame":
+        frame = cls(None)
+        frame._text = text
+        return frame
+
+    @property
+    def payload(self) -> Any:
+        if self._payload is None and self._text is not None:
+            self._payload = decode(self._text)
+        return self._payload
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = encode_text(self._payload)
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = encode_binary(self.payload)
+        return self._binary
+
+
+def as_frame(message: Union[Frame, dict, str]) -> Frame:
+    """Wrap anything the manager accepts as a message."""
+    if isinstance(message, Frame):
+        return message
+    if isinstance(message, str):
+        return Frame.from_text(message)
+    return Frame(message)
@@ -0,0 +1,98 @@
+"""Table-driven dispatch for client WebSocket events.
+
+Handlers register for an event type with the pydantic model of its payload::
+
+    @registry.on("message", MessageEvent)
+    async def handle_message(ctx: EventContext, event: MessageEvent): ...
+
+The receive loop only calls ``registry.dispatch``; the payload is validated
+once, the handler is looked up in O(1), and every invocation is timed.
+"""
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Type
+
+from pydantic import BaseModel, ValidationError
+
+from app.metrics import Histogram
+from app.websockets.manager import Connection
+
+logger = logging.getLogger(__name__)
+
+
+class EventContext:
+    """The session an event arrived on."""
+
+    __slots__ = ("user_id", "session_id", "connection")
+
+    def __init__(self, user_id: str, session_id: str, connection: Connection):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.connection = connection
+
+    def reply(self, payload: dict) -> bool:
+        """Send a frame back to this session only."""
+        return self.connection.send(payload)
+
+    def error(self, message: str) -> bool:
+        return self.reply({"type": "error", "message": message})
+
+
+Handler = Callable[[EventContext, BaseModel], Awaitable[None]]
+
+
+class EventStats:
+    __slots__ = ("count", "errors", "invalid", "latency")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.invalid = 0
+        self.latency = Histogram()
+
+
+class EventRegistry:
+    def __init__(self):
+        self._handlers: Dict[str, tuple] = {}
+        self.stats: Dict[str, EventStats] = {}
+        self.unknown = 0
+
+    def on(self, event_type: str, model: Type[BaseModel]):
+        def register(handler: Handler) -> Handler:
+            if event_type in self._handlers:
+                raise ValueError(f"Handler already registered for {event_type}")
+            self.stats[event_type] = EventStats()
+            self._handlers[event_type] = (model, handler, self.stats[event_type])
+            return handler
+        return register
+
+    async def dispatch(self, ctx: EventContext, data: dict):
+        event_type: Optional[str] = data.get("type") if isinstance(data, dict) else None
+        # Anything but a string (e.g. a list) is unhashable or can't name a handler
+        entry = self._handlers.get(event_type) if isinstance(event_type, str) else None
+        if entry is None:
+            self.unknown += 1
+            logger.error(f"Unknown message type: {event_type!r}")
+            ctx.error("Unknown message type")
+            return
+        model, handler, stats = entry
+        try:
+            event = model.model_validate(data)
+        except ValidationError as e:
+            stats.invalid += 1
+            logger.warning(f"Invalid {event_type} event from {ctx.user_id}: {e.error_count()} errors")
+            ctx.error(f"Invalid {event_type} event")
+            return
+        start = time.perf_counter()
+        try:
+            await handler(ctx, event)
+        except Exception as e:
+            stats.errors += 1
+            logger.error(f"Error handling {event_type} event: {e}", exc_info=True)
+            ctx.error(str(e))
+        finally:
+            stats.count += 1
+            stats.latency.observe(time.perf_counter() - start)
+
+
+registry = EventRegistry()
@@ -0,0 +1,357 @@
+"""Handlers for the events clients send over /ws/{user_id}.
+
+Importing this module registers every handler with ``events.registry``.
+
+Every event a handler sends to users goes through ``_logged`` first: it is
+queued for the change log and carries its ``seq``, so a client that comes
+back can ask for what it missed with ``sync``. Sync only replays up to the
+log's watermark, and its replies are the only seqs a client resumes from.
+"""
+import logging
+import os
+from datetime import datetime
+from typing import Iterable
+
+from app.models.events import (
+    CreateGroupEvent, ExitGroupEvent, GroupMemberEvent, GroupMessageEvent, MarkReadEvent, MessageEvent,
+    PresenceSnapshotEvent, ReactionEvent, ReplayReactionsEvent, SyncEvent,
+)
+from app.models.group_pydantic import Group as PydanticGroup, GroupMessage
+from app.models.message import Message
+from app.services.change_log import change_log
+from app.services.database import db
+from app.websockets.events import EventContext, registry
+from app.websockets.manager import manager
+from app.websockets.presence import presence
+
+logger = logging.getLogger(__name__)
+
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "100"))
+# Batches sent per sync request; the client asks again while "more" is set
+SYNC_MAX_BATCHES = int(os.getenv("SYNC_MAX_BATCHES", "10"))
+
+
+async def _logged(payload: dict, audience: Iterable[str]) -> dict:
+    """Record ``payload`` in the change log for ``audience`` and tag it with its seq."""
+    payload["seq"] = await change_log.record(audience, payload)
+    return payload
+
+
+# --- GROUP CHAT HANDLING ---
+@registry.on("group_message", GroupMessageEvent)
+async def handle_group_message(ctx: EventContext, event: GroupMessageEvent):
+    group_id = event.groupId
+    members = await db.get_group_members(group_id)
+    logger.debug("Group message attempt", extra={"group_id": group_id, "user_id": ctx.user_id,
+                                                  "members": len(members or ())})
+    if not members or ctx.user_id not in members:
+        ctx.error("Not a group member")
+        return
+    try:
+        # Create and save group message
+        msg_obj = GroupMessage(
+            group_id=group_id,
+            sender_id=ctx.user_id,
+            content=event.content,
+            likes=[],
+            deleted_by=[]
+        )
+        saved_msg = await db.save_group_message(msg_obj)
+        msg_dict = saved_msg.model_dump()
+
+        # Broadcast to all online group members
+        await manager.fanout(await _logged({
+            **msg_dict,
+            "type": "group_message",
+            "_id": saved_msg.id,
+            "from": saved_msg.sender_id,
+            "groupId": saved_msg.group_id
+        }, members), members, group_id=group_id)
+    except Exception as e:
+        logger.error(f"Error saving group message: {e}", exc_info=True)
+        ctx.error("Failed to save message")
+
+
+@registry.on("add_member", GroupMemberEvent)
+async def handle_add_member(ctx: EventContext, event: GroupMemberEvent):
+    group_id, user_to_add = event.groupId, event.userId
+    group = await db.get_group(group_id)
+    if not group or event.by not in group.admins:
+        ctx.error("Only admins can add members")
+        return
+    if user_to_add in group.banned:
+        group.banned.remove(user_to_add)
+    if user_to_add not in group.members:
+        group.members.append(user_to_add)
+        presence.add_contacts(user_to_add, group.members)
+        # Update group in DB
+        await db.update_group(group_id, {"members": group.members, "banned": group.banned})
+        group_dict = group.model_dump()
+        # Notify new user
+        await manager.send_personal_message(
+            await _logged({"type": "group_added", "group": group_dict}, [user_to_add]), user_to_add)
+        # Notify all members
+        await manager.fanout(await _logged({"type": "group_updated", "group": group_dict}, group.members),
+                             group.members, group_id=group.id)
+
+
+@registry.on("remove_member", GroupMemberEvent)
+async def handle_remove_member(ctx: EventContext, event: GroupMemberEvent):
+    group_id, user_to_remove = event.groupId, event.userId
+    group = await db.get_group(group_id)
+    if not group or event.by not in group.admins:
+        ctx.error("Only admins can remove members")
+        return
+    if user_to_remove in group.members:
+        group.members.remove(user_to_remove)
+        if user_to_remove in group.admins:
+            group.admins.remove(user_to_remove)
+        group.banned.append(user_to_remove)
+        # Update group in DB
+        await db.update_group(group_id, {"members": group.members, "admins": group.admins, "banned": group.banned})
+        # Notify removed user
+        await manager.send_personal_message(
+            await _logged({"type": "group_removed", "groupId": group_id}, [user_to_remove]), user_to_remove)
+        # Notify all remaining members
+        await manager.fanout(await _logged({"type": "group_updated", "group": group.model_dump()}, group.members),
+                             group.members, group_id=group.id)
+
+
+@registry.on("promote_admin", GroupMemberEvent)
+async def handle_promote_admin(ctx: EventContext, event: GroupMemberEvent):
+    group_id, user_to_promote = event.groupId, event.userId
+    group = await db.get_group(group_id)
+    if not group or event.by not in group.admins:
+        ctx.error("Only admins can promote admins")
+        return
+    if user_to_promote in group.members and user_to_promote not in group.admins:
+        group.admins.append(user_to_promote)
+        # Update group in DB
+        await db.update_group(group_id, {"admins": group.admins})
+        # Notify all members
+        await manager.fanout(await _logged({"type": "group_updated", "group": group.model_dump()}, group.members),
+                             group.members, group_id=group.id)
+
+
+@registry.on("exit_group", ExitGroupEvent)
+async def handle_exit_group(ctx: EventContext, event: ExitGroupEvent):
+    group_id, user_exiting = event.groupId, event.userId
+    group = await db.get_group(group_id)
+    if not group or user_exiting not in group.members:
+        ctx.error("Not a group member")
+        return
+    # Prevent last admin from leaving
+    if user_exiting in group.admins and len(group.admins) == 1:
+        # Try to auto-promote another member
+        other_members = [m for m in group.members if m != user_exiting]
+        if other_members:
+            group.admins.append(other_members[0])
+        else:
+            ctx.error("Cannot leave as the last admin and member")
+            return
+    if user_exiting in group.admins:
+        group.admins.remove(user_exiting)
+    group.members.remove(user_exiting)
+    # Update group in DB
+    await db.update_group(group_id, {"members": group.members, "admins": group.admins})
+    # Notify all members
+    await manager.fanout(await _logged({"type": "group_updated", "group": group.model_dump()}, group.members),
+                         group.members, group_id=group.id)
+    # Optionally notify the user who left
+    await manager.send_personal_message(
+        await _logged({"type": "group_exited", "groupId": group_id}, [user_exiting]), user_exiting)
+
+
+@registry.on("create_group", CreateGroupEvent)
+async def handle_create_group(ctx: EventContext, event: CreateGroupEvent):
+    try:
+        group_name = event.groupName
+        creator = event.creator
+        members = event.members if event.members is not None else [creator]
+        logger.info("Received create_group event", extra={"group_name": group_name, "creator": creator,
+                                                         "members": len(members)})
+        if not group_name or not creator:
+            ctx.error("Missing groupName or creator")
+            return
+        # Generate a unique groupId
+        group_id = f"g{int(datetime.utcnow().timestamp())}"
+        group_obj = PydanticGroup(
+            id=group_id,
+            name=group_name,
+            members=list(set(members)),
+            admins=[creator],
+            banned=[],
+            createdAt=datetime.utcnow().isoformat()
+        )
+        saved_group = await db.create_group(group_obj)
+        for member_id in saved_group.members:
+            presence.add_contacts(member_id, saved_group.members)
+        logger.info("Group %s created", saved_group.id, extra={"members": len(saved_group.members)})
+        # Notify the creator (and all members)
+        group_dict = saved_group.model_dump()
+        await manager.fanout(await _logged({
+            "type": "group_created",
+            "group": group_dict
+        }, saved_group.members), saved_group.members, group_id=saved_group.id)
+        # Also send group_added to all except creator
+        added = [m for m in saved_group.members if m != creator]
+        await manager.fanout(await _logged({
+            "type": "group_added",
+            "group": group_dict
+        }, added), added, group_id=saved_group.id)
+    except Exception as e:
+        logger.error(f"Error during group creation: {e}", exc_info=True)
+        ctx.error("Internal server error during group creation")
+# --- END GROUP CHAT HANDLING ---
+
+
+@registry.on("sync", SyncEvent)
+async def handle_sync(ctx: EventContext, event: SyncEvent):
+    # Replay the change log after the client's last seen seq, in batches, up to
+    # the watermark: later seqs may still have gaps that are being written
+    since = event.since
+    watermark = await db.change_watermark()
+    for _ in range(SYNC_MAX_BATCHES):
+        changes = await db.get_changes(ctx.user_id, since, watermark, SYNC_BATCH_SIZE)
+        if changes is None:
+            # Too far behind: the client reloads history and continues from here
+            ctx.reply({"type": "sync_reset", "seq": watermark})
+            return
+        more = len(changes) == SYNC_BATCH_SIZE
+        since = changes[-1]["seq"] if more else max(since, watermark)
+        ctx.reply({"type": "sync_batch", "changes": changes, "seq": since, "more": more})
+        if not more:
+            return
+
+
+@registry.on("mark_read", MarkReadEvent)
+async def handle_mark_read(ctx: EventContext, event: MarkReadEvent):
+    entry = await db.mark_read(ctx.user_id, event.chat_id, event.is_group)
+    if entry is None:
+        ctx.error("Chat not found in inbox")
+        return
+    # Every session of the user, so other devices clear the badge too
+    await manager.send_personal_message(
+        await _logged({"type": "inbox_update", "entry": entry.model_dump()}, [ctx.user_id]), ctx.user_id)
+
+
+@registry.on("presence_snapshot", PresenceSnapshotEvent)
+async def handle_presence_snapshot(ctx: EventContext, event: PresenceSnapshotEvent):
+    # Next page of online contacts after initial_status
+    ctx.reply({
+        "type": "presence_snapshot",
+        **presence.snapshot(ctx.user_id, event.cursor)
+    })
+
+
+async def _notify_reaction(payload: dict, msg, group_id: str = None):
+    """Send a like/delete update to everyone who can see ``msg``."""
+    if isinstance(msg, GroupMessage):
+        # For group messages, broadcast to all group members
+        group_id = group_id or msg.group_id
+        members = await db.get_group_members(group_id)
+        if members:
+            await manager.fanout(await _logged(payload, members), members, group_id=group_id)
+    else:
+        # For direct messages, notify both sender and receiver
+        recipients = [msg.sender_id, msg.receiver_id]
+        await manager.fanout(await _logged(payload, recipients), recipients)
+
+
+async def _notify_inbox_deleted(msg, user_id: str):
+    """Send the inbox entries a delete by ``user_id`` may have changed (preview,
+    unread count) to their owners: everyone in the chat after a sender's delete."""
+    everyone = "*" in msg.deleted_by
+    if isinstance(msg, GroupMessage):
+        members = (await db.get_group_members(msg.group_id) or ()) if everyone else [user_id]
+        chats, is_group = {member: msg.group_id for member in members}, True
+    else:
+        chats, is_group = {msg.sender_id: msg.receiver_id, msg.receiver_id: msg.sender_id}, False
+        if not everyone:
+            chats = {user_id: chats[user_id]} if user_id in chats else {}
+    for owner, entry in (await db.get_inbox_entries(chats, is_group)).items():
+        await manager.send_personal_message(
+            await _logged({"type": "inbox_update", "entry": entry.model_dump()}, [owner]), owner)
+
+
+@registry.on("like", ReactionEvent)
+async def handle_like(ctx: EventContext, event: ReactionEvent):
+    logger.debug("Received like event", extra={"user_id": ctx.user_id, "message_id": event.message_id})
+    try:
+        updated_msg = await db.toggle_like(event.message_id, ctx.user_id, is_group_message=event.is_group)
+        await _notify_reaction({
+            "type": "like_update",
+            "message_id": updated_msg.id,
+            "likes": updated_msg.likes
+        }, updated_msg, event.group_id)
+    except Exception as e:
+        logger.error(f"Error toggling like: {e}")
+        ctx.error(str(e))
+
+
+@registry.on("delete", ReactionEvent)
+async def handle_delete(ctx: EventContext, event: ReactionEvent):
+    try:
+        deleted_msg = await db.delete_message(event.message_id, ctx.user_id, is_group_message=event.is_group)
+        await _notify_reaction({
+            "type": "delete_update",
+            "message_id": deleted_msg.id,
+            "deleted_by": deleted_msg.deleted_by,
+            "likes": deleted_msg.likes
+        }, deleted_msg, event.group_id)
+        await _notify_inbox_deleted(deleted_msg, ctx.user_id)
+    except Exception as e:
+        logger.error(f"Error deleting message: {e}")
+        ctx.error(str(e))
+
+
+@registry.on("replay_reactions", ReplayReactionsEvent)
+async def handle_replay_reactions(ctx: EventContext, event: ReplayReactionsEvent):
+    # Likes/unlikes/deletes queued by the client while offline
+    try:
+        updated = await db.apply_reactions(ctx.user_id, [r.model_dump() for r in event.reactions])
+        for msg in updated:
+            if "*" in msg.deleted_by or ctx.user_id in msg.deleted_by:
+                payload = {"type": "delete_update", "message_id": msg.id,
+                           "deleted_by": msg.deleted_by, "likes": msg.likes}
+            else:
+                payload = {"type": "like_update", "message_id": msg.id, "likes": msg.likes}
+            await _notify_reaction(payload, msg)
+            if payload["type"] == "delete_update":
+                await _notify_inbox_deleted(msg, ctx.user_id)
+    except Exception as e:
+        logger.error(f"Error replaying reactions: {e}")
+        ctx.error(str(e))
+
+
+@registry.on("message", MessageEvent)
+async def handle_message(ctx: EventContext, event: MessageEvent):
+    # Handle regular 1-to-1 message
+    try:
+        sender_id = ctx.user_id
+        receiver_id = event.receiver_id
+        msg_obj = Message(
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            content=event.content,
+            likes=[],
+            deleted_by=[]
+        )
+        saved_msg = await db.save_message(msg_obj)
+        presence.add_contacts(sender_id, [receiver_id])
+        logger.debug("Broadcasting message %s -> %s", saved_msg.sender_id, saved_msg.receiver_id,
+                     extra={"online_users": len(manager.online_users)})
+        msg_dict = saved_msg.model_dump()
+        # Every session of both parties, so the sender's other devices stay in sync
+        recipients = [saved_msg.sender_id, saved_msg.receiver_id]
+        await manager.fanout(await _logged({
+            **msg_dict,
+            "type": "message",
+            "_id": saved_msg.id
+        }, recipients), recipients)
+        if not manager.is_online(saved_msg.receiver_id):
+            # Normal for offline recipients; the message is already stored
+            logger.debug("Receiver %s offline, message stored only", saved_msg.receiver_id)
+    except Exception as e:
+        logger.error(f"Error saving message: {str(e)}")
+        ctx.error(str(e))
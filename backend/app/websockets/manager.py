@@ -1,53 +1,251 @@
 from fastapi import WebSocket
-from typing import Dict, Set
-import json
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
+from collections import deque
+import asyncio
 import logging
+import os
+import uuid
+from app.websockets.codec import MSGPACK_SUBPROTOCOL, Frame, as_frame
+from app.websockets.broker import Broker, BROADCAST_TOPIC, USERS_TOPIC, create_broker, group_topic, user_topic
 
 logger = logging.getLogger(__name__)
 
+# Seconds a single socket may take to accept a frame before it is dropped
+SEND_TIMEOUT = 5.0
+
+# Maximum frames waiting to be written to one socket
+OUTBOUND_QUEUE_SIZE = int(os.getenv("WS_OUTBOUND_QUEUE_SIZE", "256"))
+
+# What to do when a socket's outbound queue is full:
+#   "drop_oldest" - discard the oldest ephemeral event (presence status) to
+#                   make room; a queue full of chat messages still evicts
+#                   the consumer so nothing durable is lost silently
+#   "disconnect"  - close the slow consumer straight away
+OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+
+# Close code sent to evicted slow consumers ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class Connection:
+    """One accepted socket with its own bounded outbound queue.
+
+    Frames are queued by ``send`` without awaiting the network; a dedicated
+    writer task drains the queue so a stalled client only ever blocks itself.
+    Sockets that negotiated the msgpack subprotocol are written binary frames.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str, manager: "ConnectionManager", session_id: str,
+                 subprotocol: Optional[str] = None, maxsize: int = OUTBOUND_QUEUE_SIZE, policy: str = OVERFLOW_POLICY):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.session_id = session_id
+        self.binary = subprotocol == MSGPACK_SUBPROTOCOL
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self._manager = manager
+        self._queue: Deque[Tuple[Frame, bool]] = deque()
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._run())
+
+    def send(self, message: Union[Frame, dict, str], ephemeral: bool = False) -> bool:
+        """Queue a frame. Returns False if it was dropped or the socket evicted."""
+        if self.closed:
+            return False
+        if len(self._queue) >= self.maxsize and not self._make_room(ephemeral):
+            return False
+        self._queue.append((as_frame(message), ephemeral))
+        self._ready.set()
+        return True
+
+    def _make_room(self, ephemeral: bool) -> bool:
+        if self.policy == "drop_oldest":
+            for i, (_, queued_ephemeral) in enumerate(self._queue):
+                if queued_ephemeral:
+                    del self._queue[i]
+                    self.dropped += 1
+                    self._manager.dropped_frames += 1
+                    return True
+            if ephemeral:
+                # Nothing cheaper to discard; drop the incoming event instead
+                self.dropped += 1
+                self._manager.dropped_frames += 1
+                return False
+        logger.warning(f"Evicting slow consumer {self.user_id} (session {self.session_id}): outbound queue full ({len(self._queue)} frames)")
+        self._manager.evictions += 1
+        self._manager._evict(self, SLOW_CONSUMER_CLOSE_CODE)
+        return False
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            while self._queue:
+                frame, _ = self._queue.popleft()
+                try:
+                    if self.binary:
+                        await asyncio.wait_for(self.websocket.send_bytes(frame.binary), SEND_TIMEOUT)
+                    else:
+                        await asyncio.wait_for(self.websocket.send_text(frame.text), SEND_TIMEOUT)
+                except Exception as e:
+                    logger.error(f"Error sending message to user {self.user_id}: {e!r}")
+                    self._manager.send_failures += 1
+                    self._manager._evict(self)
+                    return
+            self._ready.clear()
+
+    def close(self, code: Optional[int] = None):
+        """Stop the writer; with a ``code`` also close the socket itself."""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if code is not None:
+            asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    """Registry of live sockets, keyed by user and then by session.
+
+    A user may have several sessions open at once (phone, desktop, browser
+    tabs); every frame addressed to the user goes to each of them, and the
+    user counts as online while at least one session is live.
+
+    Sends go through a ``Broker`` so that, with several workers, frames reach
+    users connected to other processes; this manager only ever writes to its
+    own sockets.
+    """
+
+    def __init__(self, broker: Optional[Broker] = None):
+        self.active_connections: Dict[str, Dict[str, Connection]] = {}
         self.online_users: Set[str] = set()
+        self.broker = broker or create_broker()
+        # Counters for /metrics
+        self.send_failures = 0
+        self.dropped_frames = 0
+        self.evictions = 0
+
+    async def start(self):
+        await self.broker.start(self._deliver_local)
 
-    async def connect(self, websocket: WebSocket, user_id: str):
+    async def stop(self):
+        await self.broker.stop()
+
+    async def connect(self, websocket: WebSocket, user_id: str, subprotocol: Optional[str] = None) -> str:
         norm_user_id = user_id.strip().lower()
-        await websocket.accept()
-        self.active_connections[norm_user_id] = websocket
+        await websocket.accept(subprotocol=subprotocol)
+        session_id = uuid.uuid4().hex
+        connection = Connection(websocket, norm_user_id, self, session_id, subprotocol)
+        connection.start()
+        if norm_user_id not in self.active_connections:
+            self.broker.subscribe(user_topic(norm_user_id))
+        self.active_connections.setdefault(norm_user_id, {})[session_id] = connection
         self.online_users.add(norm_user_id)
-        logger.info(f"User {norm_user_id} connected. Online users: {self.online_users}")
+        logger.info("User %s connected (session %s)", norm_user_id, session_id,
+                    extra={"online_users": len(self.online_users)})
+        return session_id
 
-    def disconnect(self, user_id: str):
+    def disconnect(self, user_id: str, session_id: Optional[str] = None):
+        """Drop one session, or every session of the user if none is given."""
         norm_user_id = user_id.strip().lower()
-        if norm_user_id in self.active_connections:
-            del self.active_connections[norm_user_id]
-        if norm_user_id in self.online_users:
-            self.online_users.remove(norm_user_id)
-        logger.info(f"User {norm_user_id} disconnected. Online users: {self.online_users}")
+        sessions = self.active_connections.get(norm_user_id)
+        if sessions is not None:
+            if session_id is None:
+                for connection in sessions.values():
+                    connection.close()
+                sessions.clear()
+            elif session_id in sessions:
+                sessions.pop(session_id).close()
+            if not sessions:
+                del self.active_connections[norm_user_id]
+                self.broker.unsubscribe(user_topic(norm_user_id))
+        if norm_user_id not in self.active_connections:
+            self.online_users.discard(norm_user_id)
+        logger.info("User %s disconnected (session %s)", norm_user_id, session_id,
+                    extra={"online_users": len(self.online_users)})
+
+    def _evict(self, connection: Connection, code: int = 1011):
+        connection.close(code)
+        sessions = self.active_connections.get(connection.user_id, {})
+        if sessions.get(connection.session_id) is connection:
+            self.disconnect(connection.user_id, connection.session_id)
+
+    def get_connection(self, user_id: str, session_id: str) -> Optional[Connection]:
+        return self.active_connections.get(user_id.strip().lower(), {}).get(session_id)
+
+    def is_online(self, user_id: str) -> bool:
+        return user_id.strip().lower() in self.active_connections
 
     def get_online_users(self) -> Set[str]:
         return self.online_users
 
-    async def send_personal_message(self, message: str, user_id: str):
+    def get_sessions(self, user_id: str) -> List[str]:
+        return list(self.active_connections.get(user_id.strip().lower(), {}))
+
+    def get_queue_depths(self) -> Dict[str, Dict[str, int]]:
+        return {
+            user_id: {session_id: conn.depth for session_id, conn in sessions.items()}
+            for user_id, sessions in self.active_connections.items()
+        }
+
+    def _send_to_user(self, message: Frame, user_id: str, ephemeral: bool) -> Tuple[int, int]:
+        delivered = failed = 0
+        # Copy: a full queue may evict a session while we iterate
+        for connection in list(self.active_connections.get(user_id, {}).values()):
+            if connection.send(message, ephemeral):
+                delivered += 1
+            else:
+                failed += 1
+        return delivered, failed
+
+    def _deliver_local(self, message: Frame, recipients: Optional[List[str]], ephemeral: bool) -> Dict[str, int]:
+        """Broker callback: queue a frame on this worker's sockets only."""
+        delivered = failed = 0
+        targets = list(self.active_connections) if recipients is None else recipients
+        for uid in targets:
+            ok, bad = self._send_to_user(message, uid, ephemeral)
+            delivered += ok
+            failed += bad
+        return {"delivered": delivered, "failed": failed}
+
+    async def send_personal_message(self, message: Union[Frame, dict, str], user_id: str, ephemeral: bool = False) -> bool:
         norm_user_id = user_id.strip().lower()
-        if norm_user_id in self.active_connections:
-            try:
-                await self.active_connections[norm_user_id].send_text(message)
-            except Exception as e:
-                logger.error(f"Error sending message to user {norm_user_id}: {str(e)}")
-                self.disconnect(norm_user_id)
-
-    async def broadcast(self, message: str):
-        disconnected_users = []
-        for user_id, connection in self.active_connections.items():
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"Error broadcasting to user {user_id}: {str(e)}")
-                disconnected_users.append(user_id)
-
-        # Clean up disconnected users
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
-
-manager = ConnectionManager() 
\ No newline at end of file
+        counts = await self.broker.publish(user_topic(norm_user_id), as_frame(message), [norm_user_id], ephemeral)
+        return counts["delivered"] > 0
+
+    async def fanout(self, payload: Union[Frame, dict, str], recipients: Iterable[str], ephemeral: bool = False,
+                     group_id: Optional[str] = None) -> Dict[str, int]:
+        """Queue one frame for many users.
+
+        The payload is serialized once per wire protocol and handed to the
+        outbound queue of every session of each recipient, so a slow socket cannot hold up the
+        rest (each write is still bounded by ``SEND_TIMEOUT`` in the writer
+        task). Pass ``group_id`` to publish on the group's topic. Recipients
+        that are not connected are skipped. Returns delivered/failed counts per
+        session on this worker.
+        """
+        message = as_frame(payload)
+        targets = list({r.strip().lower() for r in recipients})
+        topic = group_topic(group_id) if group_id else USERS_TOPIC
+        return await self.broker.publish(topic, message, targets, ephemeral)
+
+    async def broadcast(self, message: Union[Frame, dict, str], ephemeral: bool = False):
+        await self.broker.publish(BROADCAST_TOPIC, as_frame(message), None, ephemeral)
+
+manager = ConnectionManager()
@@ -0,0 +1,144 @@
+"""Scoped, coalesced presence.
+
+Presence changes are only sent to a user's contacts (direct-message partners
+and co-members of their groups), batched into one ``presence`` delta frame per
+subscriber every ``PRESENCE_FLUSH_INTERVAL`` seconds. A user who drops and
+comes back within ``PRESENCE_DEBOUNCE`` seconds never appears offline.
+
+With several workers, "online" means connected to any of them
+(``Broker.online_elsewhere``). A worker only announces a user offline once
+no worker holds a session; if the user's last local session closes while
+another worker still has one, the change is handed off and announced when
+the broker reports that worker losing it too (in a close race both workers
+may announce the same offline, which clients apply idempotently).
+"""
+import asyncio
+import bisect
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.services.database import db
+from app.websockets.manager import ConnectionManager, manager
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "1.0"))
+PRESENCE_DEBOUNCE = float(os.getenv("PRESENCE_DEBOUNCE", "3.0"))
+PRESENCE_PAGE_SIZE = 200
+
+
+class PresenceTracker:
+    def __init__(self, connections: ConnectionManager, flush_interval: float = PRESENCE_FLUSH_INTERVAL,
+                 debounce: float = PRESENCE_DEBOUNCE):
+        self.connections = connections
+        self.flush_interval = flush_interval
+        self.debounce = debounce
+        # Contacts of every user that is online or pending offline
+        self.contacts: Dict[str, Set[str]] = {}
+        # Changes not yet announced: user -> "online"/"offline"
+        self._pending: Dict[str, str] = {}
+        # Users whose last session closed, and when
+        self._leaving: Dict[str, float] = {}
+        # Users whose last local session closed while another worker had one
+        self._handed_off: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        connections.broker.on_presence = self._remote_changed
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def is_online(self, user_id: str) -> bool:
+        """Connected to this worker or any other."""
+        return self.connections.is_online(user_id) or self.connections.broker.online_elsewhere(user_id)
+
+    async def user_connected(self, user_id: str):
+        """Called when a user's first session on this worker opens."""
+        self._handed_off.discard(user_id)
+        if user_id in self._leaving:
+            # Reconnected inside the debounce window: nothing to announce
+            del self._leaving[user_id]
+            self._pending.pop(user_id, None)
+            return
+        if user_id not in self.contacts:
+            self.contacts[user_id] = await db.get_contacts(user_id)
+        if not self.connections.broker.online_elsewhere(user_id):
+            self._pending[user_id] = "online"
+
+    def user_disconnected(self, user_id: str):
+        """Called when a user's last session on this worker closes."""
+        if self.connections.broker.online_elsewhere(user_id):
+            # Still online; announce offline when the other worker loses them
+            self._handed_off.add(user_id)
+            return
+        if self._pending.get(user_id) == "online":
+            # Never announced, so there is nothing to retract
+            del self._pending[user_id]
+            self.contacts.pop(user_id, None)
+            return
+        self._leaving[user_id] = time.monotonic()
+
+    def _remote_changed(self, user_id: str, elsewhere: bool):
+        if elsewhere:
+            if user_id in self._leaving:
+                # Came back on another worker inside the debounce window
+                del self._leaving[user_id]
+                self._handed_off.add(user_id)
+        elif user_id in self._handed_off and not self.connections.is_online(user_id):
+            self._handed_off.discard(user_id)
+            self._leaving[user_id] = time.monotonic()
+
+    def add_contacts(self, user_id: str, others: Iterable[str]):
+        """Record new contact edges (new conversation, group membership)."""
+        others = [o for o in others if o != user_id]
+        if user_id in self.contacts:
+            self.contacts[user_id].update(others)
+        for other in others:
+            if other in self.contacts:
+                self.contacts[other].add(user_id)
+
+    def snapshot(self, user_id: str, cursor: Optional[str] = None, limit: int = PRESENCE_PAGE_SIZE) -> dict:
+        """One page of the user's online contacts, ordered by username."""
+        online = sorted(c for c in self.contacts.get(user_id, ()) if self.is_online(c))
+        start = bisect.bisect_right(online, cursor) if cursor else 0
+        page = online[start:start + limit]
+        next_cursor = page[-1] if start + limit < len(online) else None
+        return {"online_users": page, "next_cursor": next_cursor}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing presence: {e}", exc_info=True)
+
+    async def flush(self):
+        now = time.monotonic()
+        for user_id, left_at in list(self._leaving.items()):
+            if now - left_at >= self.debounce:
+                del self._leaving[user_id]
+                self._pending[user_id] = "offline"
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+
+        # Invert user -> change into subscriber -> delta
+        deltas: Dict[str, Dict[str, List[str]]] = {}
+        for user_id, status in pending.items():
+            watchers = self.contacts.get(user_id, ())
+            if status == "offline":
+                self.contacts.pop(user_id, None)
+            for watcher in watchers:
+                delta = deltas.setdefault(watcher, {"online": [], "offline": []})
+                delta[status].append(user_id)
+        for watcher, delta in deltas.items():
+            await self.connections.send_personal_message({"type": "presence", **delta}, watcher, ephemeral=True)
+
+
+presence = PresenceTracker(manager)
@@ -0,0 +1,2 @@
+# Benchmarks for the backend; run each module with "python -m benchmarks.<name>"
+# from the backend directory.
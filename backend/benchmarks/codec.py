@@ -0,0 +1,73 @@
+"""Encode/decode cost per message: stdlib json versus app.websockets.codec.
+
+Compares the old hot path (model_dump, hand-converted datetime, one
+json.dumps per recipient) with encoding a frame once, and the JSON and
+msgpack wire protocols by payload size and encode/decode time::
+
+    python -m benchmarks.codec --recipients 50 --iterations 20000
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime
+
+from app.models.message import MessageInDB
+from app.websockets import codec
+
+
+def sample_message() -> MessageInDB:
+    return MessageInDB(
+        _id="665f1c2e9b1e8a3d4c5b6a79",
+        sender_id="alice",
+        receiver_id="bob",
+        content="hello " * 20,
+        likes=["carol", "dave"],
+    )
+
+
+def old_encode(msg: MessageInDB, recipients: int):
+    for _ in range(recipients):
+        msg_dict = msg.model_dump()
+        if isinstance(msg_dict.get("timestamp"), datetime):
+            msg_dict["timestamp"] = msg_dict["timestamp"].isoformat()
+        json.dumps({**msg_dict, "type": "message", "_id": msg.id})
+
+
+def new_encode(msg: MessageInDB, recipients: int):
+    frame = codec.Frame({**msg.model_dump(), "type": "message", "_id": msg.id})
+    for _ in range(recipients):
+        frame.text
+
+
+def report(label: str, seconds: float, iterations: int):
+    print(f"{label:<32} {seconds / iterations * 1e6:8.2f} us/message")
+
+
+def main(recipients: int, iterations: int):
+    print(f"codec backend: {'orjson' if codec.orjson is not None else 'stdlib json'}")
+    msg = sample_message()
+    raw = codec.encode_text({**msg.model_dump(), "type": "message", "_id": msg.id})
+    print(f"frame size: {len(raw)} bytes")
+
+    report(f"encode old ({recipients} recipients)", timeit.timeit(lambda: old_encode(msg, recipients), number=iterations), iterations)
+    report(f"encode new ({recipients} recipients)", timeit.timeit(lambda: new_encode(msg, recipients), number=iterations), iterations)
+    report("decode json.loads", timeit.timeit(lambda: json.loads(raw), number=iterations), iterations)
+    report("decode codec.decode", timeit.timeit(lambda: codec.decode(raw), number=iterations), iterations)
+
+    if codec.msgpack is None:
+        print("msgpack not installed; skipping binary protocol")
+        return
+    payload = {**msg.model_dump(), "type": "message", "_id": msg.id}
+    packed = codec.encode_binary(payload)
+    print(f"msgpack frame size: {len(packed)} bytes ({len(packed) / len(raw.encode()):.0%} of JSON)")
+    report("encode JSON (codec.encode)", timeit.timeit(lambda: codec.encode(payload), number=iterations), iterations)
+    report("encode msgpack", timeit.timeit(lambda: codec.encode_binary(payload), number=iterations), iterations)
+    report("decode msgpack", timeit.timeit(lambda: codec.decode_binary(packed), number=iterations), iterations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    main(args.recipients, args.iterations)
@@ -0,0 +1,42 @@
+"""Cost of AuthService.verify_token with and without the token cache.
+
+Simulates clients polling REST endpoints with a fixed set of tokens::
+
+    python -m benchmarks.token_cache --tokens 1000 --iterations 100000
+"""
+import argparse
+import random
+import timeit
+
+from app.services.auth_service import AuthService, token_cache
+
+
+def main(tokens: int, iterations: int):
+    pool = [AuthService.create_access_token({"sub": f"user{i}"}) for i in range(tokens)]
+    picks = [random.choice(pool) for _ in range(iterations)]
+
+    def run():
+        for token in picks:
+            AuthService.verify_token(token)
+
+    # Uncached: an empty cache that never keeps anything
+    maxsize = token_cache.maxsize
+    token_cache.maxsize = 0
+    uncached = timeit.timeit(run, number=1)
+    token_cache.maxsize = maxsize
+
+    run()  # warm
+    token_cache.hits = token_cache.misses = 0
+    cached = timeit.timeit(run, number=1)
+
+    print(f"verify_token uncached  {uncached / iterations * 1e6:8.2f} us/call")
+    print(f"verify_token cached    {cached / iterations * 1e6:8.2f} us/call  ({uncached / cached:.1f}x)")
+    print(f"cache stats: {token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+    main(args.tokens, args.iterations)
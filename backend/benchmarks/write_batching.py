@@ -0,0 +1,71 @@
+"""Per-message insert_one versus WriteBatcher group commit.
+
+Needs a reachable MongoDB (MONGO_URI); writes to a scratch ``chat_app_bench``
+database which is dropped afterwards::
+
+    python -m benchmarks.write_batching --messages 5000 --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.services.write_batcher import WriteBatcher
+
+
+def make_doc(i: int) -> dict:
+    return {
+        "sender_id": f"user{i % 50}",
+        "receiver_id": f"user{(i + 1) % 50}",
+        "content": f"benchmark message {i}",
+        "timestamp": datetime.utcnow(),
+        "likes": [],
+        "deleted_by": [],
+    }
+
+
+async def run(insert, messages: int, concurrency: int) -> float:
+    """Insert ``messages`` docs from ``concurrency`` workers; returns msgs/sec."""
+    counter = iter(range(messages))
+
+    async def worker():
+        for i in counter:
+            await insert(make_doc(i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return messages / (time.perf_counter() - start)
+
+
+async def main(messages: int, concurrency: int, batch_size: int, delay: float):
+    load_dotenv()
+    client = AsyncIOMotorClient(os.getenv("MONGO_URI"))
+    bench_db = client.chat_app_bench
+    await bench_db.messages.drop()
+    try:
+        single = await run(lambda doc: bench_db.messages.insert_one(doc), messages, concurrency)
+        print(f"insert_one:   {single:10.0f} msgs/sec")
+
+        batcher = WriteBatcher(bench_db, max_batch=batch_size, max_delay=delay)
+        batched = await run(lambda doc: batcher.insert("messages", doc), messages, concurrency)
+        await batcher.flush()
+        stats = batcher.stats()
+        print(f"batched:      {batched:10.0f} msgs/sec "
+              f"({stats['batches']} batches, avg {stats['documents'] / max(stats['batches'], 1):.1f} docs)")
+        print(f"speedup:      {batched / single:10.2f}x")
+    finally:
+        await client.drop_database("chat_app_bench")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--delay", type=float, default=0.005)
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.concurrency, args.batch_size, args.delay))
@@ -0,0 +1,13 @@
+"""WebSocket load generator for /ws/{user_id}.
+
+Starts the FastAPI app in a subprocess on the in-memory storage backend
+(``STORAGE_BACKEND=memory``), opens many authenticated clients and
+drives a configurable mix of events. It reports throughput, p50/p99
+send-to-receive latency, server memory per connection and event-loop lag,
+and writes the results as JSON so runs can be compared between commits::
+
+    python -m benchmarks.ws_load --clients 2000 --duration 30 \\
+        --mix message=70,group_message=20,like=8,delete=2 --storm-every 10
+
+Needs the ``websockets`` client package (installed with ``uvicorn[standard]``).
+"""
@@ -0,0 +1,312 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import websockets
+
+from app.services.auth_service import AuthService
+
+BENCH_PREFIX = "bench|"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "..", "results")
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"message", "group_message", "like", "delete"}
+    if unknown:
+        raise SystemExit(f"Unknown event types in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def rss_kib(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None  # not Linux
+    return None
+
+
+def scrape(port: int) -> str:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        return response.read().decode()
+
+
+def lag_buckets(text: str) -> Dict[str, float]:
+    buckets = {}
+    for line in text.splitlines():
+        if line.startswith("chat_event_loop_lag_seconds_bucket"):
+            le = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets[le] = float(line.rsplit(" ", 1)[1])
+    return buckets
+
+
+def lag_summary(before: Dict[str, float], after: Dict[str, float]) -> dict:
+    """p50/p99 upper bounds (seconds) of the lag histogram over the run."""
+    diff = [(le, after[le] - before.get(le, 0)) for le in after]
+    total = diff[-1][1] if diff else 0
+    summary = {"samples": total}
+    for name, q in (("p50_le", 0.5), ("p99_le", 0.99)):
+        summary[name] = next((le for le, count in diff if total and count >= q * total), None)
+    return summary
+
+
+class Client:
+    def __init__(self, bench: "Bench", index: int):
+        self.bench = bench
+        self.username = f"user{index}"
+        self.group_id = f"g{index // bench.group_size}"
+        first = (index // bench.group_size) * bench.group_size
+        self.peers = [f"user{i}" for i in range(first, min(first + bench.group_size, bench.clients)) if i != index]
+        self.token = AuthService.create_access_token({"sub": self.username})
+        self.known = deque(maxlen=50)  # (message_id, is_group) this client has seen
+        self.ws = None
+        self.open = False
+        self.reader: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        url = f"ws://127.0.0.1:{self.bench.port}/ws/{self.username}?token={self.token}"
+        self.ws = await websockets.connect(url, max_queue=None, open_timeout=60)
+        self.open = True
+        self.reader = asyncio.create_task(self.read())
+
+    async def close(self):
+        self.open = False
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            await asyncio.gather(self.reader, return_exceptions=True)
+
+    async def read(self):
+        try:
+            async for raw in self.ws:
+                self.bench.on_frame(self, json.loads(raw))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.open = False
+
+    async def send(self, event_type: str):
+        if event_type in ("like", "delete") and self.known:
+            message_id, is_group = random.choice(self.known)
+            payload = {"type": event_type, "message_id": message_id, "is_group": is_group}
+            if is_group:
+                payload["group_id"] = self.group_id
+        elif event_type == "group_message" or (event_type in ("like", "delete") and not self.peers):
+            event_type = "group_message"
+            payload = {"type": event_type, "groupId": self.group_id,
+                       "content": f"{BENCH_PREFIX}{time.perf_counter()}"}
+        else:
+            event_type = "message"
+            payload = {"type": event_type, "receiver_id": random.choice(self.peers or [self.username]),
+                       "content": f"{BENCH_PREFIX}{time.perf_counter()}"}
+        try:
+            await self.ws.send(json.dumps(payload))
+            self.bench.sent[event_type] += 1
+        except websockets.ConnectionClosed:
+            self.bench.send_failures += 1
+
+
+class Bench:
+    def __init__(self, args):
+        self.port = args.port
+        self.clients = args.clients
+        self.group_size = args.group_size
+        self.duration = args.duration
+        self.rate = args.rate
+        self.mix = parse_mix(args.mix)
+        self.storm_every = args.storm_every
+        self.storm_fraction = args.storm_fraction
+        self.connect_concurrency = args.connect_concurrency
+        self.sent = Counter()
+        self.received = Counter()
+        self.latencies: List[float] = []
+        self.send_failures = 0
+        self.errors = Counter()
+        self.storms: List[dict] = []
+        self.measuring = False
+
+    def on_frame(self, client: Client, data: dict):
+        kind = data.get("type")
+        self.received[kind] += 1
+        if kind == "error":
+            self.errors[data.get("message", "")] += 1
+        elif kind in ("message", "group_message"):
+            client.known.append((data.get("_id"), kind == "group_message"))
+            content = data.get("content") or ""
+            if self.measuring and content.startswith(BENCH_PREFIX) and data.get("sender_id") != client.username:
+                self.latencies.append(time.perf_counter() - float(content[len(BENCH_PREFIX):]))
+
+    async def connect_all(self, clients: List[Client]) -> float:
+        limit = asyncio.Semaphore(self.connect_concurrency)
+
+        async def one(client: Client):
+            async with limit:
+                await client.connect()
+        start = time.perf_counter()
+        await asyncio.gather(*(one(c) for c in clients))
+        return time.perf_counter() - start
+
+    async def drive(self, client: Client, until: float):
+        # Poisson arrivals per client, rate split evenly across clients
+        interval = self.clients / self.rate
+        kinds, weights = list(self.mix), list(self.mix.values())
+        while time.perf_counter() < until:
+            await asyncio.sleep(random.expovariate(1 / interval))
+            if client.open:
+                await client.send(random.choices(kinds, weights)[0])
+
+    async def storm(self, clients: List[Client], until: float):
+        while self.storm_every and time.perf_counter() + self.storm_every < until:
+            await asyncio.sleep(self.storm_every)
+            victims = random.sample(clients, max(1, int(len(clients) * self.storm_fraction)))
+            await asyncio.gather(*(c.close() for c in victims))
+            elapsed = await self.connect_all(victims)
+            self.storms.append({"clients": len(victims), "reconnect_seconds": round(elapsed, 3)})
+
+    async def run(self, server_pid: int) -> dict:
+        clients = [Client(self, i) for i in range(self.clients)]
+        rss_idle = rss_kib(server_pid)
+        connect_seconds = await self.connect_all(clients)
+        await asyncio.sleep(1)  # let initial_status and presence settle
+        rss_connected = rss_kib(server_pid)
+        lag_before = lag_buckets(await asyncio.to_thread(scrape, self.port))
+
+        self.measuring = True
+        start = time.perf_counter()
+        until = start + self.duration
+        await asyncio.gather(self.storm(clients, until), *(self.drive(c, until) for c in clients))
+        await asyncio.sleep(1)  # drain in-flight deliveries
+        self.measuring = False
+        elapsed = time.perf_counter() - start
+
+        lag_after = lag_buckets(await asyncio.to_thread(scrape, self.port))
+        rss_loaded = rss_kib(server_pid)
+        await asyncio.gather(*(c.close() for c in clients))
+
+        sent = sum(self.sent.values())
+        per_connection = None
+        if rss_idle is not None and rss_connected is not None:
+            per_connection = round((rss_connected - rss_idle) / self.clients, 2)
+        return {
+            "connect_seconds": round(connect_seconds, 3),
+            "sent": dict(self.sent),
+            "received": dict(self.received),
+            "send_failures": self.send_failures,
+            "errors": dict(self.errors),
+            "throughput": {
+                "sent_per_second": round(sent / elapsed, 1),
+                "delivered_per_second": round(len(self.latencies) / elapsed, 1),
+            },
+            "latency_ms": {
+                "samples": len(self.latencies),
+                **{name: round(v * 1000, 3) if v is not None else None for name, v in (
+                    ("p50", percentile(self.latencies, 0.5)),
+                    ("p90", percentile(self.latencies, 0.9)),
+                    ("p99", percentile(self.latencies, 0.99)),
+                    ("max", max(self.latencies, default=None)),
+                )},
+            },
+            "memory_kib": {"idle": rss_idle, "connected": rss_connected, "loaded": rss_loaded,
+                           "per_connection": per_connection},
+            "event_loop_lag": lag_summary(lag_before, lag_after),
+            "reconnect_storms": self.storms,
+        }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"vs {baseline_path} (commit {baseline.get('commit')}):")
+    for section, key in (("throughput", "delivered_per_second"), ("latency_ms", "p50"),
+                         ("latency_ms", "p99"), ("memory_kib", "per_connection")):
+        old = baseline["results"].get(section, {}).get(key)
+        new = current["results"].get(section, {}).get(key)
+        change = f"{(new - old) / old:+.1%}" if old and new is not None else "n/a"
+        print(f"  {section}.{key:<22} {old} -> {new} ({change})")
+
+
+async def wait_ready(port: int, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("Server exited during startup")
+        try:
+            await asyncio.to_thread(scrape, port)
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise SystemExit("Server did not start in time")
+
+
+async def main(args):
+    env = {**os.environ, "LOG_LEVEL": "WARNING"}
+    server = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.ws_load.server", "--port", str(args.port),
+        "--users", str(args.clients), "--group-size", str(args.group_size),
+    ], env=env)
+    try:
+        await wait_ready(args.port, server)
+        results = await Bench(args).run(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"ws_load-{report['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"results written to {output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket load benchmark for /ws/{user_id}")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load after connecting")
+    parser.add_argument("--rate", type=float, default=2000, help="events/second across all clients")
+    parser.add_argument("--mix", default="message=70,group_message=20,like=8,delete=2")
+    parser.add_argument("--group-size", type=int, default=20)
+    parser.add_argument("--storm-every", type=float, default=0, help="seconds between reconnect storms (0 = off)")
+    parser.add_argument("--storm-fraction", type=float, default=0.2)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="JSON results path (default benchmarks/results/ws_load-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    asyncio.run(main(parser.parse_args()))
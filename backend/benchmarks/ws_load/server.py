@@ -0,0 +1,42 @@
+"""Run the app on the in-memory store; started by ``benchmarks.ws_load``.
+
+Can also be run by hand to point another load tool at it::
+
+    python -m benchmarks.ws_load.server --port 8765 --users 2000 --group-size 20
+"""
+import argparse
+import asyncio
+import os
+
+import uvicorn
+
+# Must be set before anything imports app.services.database
+os.environ["STORAGE_BACKEND"] = "memory"
+
+from app.main import app  # noqa: E402
+from app.models.group_pydantic import Group  # noqa: E402
+from app.services.database import db  # noqa: E402
+
+
+async def seed(users: int, group_size: int):
+    """Create ``users`` users and split them into groups of ``group_size``."""
+    for i in range(users):
+        await db.create_user(f"user{i}", "unused", "0000")
+    for start in range(0, users, group_size):
+        members = [f"user{i}" for i in range(start, min(start + group_size, users))]
+        group_id = f"g{start // group_size}"
+        await db.create_group(Group(id=group_id, name=group_id, members=members, admins=members[:1]))
+
+
+def main(port: int, users: int, group_size: int):
+    asyncio.run(seed(users, group_size))
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--group-size", type=int, default=20)
+    args = parser.parse_args()
+    main(args.port, args.users, args.group_size)
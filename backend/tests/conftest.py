@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STORAGE_BACKENDS = ["memory", "sqlite", "mongo"]
+
+
+def _mongo_available() -> bool:
+    uri = os.getenv("MONGO_URI")
+    if not uri:
+        return False
+    try:
+        from pymongo import MongoClient
+        MongoClient(uri, serverSelectionTimeoutMS=1000).admin.command("ping")
+    except Exception:
+        return False
+    return True
+
+
+@pytest.fixture(params=STORAGE_BACKENDS)
+def run(request, tmp_path):
+    """Call ``run(body)`` to await ``body(storage)`` on a fresh, empty backend.
+
+    Each call gets its own event loop and store. Mongo runs against a
+    throwaway database and is skipped unless ``MONGO_URI`` answers.
+    """
+    backend = request.param
+    if backend == "mongo":
+        pytest.importorskip("motor")
+        if not _mongo_available():
+            pytest.skip("MONGO_URI not set or not reachable")
+
+    def runner(body):
+        async def main():
+            if backend == "memory":
+                from app.services.memory_store import MemoryStorage
+                storage = MemoryStorage()
+            elif backend == "sqlite":
+                from app.services.sqlite_store import SQLiteStorage
+                storage = SQLiteStorage(str(tmp_path / f"{uuid.uuid4().hex}.db"))
+            else:
+                from app.services.database import Database
+                storage = Database()
+                storage.db = storage.client[f"chat_test_{uuid.uuid4().hex}"]
+                if storage.batcher is not None:
+                    storage.batcher.db = storage.db
+            await storage.ensure_indexes()
+            try:
+                return await body(storage)
+            finally:
+                await storage.close()
+                if backend == "mongo":
+                    await storage.client.drop_database(storage.db.name)
+        return asyncio.run(main())
+    return runner
@@ -0,0 +1,67 @@
+"""Verified-token cache and revocation in ``AuthService``."""
+import time
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("jose")
+
+from app.services import auth_service
+from app.services.auth_service import AuthService, TokenCache, TokenDenylist
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(auth_service, "token_cache", TokenCache(maxsize=2, ttl=60))
+    monkeypatch.setattr(auth_service, "token_denylist", TokenDenylist())
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TokenCache(maxsize=2, ttl=60)
+    cache.put("a", "alice", None)
+    cache.put("b", "bob", None)
+    assert cache.get("a") == "alice"
+    cache.put("c", "carol", None)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("alice", "carol")
+    assert cache.stats() == {"hits": 3, "misses": 1, "size": 2}
+
+
+def test_cache_entries_expire_with_the_token():
+    cache = TokenCache(maxsize=10, ttl=60)
+    cache.put("expired", "alice", time.time() - 1)
+    assert cache.get("expired") is None and cache.stats()["size"] == 0
+    cache = TokenCache(maxsize=10, ttl=0)
+    cache.put("stale", "alice", time.time() + 3600)
+    assert cache.get("stale") is None
+
+
+def test_verified_tokens_are_cached():
+    token = AuthService.create_access_token({"sub": " Alice "})
+    assert AuthService.verify_token(token) == "alice"
+    assert AuthService.verify_token(token) == "alice"
+    assert auth_service.token_cache.stats()["hits"] == 1
+    assert AuthService.verify_token("not-a-jwt") is None
+    expired = AuthService.create_access_token({"sub": "alice"}, expires_delta=timedelta(seconds=-1))
+    assert AuthService.verify_token(expired) is None
+
+
+def test_revoked_tokens_are_rejected_even_once_cached():
+    token = AuthService.create_access_token({"sub": "alice"})
+    other = AuthService.create_access_token({"sub": "alice", "device": "phone"})
+    assert AuthService.verify_token(token) == "alice"
+    AuthService.revoke_token(token)
+    assert AuthService.verify_token(token) is None
+    assert AuthService.verify_token(other) == "alice"
+
+
+def test_revoking_a_user_rejects_earlier_tokens_only(monkeypatch):
+    token = AuthService.create_access_token({"sub": "alice"})
+    bob = AuthService.create_access_token({"sub": "bob"})
+    assert AuthService.verify_token(token) == "alice"
+    # Issued in an earlier second than the revocation
+    later = time.time() + 2
+    monkeypatch.setattr(time, "time", lambda: later)
+    AuthService.revoke_user_tokens("alice")
+    assert AuthService.verify_token(token) is None
+    assert AuthService.verify_token(bob) == "bob"
@@ -0,0 +1,92 @@
+"""``BrokerHub`` relaying frames and presence between ``UnixSocketBroker`` workers."""
+import asyncio
+import sys
+
+import pytest
+
+from app.websockets.broker import BROADCAST_TOPIC, BrokerHub, UnixSocketBroker, group_topic, user_topic
+from app.websockets.codec import Frame
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="needs Unix domain sockets")
+
+
+class Worker:
+    """One worker process: a broker plus the frames it delivered locally."""
+
+    def __init__(self, path):
+        self.broker = UnixSocketBroker(path, reconnect_delay=0.01)
+        self.delivered = []
+        self.presence = []
+        self.broker.on_presence = lambda user_id, elsewhere: self.presence.append((user_id, elsewhere))
+
+    def deliver(self, message, recipients, ephemeral):
+        self.delivered.append((message.payload, recipients))
+        return {"delivered": 1, "failed": 0}
+
+    async def start(self):
+        await self.broker.start(self.deliver)
+        await _until(lambda: self.broker._writer is not None)
+
+
+async def _until(condition, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def _with_hub(tmp_path, body):
+    async def main():
+        hub = BrokerHub(str(tmp_path / "hub.sock"))
+        server = asyncio.create_task(hub.serve())
+        await _until(lambda: (tmp_path / "hub.sock").exists())
+        workers = [Worker(hub.path), Worker(hub.path)]
+        for worker in workers:
+            await worker.start()
+        try:
+            await body(hub, *workers)
+        finally:
+            for worker in workers:
+                await worker.broker.stop()
+            server.cancel()
+    asyncio.run(main())
+
+
+def test_frames_reach_workers_holding_a_recipient(tmp_path):
+    async def body(hub, first, second):
+        first.broker.subscribe(user_topic("alice"))
+        second.broker.subscribe(user_topic("bob"))
+        await _until(lambda: len(hub.subscriptions) == 2)
+        counts = await first.broker.publish(group_topic("g1"), Frame({"n": 1}), ["alice", "bob"])
+        # Local delivery happens straight away; the hub relays to the other worker once
+        assert counts == {"delivered": 1, "failed": 0}
+        await _until(lambda: second.delivered)
+        assert second.delivered == [({"n": 1}, ["alice", "bob"])]
+        # Workers without a recipient, or the publisher itself, get nothing back
+        await second.broker.publish(user_topic("carol"), Frame({"n": 2}), ["carol"])
+        await second.broker.publish(BROADCAST_TOPIC, Frame({"n": 3}), None)
+        await _until(lambda: len(first.delivered) == 2)
+        assert first.delivered == [({"n": 1}, ["alice", "bob"]), ({"n": 3}, None)]
+        assert len(second.delivered) == 3
+    _with_hub(tmp_path, body)
+
+
+def test_presence_is_shared_between_workers(tmp_path):
+    async def body(hub, first, second):
+        first.broker.subscribe(user_topic("alice"))
+        await _until(lambda: second.broker.online_elsewhere("alice"))
+        assert not first.broker.online_elsewhere("alice")
+        # A second worker holding the user makes it online elsewhere for both
+        second.broker.subscribe(user_topic("alice"))
+        await _until(lambda: first.broker.online_elsewhere("alice"))
+        assert second.broker.online_elsewhere("alice")
+        first.broker.unsubscribe(user_topic("alice"))
+        await _until(lambda: not second.broker.online_elsewhere("alice"))
+        assert first.presence == [("alice", True)]
+        assert second.presence == [("alice", True), ("alice", False)]
+        # A worker dropping off the hub takes its users with it
+        await second.broker.stop()
+        await _until(lambda: not first.broker.online_elsewhere("alice"))
+        assert first.presence == [("alice", True), ("alice", False)]
+    _with_hub(tmp_path, body)
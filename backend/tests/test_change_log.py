@@ -0,0 +1,97 @@
+"""``ChangeLog`` seq blocks, background writes and the served watermark."""
+import asyncio
+
+import pytest
+
+# The module builds its singleton over the Mongo Database
+pytest.importorskip("motor")
+
+from app.services.change_log import ChangeLog
+from app.services.memory_store import MemoryStorage
+
+
+def _log(storage):
+    return ChangeLog(storage, block_size=3, flush_interval=0.01, block_idle=0.05)
+
+
+async def _until(condition, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not await condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def _types(storage, watermark):
+    return [change["type"] for change in await storage.get_changes("alice", 0, watermark, 10)]
+
+
+def test_blocks_are_reserved_per_writer_and_served_up_to_the_watermark(run):
+    async def body(storage):
+        first, second = _log(storage), _log(storage)
+        seqs = [await first.record(["alice"], {"type": f"a{i}"}) for i in range(4)]
+        assert seqs == list(range(seqs[0], seqs[0] + 4))
+        # Moving to a new block wrote the old one's entries first
+        assert first.pending == 1
+        other = await second.record(["alice", "bob"], {"type": "b"})
+        assert other >= seqs[0] + 6
+        await second.start()
+
+        async def written():
+            return second.pending == 0 and await storage.change_watermark() >= seqs[2]
+        await _until(written)
+        # first still holds seqs[3] unwritten, so nothing from there on is served
+        watermark = await storage.change_watermark()
+        assert seqs[2] <= watermark < seqs[3]
+        assert await _types(storage, watermark) == ["a0", "a1", "a2"]
+        await first.start()
+
+        # Written, then both blocks are released once idle
+        async def released():
+            return await storage.change_watermark() >= other
+        await _until(released)
+        watermark = await storage.change_watermark()
+        assert await _types(storage, watermark) == ["a0", "a1", "a2", "a3", "b"]
+        await first.stop()
+        await second.stop()
+    run(body)
+
+
+def test_stop_writes_what_is_queued(run):
+    async def body(storage):
+        log = _log(storage)
+        seq = await log.record(["alice"], {"type": "a"})
+        await log.stop()
+        assert log.pending == 0
+        watermark = await storage.change_watermark()
+        assert watermark >= seq and await _types(storage, watermark) == ["a"]
+    run(body)
+
+
+class FlakyStorage(MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.failures = 1
+
+    async def write_changes(self, writer_id, entries, floor):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("storage unavailable")
+        return await super().write_changes(writer_id, entries, floor)
+
+
+def test_failed_writes_are_retried():
+    async def main():
+        storage = FlakyStorage()
+        log = _log(storage)
+        seq = await log.record(["alice"], {"type": "a"})
+        await log.start()
+
+        async def written():
+            return log.pending == 0
+        await _until(written)
+        assert log.write_failures == 1
+        await log.stop()
+        watermark = await storage.change_watermark()
+        assert watermark >= seq and await _types(storage, watermark) == ["a"]
+    asyncio.run(main())
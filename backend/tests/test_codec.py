@@ -0,0 +1,49 @@
+"""Frame encoding for both wire protocols and the ``Frame`` encode-once cache."""
+import json
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.websockets import codec
+from app.websockets.codec import MSGPACK_SUBPROTOCOL, Frame, as_frame, decode, decode_binary, encode_text, negotiate
+
+OID = ObjectId("65a1b2c3d4e5f60718293a4b")
+PAYLOAD = {"type": "message", "_id": OID, "timestamp": datetime(2026, 1, 1, 12, 30), "likes": ["bob"]}
+EXPECTED = {"type": "message", "_id": str(OID), "timestamp": "2026-01-01T12:30:00", "likes": ["bob"]}
+
+
+def test_json_frames_carry_ids_and_datetimes_as_strings():
+    text = encode_text(PAYLOAD)
+    assert json.loads(text) == EXPECTED
+    assert decode(text) == EXPECTED
+    with pytest.raises(TypeError):
+        encode_text({"value": object()})
+
+
+def test_frames_encode_once():
+    frame = Frame(PAYLOAD)
+    assert frame.text is frame.text
+    assert as_frame(frame) is frame
+    # Text relayed by the broker is only decoded when something needs the payload
+    relayed = as_frame(frame.text)
+    assert relayed.text is frame.text
+    assert relayed.payload == EXPECTED
+    assert as_frame({"type": "ping"}).text == '{"type":"ping"}'
+
+
+def test_msgpack_frames_carry_the_same_schema():
+    pytest.importorskip("msgpack")
+    frame = Frame(PAYLOAD)
+    assert isinstance(frame.binary, bytes) and frame.binary is frame.binary
+    assert decode_binary(frame.binary) == EXPECTED
+    # A frame relayed as JSON text is re-encoded for binary sockets
+    assert decode_binary(as_frame(frame.text).binary) == EXPECTED
+
+
+def test_negotiate_picks_msgpack_only_when_offered_and_available(monkeypatch):
+    pytest.importorskip("msgpack")
+    assert negotiate(["json", MSGPACK_SUBPROTOCOL]) == MSGPACK_SUBPROTOCOL
+    assert negotiate([]) is None
+    monkeypatch.setattr(codec, "msgpack", None)
+    assert negotiate([MSGPACK_SUBPROTOCOL]) is None
@@ -0,0 +1,79 @@
+"""Dispatch and payload validation in ``EventRegistry``."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from app.models.events import MessageEvent, SyncEvent
+from app.websockets.events import EventContext, EventRegistry
+
+
+class Connection:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, payload, ephemeral=False):
+        self.sent.append(payload)
+        return True
+
+
+def _registry():
+    registry = EventRegistry()
+    handled = []
+
+    @registry.on("message", MessageEvent)
+    async def handle_message(ctx, event):
+        handled.append((ctx.user_id, event))
+
+    @registry.on("sync", SyncEvent)
+    async def handle_sync(ctx, event):
+        raise RuntimeError("storage unavailable")
+
+    return registry, handled
+
+
+def _dispatch(registry, data):
+    ctx = EventContext("alice", "s1", Connection())
+    asyncio.run(registry.dispatch(ctx, data))
+    return ctx.connection.sent
+
+
+def test_events_reach_their_handler_validated():
+    registry, handled = _registry()
+    assert _dispatch(registry, {"type": "message", "receiver_id": " Bob ", "content": "hi"}) == []
+    [(user_id, event)] = handled
+    assert user_id == "alice" and isinstance(event, MessageEvent)
+    assert (event.receiver_id, event.content) == ("bob", "hi")
+    stats = registry.stats["message"]
+    assert (stats.count, stats.errors, stats.invalid, stats.latency.count) == (1, 0, 0, 1)
+
+
+def test_invalid_payloads_never_reach_the_handler():
+    registry, handled = _registry()
+    assert _dispatch(registry, {"type": "message", "content": "no receiver"}) == [
+        {"type": "error", "message": "Invalid message event"}
+    ]
+    assert _dispatch(registry, {"type": "sync", "since": -1}) == [{"type": "error", "message": "Invalid sync event"}]
+    assert handled == []
+    assert registry.stats["message"].invalid == 1 and registry.stats["message"].count == 0
+
+
+@pytest.mark.parametrize("data", [{"type": "typing"}, {"content": "no type"}, {"type": ["message"]}, ["message"]])
+def test_unknown_events_are_rejected(data):
+    registry, handled = _registry()
+    assert _dispatch(registry, data) == [{"type": "error", "message": "Unknown message type"}]
+    assert registry.unknown == 1 and handled == []
+
+
+def test_handler_errors_are_reported_and_counted():
+    registry, _ = _registry()
+    assert _dispatch(registry, {"type": "sync", "since": 3}) == [{"type": "error", "message": "storage unavailable"}]
+    stats = registry.stats["sync"]
+    assert (stats.count, stats.errors, stats.latency.count) == (1, 1, 1)
+
+
+def test_an_event_type_has_one_handler():
+    registry, _ = _registry()
+    with pytest.raises(ValueError):
+        registry.on("message", MessageEvent)(lambda ctx, event: None)
@@ -0,0 +1,172 @@
+"""Sessions and outbound queues of ``ConnectionManager`` sockets."""
+import asyncio
+import importlib
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from app.websockets.broker import InProcessBroker
+from app.websockets.manager import SLOW_CONSUMER_CLOSE_CODE, ConnectionManager
+
+# The package re-exports the ``manager`` singleton under the module's name
+manager_module = importlib.import_module("app.websockets.manager")
+
+
+class FakeSocket:
+    """Records what the writer task sends; ``stalled`` sockets never finish a send."""
+
+    def __init__(self, stalled=False, fail=False):
+        self.stalled = stalled
+        self.fail = fail
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        await self._send(text)
+
+    async def send_bytes(self, data):
+        await self._send(data)
+
+    async def _send(self, data):
+        if self.fail:
+            raise ConnectionResetError("gone")
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+async def _manager():
+    manager = ConnectionManager(InProcessBroker())
+    await manager.start()
+    return manager
+
+
+async def _connect(manager, websocket, user_id="alice", subprotocol=None):
+    session_id = await manager.connect(websocket, user_id, subprotocol)
+    # Let the writer task reach its first wait
+    await asyncio.sleep(0)
+    return manager.get_connection(user_id, session_id)
+
+
+def test_frames_are_written_in_order():
+    async def main():
+        manager = await _manager()
+        websocket = FakeSocket()
+        await _connect(manager, websocket)
+        for i in range(3):
+            assert await manager.send_personal_message({"n": i}, "Alice")
+        await asyncio.sleep(0.01)
+        assert websocket.sent == ['{"n":0}', '{"n":1}', '{"n":2}']
+    asyncio.run(main())
+
+
+def test_drop_oldest_discards_ephemeral_frames_first():
+    async def main():
+        manager = await _manager()
+        websocket = FakeSocket(stalled=True)
+        connection = await _connect(manager, websocket)
+        connection.maxsize = 2
+        assert connection.send({"type": "status"}, ephemeral=True)
+        assert connection.send({"type": "message", "n": 1})
+        # Full: the queued presence event makes room for the message
+        assert connection.send({"type": "message", "n": 2})
+        assert connection.dropped == 1
+        # Nothing ephemeral left to discard, so an incoming one is dropped
+        assert not connection.send({"type": "status"}, ephemeral=True)
+        assert connection.dropped == 2 and manager.dropped_frames == 2
+        assert connection.depth == 2 and manager.is_online("alice")
+        # A queue full of messages evicts the consumer rather than lose one
+        assert not connection.send({"type": "message", "n": 3})
+        assert manager.evictions == 1 and connection.closed
+        assert not manager.is_online("alice")
+        await asyncio.sleep(0)
+        assert websocket.close_code == SLOW_CONSUMER_CLOSE_CODE
+    asyncio.run(main())
+
+
+def test_disconnect_policy_evicts_on_first_overflow():
+    async def main():
+        manager = await _manager()
+        websocket = FakeSocket(stalled=True)
+        connection = await _connect(manager, websocket)
+        connection.maxsize, connection.policy = 1, "disconnect"
+        assert connection.send({"type": "status"}, ephemeral=True)
+        assert not connection.send({"type": "status"}, ephemeral=True)
+        assert manager.evictions == 1 and manager.dropped_frames == 0
+        assert manager.get_sessions("alice") == []
+        await asyncio.sleep(0)
+        assert websocket.close_code == SLOW_CONSUMER_CLOSE_CODE
+    asyncio.run(main())
+
+
+def test_stalled_writes_time_out_and_evict(monkeypatch):
+    monkeypatch.setattr(manager_module, "SEND_TIMEOUT", 0.01)
+
+    async def main():
+        manager = await _manager()
+        websocket = FakeSocket(stalled=True)
+        await _connect(manager, websocket)
+        await manager.send_personal_message({"type": "message"}, "alice")
+        await asyncio.sleep(0.05)
+        assert manager.send_failures == 1 and not manager.is_online("alice")
+        assert websocket.close_code == 1011
+    asyncio.run(main())
+
+
+def test_failed_writes_evict():
+    async def main():
+        manager = await _manager()
+        websocket = FakeSocket(fail=True)
+        await _connect(manager, websocket)
+        await manager.send_personal_message({"type": "message"}, "alice")
+        await asyncio.sleep(0.01)
+        assert manager.send_failures == 1 and not manager.is_online("alice")
+        # Later sends to the user are no longer queued anywhere
+        assert not await manager.send_personal_message({"type": "message"}, "alice")
+    asyncio.run(main())
+
+
+def test_every_session_of_a_user_gets_its_frames():
+    async def main():
+        manager = await _manager()
+        phone, desktop, bob = FakeSocket(), FakeSocket(), FakeSocket()
+        first = await _connect(manager, phone)
+        await _connect(manager, desktop, "Alice", subprotocol="msgpack")
+        await _connect(manager, bob, "bob")
+        assert len(manager.get_sessions("alice")) == 2
+        assert await manager.send_personal_message({"type": "message"}, "alice")
+        counts = await manager.fanout({"type": "group_message"}, ["alice", "Bob", "carol"], group_id="g1")
+        assert counts == {"delivered": 3, "failed": 0}
+        await asyncio.sleep(0.01)
+        assert phone.sent == ['{"type":"message"}', '{"type":"group_message"}']
+        # The msgpack session gets the same events as binary frames
+        assert len(desktop.sent) == 2 and all(isinstance(f, bytes) for f in desktop.sent)
+        assert bob.sent == ['{"type":"group_message"}']
+        # Closing one session leaves the user online on the other
+        manager.disconnect("alice", first.session_id)
+        assert manager.is_online("alice") and len(manager.get_sessions("alice")) == 1
+        manager.disconnect("alice")
+        assert not manager.is_online("alice") and "alice" not in manager.get_online_users()
+    asyncio.run(main())
+
+
+def test_evicting_one_session_keeps_the_others():
+    async def main():
+        manager = await _manager()
+        slow, fast = FakeSocket(stalled=True), FakeSocket()
+        slow_connection = await _connect(manager, slow)
+        await _connect(manager, fast)
+        slow_connection.maxsize, slow_connection.policy = 1, "disconnect"
+        await manager.send_personal_message({"n": 1}, "alice")
+        await manager.send_personal_message({"n": 2}, "alice")
+        await asyncio.sleep(0.01)
+        assert slow_connection.closed and manager.evictions == 1
+        assert manager.get_sessions("alice") != [] and fast.sent == ['{"n":1}', '{"n":2}']
+    asyncio.run(main())
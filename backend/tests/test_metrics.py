@@ -0,0 +1,59 @@
+"""Histograms, ``@instrument`` and the Prometheus text page."""
+import asyncio
+
+import pytest
+
+from app.metrics import Exposition, Histogram, instrument
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    assert histogram.cumulative() == [2, 3, 4]
+    assert histogram.count == 4 and histogram.sum == pytest.approx(3.65)
+
+
+def test_instrument_times_public_coroutines_only():
+    stats = {}
+
+    @instrument(stats)
+    class Store:
+        async def get(self, fail=False):
+            if fail:
+                raise ValueError("missing")
+            return "value"
+
+        async def _helper(self):
+            pass
+
+        def sync(self):
+            pass
+
+    store = Store()
+    assert asyncio.run(store.get()) == "value"
+    with pytest.raises(ValueError):
+        asyncio.run(store.get(fail=True))
+    assert list(stats) == ["get"]
+    assert stats["get"].latency.count == 2 and stats["get"].errors == 1
+
+
+def test_exposition_renders_prometheus_text():
+    histogram = Histogram(buckets=(0.5,))
+    histogram.observe(0.25)
+    out = Exposition()
+    out.family("chat_sockets", "gauge", "Open sockets")
+    out.sample("chat_sockets", 3)
+    out.family("chat_handler_seconds", "histogram", "Handler latency")
+    out.histogram("chat_handler_seconds", histogram, {"event": "message"})
+    assert out.render() == "\n".join([
+        "# HELP chat_sockets Open sockets",
+        "# TYPE chat_sockets gauge",
+        "chat_sockets 3",
+        "# HELP chat_handler_seconds Handler latency",
+        "# TYPE chat_handler_seconds histogram",
+        'chat_handler_seconds_bucket{event="message",le="0.5"} 1',
+        'chat_handler_seconds_bucket{event="message",le="+Inf"} 1',
+        'chat_handler_seconds_sum{event="message"} 0.25',
+        'chat_handler_seconds_count{event="message"} 1',
+    ]) + "\n"
@@ -0,0 +1,67 @@
+"""Bounded bcrypt pool: back-pressure and rehash-on-login."""
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("passlib")
+pytest.importorskip("jose")
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException
+
+from app.models.user import UserLogin
+from app.routes import auth as auth_routes
+from app.services import auth_service
+from app.services.auth_service import AuthService
+from app.services.memory_store import MemoryStorage
+from app.services.password_hasher import HasherBusy, PasswordHasher, pwd_context
+
+
+def test_full_queue_is_refused_straight_away():
+    async def main():
+        hasher = PasswordHasher(pool="thread", workers=1, max_pending=1)
+        try:
+            running = asyncio.create_task(hasher._run(time.sleep, 0.2))
+            queued = asyncio.create_task(hasher._run(time.sleep, 0))
+            await asyncio.sleep(0.05)
+            assert (hasher.running, hasher.waiting) == (1, 1)
+            with pytest.raises(HasherBusy):
+                await hasher._run(time.sleep, 0)
+            await asyncio.gather(running, queued)
+            assert hasher.stats() == {"waiting": 0, "running": 0, "completed": 2, "rejected": 1, "rehashed": 0}
+        finally:
+            hasher.close()
+    asyncio.run(main())
+
+
+def test_busy_hasher_answers_503(monkeypatch):
+    async def busy(user):
+        raise HasherBusy("Too many password operations in progress, try again shortly")
+    monkeypatch.setattr(AuthService, "authenticate", staticmethod(busy))
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(auth_routes.login(UserLogin(username="alice", password="secret")))
+    assert raised.value.status_code == 503
+
+
+def test_login_upgrades_weak_hashes(monkeypatch):
+    storage = MemoryStorage()
+    hasher = PasswordHasher(pool="thread", workers=1)
+    monkeypatch.setattr(auth_service, "db", storage)
+    monkeypatch.setattr(auth_service, "hasher", hasher)
+    weak = pwd_context.handler("bcrypt").using(rounds=4).hash("secret")
+
+    async def main():
+        await storage.create_user("alice", weak, "1234")
+        assert await AuthService.authenticate(UserLogin(username="alice", password="wrong")) is None
+        user = await AuthService.authenticate(UserLogin(username=" Alice ", password="secret"))
+        assert user is not None and user.password_hash != weak
+        assert (await storage.get_user("alice"))["password_hash"] == user.password_hash
+        assert hasher.rehashed == 1
+        # The upgraded hash verifies without another rehash
+        assert await AuthService.authenticate(UserLogin(username="alice", password="secret")) is not None
+        assert hasher.rehashed == 1
+    try:
+        asyncio.run(main())
+    finally:
+        hasher.close()
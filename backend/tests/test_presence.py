@@ -0,0 +1,127 @@
+"""Debounced, batched presence from ``PresenceTracker``."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("motor")
+
+from app.websockets.broker import InProcessBroker
+from app.websockets.presence import PresenceTracker
+
+
+class Broker(InProcessBroker):
+    def __init__(self):
+        super().__init__()
+        self.remote = set()
+
+    def online_elsewhere(self, user_id):
+        return user_id in self.remote
+
+
+class Connections:
+    """Records presence frames instead of queueing them on sockets."""
+
+    def __init__(self):
+        self.broker = Broker()
+        self.local = set()
+        self.sent = []
+
+    def is_online(self, user_id):
+        return user_id in self.local
+
+    async def send_personal_message(self, message, user_id, ephemeral=False):
+        assert ephemeral
+        self.sent.append((user_id, message))
+        return True
+
+
+def _tracker(debounce=0.05):
+    connections = Connections()
+    tracker = PresenceTracker(connections, flush_interval=60, debounce=debounce)
+    # Known up front so user_connected does not ask the database
+    tracker.contacts.update(alice={"bob", "carol"}, dave={"bob"})
+    return tracker, connections
+
+
+def _delta(online=(), offline=()):
+    return {"type": "presence", "online": list(online), "offline": list(offline)}
+
+
+def test_changes_are_batched_per_watcher():
+    async def main():
+        tracker, connections = _tracker()
+        await tracker.user_connected("alice")
+        await tracker.user_connected("dave")
+        assert connections.sent == []
+        await tracker.flush()
+        assert sorted(connections.sent, key=lambda sent: sent[0]) == [
+            ("bob", _delta(online=["alice", "dave"])),
+            ("carol", _delta(online=["alice"])),
+        ]
+        connections.sent.clear()
+        await tracker.flush()
+        assert connections.sent == []
+    asyncio.run(main())
+
+
+def test_quick_reconnects_are_never_announced():
+    async def main():
+        tracker, connections = _tracker()
+        await tracker.user_connected("alice")
+        await tracker.flush()
+        connections.sent.clear()
+        tracker.user_disconnected("alice")
+        await tracker.flush()
+        await tracker.user_connected("alice")
+        await asyncio.sleep(0.06)
+        await tracker.flush()
+        assert connections.sent == []
+        # Staying away past the debounce is announced once
+        tracker.user_disconnected("alice")
+        await tracker.flush()
+        assert connections.sent == []
+        await asyncio.sleep(0.06)
+        await tracker.flush()
+        assert sorted(connections.sent) == [("bob", _delta(offline=["alice"])), ("carol", _delta(offline=["alice"]))]
+    asyncio.run(main())
+
+
+def test_unannounced_sessions_leave_no_trace():
+    async def main():
+        tracker, connections = _tracker()
+        await tracker.user_connected("alice")
+        tracker.user_disconnected("alice")
+        await asyncio.sleep(0.06)
+        await tracker.flush()
+        assert connections.sent == [] and "alice" not in tracker.contacts
+    asyncio.run(main())
+
+
+def test_offline_waits_for_other_workers():
+    async def main():
+        tracker, connections = _tracker(debounce=0)
+        connections.broker.remote.add("alice")
+        # Already online on another worker: no new online event
+        await tracker.user_connected("alice")
+        await tracker.flush()
+        assert connections.sent == [] and tracker.is_online("alice")
+        tracker.user_disconnected("alice")
+        await tracker.flush()
+        assert connections.sent == []
+        # The other worker loses the user too
+        connections.broker.remote.discard("alice")
+        connections.broker.on_presence("alice", False)
+        await tracker.flush()
+        assert sorted(connections.sent) == [("bob", _delta(offline=["alice"])), ("carol", _delta(offline=["alice"]))]
+    asyncio.run(main())
+
+
+def test_snapshot_pages_online_contacts():
+    tracker, connections = _tracker()
+    tracker.contacts["bob"] = {"alice", "carol", "dave", "erin"}
+    connections.local.update({"alice", "dave"})
+    connections.broker.remote.add("erin")
+    first = tracker.snapshot("bob", limit=2)
+    assert first == {"online_users": ["alice", "dave"], "next_cursor": "dave"}
+    assert tracker.snapshot("bob", cursor="dave", limit=2) == {"online_users": ["erin"], "next_cursor": None}
@@ -0,0 +1,87 @@
+"""Recent-message windows: seeding, buffered writes and page answers."""
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app.services.recent_messages import RecentMessages, _key
+
+T0 = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def _docs(count, start=0):
+    return [{"_id": str(ObjectId()), "timestamp": T0 + timedelta(seconds=i), "content": f"m{i}", "deleted_by": []}
+            for i in range(start, start + count)]
+
+
+def _contents(docs):
+    return [doc["content"] for doc in docs] if docs is not None else None
+
+
+def test_writes_during_a_load_are_merged_into_the_window():
+    recent = RecentMessages(window=10, ttl=60)
+    m0, m1, m2, m3 = _docs(4)
+    recent.begin_seed("c")
+    # Saved after the load's query ran, so missing from its result
+    recent.add("c", m3)
+    # Liked while loading: the query may have read the old version
+    recent.update("c", {**m1, "content": "m1 liked"})
+    # Updates to messages outside the loaded range are not added
+    recent.update("c", {**m0, "content": "m0 liked"})
+    recent.seed("c", [m1, m2], has_older=True)
+    assert _contents(recent.page("c", None, None, None, 3)) == ["m1 liked", "m2", "m3"]
+    assert recent.stats()["size"] == 3
+    # Loading is over: later writes go straight to the window
+    m4 = _docs(1, start=4)[0]
+    recent.add("c", m4)
+    assert _contents(recent.page("c", None, None, None, 2)) == ["m3", "m4"]
+
+
+def test_a_failed_load_discards_its_buffer():
+    recent = RecentMessages(window=10, ttl=60)
+    recent.begin_seed("c")
+    recent.add("c", _docs(1)[0])
+    assert len(recent.end_seed("c")) == 1
+    assert recent.page("c", None, None, None, 1) is None
+    assert recent.end_seed("c") == {}
+
+
+def test_overlapping_loads_share_the_buffer():
+    recent = RecentMessages(window=10, ttl=60)
+    m0, m1 = _docs(2)
+    recent.begin_seed("c")
+    recent.begin_seed("c")
+    recent.add("c", m1)
+    # The first load failed; the second still sees the buffered write
+    recent.end_seed("c")
+    recent.seed("c", [m0], has_older=False)
+    assert _contents(recent.page("c", None, None, None, 5)) == ["m0", "m1"]
+
+
+def test_pages_the_window_cannot_answer_fall_back_to_storage():
+    recent = RecentMessages(window=3, ttl=60)
+    docs = _docs(4)
+    docs[2]["deleted_by"] = ["bob"]
+    recent.seed("c", docs, has_older=False)
+    # Only the newest three are kept
+    assert _contents(recent.page("c", None, None, None, 3)) == ["m1", "m2", "m3"]
+    assert recent.page("c", None, None, None, 4) is None
+    # Hidden messages do not count towards the page
+    assert _contents(recent.page("c", "alice", None, None, 2)) == ["m2", "m3"]
+    assert recent.page("c", "bob", None, None, 3) is None
+    assert _contents(recent.page("c", "bob", _key(docs[3]), None, 1)) == ["m1"]
+    # An after cursor older than the window may skip messages
+    assert recent.page("c", None, None, _key(docs[0]), 3) is None
+    assert _contents(recent.page("c", None, None, _key(docs[1]), 3)) == ["m2", "m3"]
+
+
+def test_windows_are_evicted_least_recently_used():
+    recent = RecentMessages(window=3, max_messages=5, ttl=60)
+    recent.seed("a", _docs(3), has_older=False)
+    recent.seed("b", _docs(2), has_older=False)
+    recent.page("a", None, None, None, 1)
+    recent.seed("c", _docs(1), has_older=False)
+    assert recent.page("b", None, None, None, 1) is None
+    assert recent.stats()["size"] == 4 and recent.stats()["conversations"] == 2
+    expired = RecentMessages(window=3, ttl=-1)
+    expired.seed("a", _docs(1), has_older=False)
+    assert expired.page("a", None, None, None, 1) is None
@@ -0,0 +1,192 @@
+"""Behaviour every storage backend must share (see ``app.services.storage``).
+
+Each test runs once per backend through the ``run`` fixture in conftest.py.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.group_pydantic import Group, GroupMessage
+from app.models.message import Message
+from app.services.storage import encode_cursor, inbox_cursor
+
+T0 = datetime(2026, 1, 1, 12, 0, 0)
+
+
+async def _send(storage, sender, receiver, count, start=0):
+    saved = []
+    for i in range(start, start + count):
+        saved.append(await storage.save_message(Message(
+            sender_id=sender, receiver_id=receiver, content=f"m{i}", timestamp=T0 + timedelta(seconds=i),
+        )))
+    return saved
+
+
+async def _group(storage, members=("alice", "bob", "carol")):
+    return await storage.create_group(Group(id="g1", name="Group", members=list(members), admins=[members[0]]))
+
+
+def _contents(messages):
+    return [m.content for m in messages]
+
+
+def test_history_pages_with_cursors(run):
+    async def body(storage):
+        saved = await _send(storage, "alice", "bob", 5)
+        latest = await storage.get_messages("alice", "bob", limit=2)
+        assert _contents(latest) == ["m3", "m4"]
+        # Both participants see the same conversation
+        assert _contents(await storage.get_messages("bob", "alice", limit=2)) == ["m3", "m4"]
+        before = encode_cursor(latest[0].timestamp, latest[0].id)
+        assert _contents(await storage.get_messages("alice", "bob", before=before, limit=2)) == ["m1", "m2"]
+        after = encode_cursor(saved[1].timestamp, saved[1].id)
+        assert _contents(await storage.get_messages("alice", "bob", after=after, limit=2)) == ["m2", "m3"]
+        with pytest.raises(ValueError):
+            await storage.get_messages("alice", "bob", before=before, after=after)
+    run(body)
+
+
+def test_like_and_unlike(run):
+    async def body(storage):
+        [message] = await _send(storage, "alice", "bob", 1)
+        assert (await storage.toggle_like(message.id, "bob")).likes == ["bob"]
+        assert (await storage.toggle_like(message.id, "bob")).likes == []
+        updated = await storage.apply_reactions("bob", [
+            {"message_id": message.id, "action": "like", "is_group": False},
+            {"message_id": message.id, "action": "like", "is_group": False},
+        ])
+        assert [m.likes for m in updated] == [["bob"]]
+        with pytest.raises(ValueError):
+            await storage.toggle_like("0" * 24, "bob")
+    run(body)
+
+
+def test_delete_for_everyone_and_for_self(run):
+    async def body(storage):
+        first, second = await _send(storage, "alice", "bob", 2)
+        await storage.toggle_like(first.id, "bob")
+        # The sender's delete leaves a tombstone for everyone
+        deleted = await storage.delete_message(first.id, "alice")
+        assert deleted.deleted_by == ["*"]
+        assert deleted.content == "" and deleted.likes == []
+        assert _contents(await storage.get_messages("bob", "alice")) == ["m1"]
+        with pytest.raises(ValueError):
+            await storage.toggle_like(first.id, "bob")
+        # Anyone else only hides it from themselves
+        hidden = await storage.delete_message(second.id, "bob")
+        assert hidden.deleted_by == ["bob"]
+        assert _contents(await storage.get_messages("bob", "alice")) == []
+        assert _contents(await storage.get_messages("alice", "bob")) == ["m1"]
+    run(body)
+
+
+def test_group_membership(run):
+    async def body(storage):
+        group = await _group(storage)
+        assert await storage.get_group_members(group.id) == {"alice", "bob", "carol"}
+        assert await storage.get_group_members("missing") is None
+        await storage.update_group(group.id, {"members": ["alice", "bob", "dave"]})
+        assert await storage.get_group_members(group.id) == {"alice", "bob", "dave"}
+        assert [g.id for g in await storage.get_user_groups("dave")] == [group.id]
+        assert await storage.get_user_groups("carol") == []
+        assert "dave" in await storage.get_contacts("alice")
+    run(body)
+
+
+def test_group_messages(run):
+    async def body(storage):
+        group = await _group(storage)
+        for i in range(3):
+            await storage.save_group_message(GroupMessage(
+                group_id=group.id, sender_id="alice", content=f"g{i}",
+                timestamp=(T0 + timedelta(seconds=i)).isoformat(),
+            ))
+        latest = await storage.get_group_messages(group.id, viewer="bob", limit=2)
+        assert _contents(latest) == ["g1", "g2"]
+        before = encode_cursor(latest[0].timestamp, latest[0].id)
+        assert _contents(await storage.get_group_messages(group.id, viewer="bob", before=before)) == ["g0"]
+        await storage.delete_message(latest[1].id, "bob", is_group_message=True)
+        assert _contents(await storage.get_group_messages(group.id, viewer="bob")) == ["g0", "g1"]
+        assert _contents(await storage.get_group_messages(group.id, viewer="carol")) == ["g0", "g1", "g2"]
+    run(body)
+
+
+def test_change_log(run):
+    async def body(storage):
+        first = await storage.reserve_change_seqs("w1", 10)
+        second = await storage.reserve_change_seqs("w2", 10)
+        assert second >= first + 10
+        entry = {"seq": second, "audience": ["alice"], "payload": {"type": "b"}, "created_at": datetime.utcnow()}
+        await storage.write_changes("w2", [entry], second + 1)
+        # w1 has not written its block yet, so nothing is served past it
+        watermark = await storage.change_watermark()
+        assert watermark < first
+        assert await storage.get_changes("alice", 0, watermark, 10) == []
+        entry = {"seq": first, "audience": ["alice", "bob"], "payload": {"type": "a"}, "created_at": datetime.utcnow()}
+        await storage.write_changes("w1", [entry], None)
+        await storage.write_changes("w2", [], None)
+        watermark = await storage.change_watermark()
+        assert watermark >= second
+        changes = await storage.get_changes("alice", 0, watermark, 10)
+        assert changes == [{"type": "a", "seq": first}, {"type": "b", "seq": second}]
+        assert await storage.get_changes("alice", 0, watermark, 1) == changes[:1]
+        assert await storage.get_changes("alice", first, watermark, 10) == changes[1:]
+        assert await storage.get_changes("bob", 0, watermark, 10) == changes[:1]
+        # Pruned entries turn an old seq into a reset
+        await storage.prune_changes(datetime.utcnow() + timedelta(seconds=1))
+        assert await storage.get_changes("alice", 0, watermark, 10) is None
+        assert await storage.get_changes("alice", watermark, watermark, 10) == []
+    run(body)
+
+
+def test_inbox(run):
+    async def body(storage):
+        await _send(storage, "alice", "bob", 3)
+        await _send(storage, "carol", "bob", 1, start=3)
+        inbox = await storage.get_inbox("bob")
+        assert [(e.chat_id, e.unread, e.preview) for e in inbox] == [("carol", 1, "m3"), ("alice", 3, "m2")]
+        assert (await storage.get_inbox("alice"))[0].unread == 0
+        page = await storage.get_inbox("bob", before=inbox_cursor(inbox[0]), limit=1)
+        assert [e.chat_id for e in page] == ["alice"]
+        entry = await storage.mark_read("bob", "alice")
+        assert entry.unread == 0 and entry.read_at is not None
+        assert await storage.mark_read("bob", "nobody") is None
+    run(body)
+
+
+def test_inbox_after_delete_for_everyone(run):
+    async def body(storage):
+        saved = await _send(storage, "alice", "bob", 3)
+        # Deleting the latest message takes it out of the unread count once
+        # and moves the preview back to the previous message
+        await storage.delete_message(saved[2].id, "alice")
+        await storage.delete_message(saved[2].id, "alice")
+        entries = await storage.get_inbox_entries({"bob": "alice", "alice": "bob"}, False)
+        assert (entries["bob"].unread, entries["bob"].preview) == (2, "m1")
+        assert entries["alice"].preview == "m1"
+        # Already read messages are not taken off again
+        await storage.mark_read("bob", "alice")
+        await storage.delete_message(saved[0].id, "alice")
+        assert (await storage.get_inbox_entries({"bob": "alice"}, False))["bob"].unread == 0
+        # Hiding the latest message only changes the hider's preview
+        await storage.delete_message(saved[1].id, "bob")
+        entries = await storage.get_inbox_entries({"bob": "alice", "alice": "bob"}, False)
+        assert entries["bob"].last_deleted and entries["bob"].preview == ""
+        assert entries["alice"].preview == "m1"
+    run(body)
+
+
+def test_group_inbox(run):
+    async def body(storage):
+        group = await _group(storage)
+        message = await storage.save_group_message(GroupMessage(
+            group_id=group.id, sender_id="alice", content="hello", timestamp=T0.isoformat(),
+        ))
+        entries = await storage.get_inbox_entries({m: group.id for m in ("alice", "bob", "carol")}, True)
+        assert {user: e.unread for user, e in entries.items()} == {"alice": 0, "bob": 1, "carol": 1}
+        await storage.mark_read("bob", group.id, is_group=True)
+        await storage.delete_message(message.id, "alice", is_group_message=True)
+        entries = await storage.get_inbox_entries({m: group.id for m in ("alice", "bob", "carol")}, True)
+        assert {user: e.unread for user, e in entries.items()} == {"alice": 0, "bob": 0, "carol": 0}
+        assert all(e.last_deleted for e in entries.values())
+    run(body)
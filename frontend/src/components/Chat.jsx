@@ -3,12 +3,17 @@ import { useAuth } from "../context/AuthContext";
 import { useWebSocket } from "../context/WebSocketContext";
 import authFetch from "../utils/authFetch";
 
+// Messages per history page (the server's default page size)
+const PAGE_SIZE = 50;
+
 const Chat = ({ selectedUser }) => {
   const { user, token } = useAuth();
-  const { sendMessage, subscribe, onlineUsers } = useWebSocket();
+  const { sendMessage, subscribe, onlineUsers, syncEpoch } = useWebSocket();
   const [messages, setMessages] = useState([]);
   const [newMessage, setNewMessage] = useState("");
   const [forceRerender, setForceRerender] = useState(0);
+  // Cursor for the page before the oldest loaded message; null once all is loaded
+  const [olderCursor, setOlderCursor] = useState(null);
   const messagesEndRef = useRef(null);
 
   const backendURL = import.meta.env.VITE_BACKEND_URL || "http://localhost:8000";
@@ -21,23 +26,34 @@ const Chat = ({ selectedUser }) => {
     scrollToBottom();
   }, [messages]);
 
-  // Clear input field and messages when switching users
+  // Clear input field when changing chat partner
+  useEffect(() => {
+    setNewMessage("");
+  }, [selectedUser]);
+
+  // Reload messages when switching users or after a sync_reset
   useEffect(() => {
-    setNewMessage(""); // Clear input field when changing chat partner
+    setOlderCursor(null);
 
     if (!user || !selectedUser || !token) {
       setMessages([]);
       return;
     }
 
-    // Load previous messages
-    
-
+    // Load the latest page; older pages are fetched on demand
     authFetch(
       `${backendURL}/api/messages/${user.username}/${selectedUser.name}`,
       token
     )
-      .then((res) => (res.ok ? res.json() : []))
+      .then((res) => {
+        if (!res.ok) return [];
+        return res.json().then((data) => {
+          setOlderCursor(
+            data.length === PAGE_SIZE ? res.headers.get("X-Before-Cursor") : null
+          );
+          return data;
+        });
+      })
       .then((data) => {
         console.log("Loaded messages:", data);
         // Normalize message IDs
@@ -46,12 +62,14 @@ const Chat = ({ selectedUser }) => {
           _id: msg._id || msg.id || `optimistic-${Date.now()}`,
         }));
         setMessages(normalizedMessages);
+        // Opening the chat reads it: clear its unread count
+        sendMessage({ type: "mark_read", chat_id: selectedUser.name });
       })
       .catch((error) => {
         console.error("Error loading messages:", error);
         setMessages([]);
       });
-  }, [user, selectedUser, token]);
+  }, [user, selectedUser, token, syncEpoch]);
 
   useEffect(() => {
     if (!user) return;
@@ -126,6 +144,10 @@ const Chat = ({ selectedUser }) => {
           }
           return filtered;
         });
+        if (msgSender === selected && msgReceiver === loggedInUser) {
+          // Arrived while this chat is open, so it is already read
+          sendMessage({ type: "mark_read", chat_id: selected });
+        }
       }
     });
     return () => {
@@ -133,6 +155,24 @@ const Chat = ({ selectedUser }) => {
     };
   }, [user, selectedUser, token, subscribe]);
 
+  const loadOlder = () => {
+    if (!olderCursor) return;
+    const params = new URLSearchParams({ before: olderCursor });
+    authFetch(
+      `${backendURL}/api/messages/${user.username}/${selectedUser.name}?${params}`,
+      token
+    ).then((res) => {
+      if (!res.ok) return;
+      return res.json().then((data) => {
+        setOlderCursor(
+          data.length === PAGE_SIZE ? res.headers.get("X-Before-Cursor") : null
+        );
+        const older = data.map((msg) => ({ ...msg, _id: msg._id || msg.id }));
+        setMessages((prev) => [...older, ...prev]);
+      });
+    });
+  };
+
   const handleSendMessage = (e) => {
     e.preventDefault();
     if (!newMessage.trim() || !selectedUser || !user) return;
@@ -220,6 +260,14 @@ const Chat = ({ selectedUser }) => {
       </div>
 
       <div className="flex-1 overflow-y-auto p-4 space-y-3">
+        {olderCursor && (
+          <button
+            className="w-full text-sm text-blue-500 hover:underline"
+            onClick={loadOlder}
+          >
+            Load older messages
+          </button>
+        )}
         {/* Deduplicate messages before rendering */}
         {(() => {
           const dedupedMessages = [];
@@ -1,11 +1,10 @@
-import { useState } from "react";
-import { useUser } from "../context/UserContext";
+import { useEffect, useState } from "react";
 import { useWebSocket } from "../context/WebSocketContext";
+import authFetch from "../utils/authFetch";
 
 const CreateGroupModal = ({
   isOpen,
   onClose,
-  allUsers = [],
   currentUser,
   token,
 }) => {
@@ -15,6 +14,31 @@ const CreateGroupModal = ({
     currentUser?.name || "",
   ]);
   const [error, setError] = useState("");
+  const [users, setUsers] = useState([]);
+  const [query, setQuery] = useState("");
+  const [nextCursor, setNextCursor] = useState(null);
+
+  const backendURL = import.meta.env.VITE_BACKEND_URL || "http://localhost:8000";
+
+  // Member candidates come from the paginated directory, like UserList
+  const fetchPage = (after) => {
+    const params = new URLSearchParams({ q: query.trim().toLowerCase() });
+    if (after) params.set("after", after);
+    return authFetch(`${backendURL}/api/auth/users?${params}`, token).then((res) => {
+      if (!res.ok) return;
+      setNextCursor(res.headers.get("X-Next-Cursor"));
+      return res.json().then((page) => {
+        setUsers((prev) => (after ? [...prev, ...page] : page));
+      });
+    });
+  };
+
+  // Refetch the first page when the modal opens or the search changes (debounced)
+  useEffect(() => {
+    if (!isOpen || !token) return;
+    const timer = setTimeout(() => fetchPage(null), 250);
+    return () => clearTimeout(timer);
+  }, [isOpen, token, query]);
 
   if (!isOpen || !currentUser || !currentUser.name) return null;
 
@@ -67,8 +91,15 @@ const CreateGroupModal = ({
           </div>
           <div className="mb-3">
             <label className="block text-sm font-medium mb-1">Members</label>
-            <div className="flex flex-wrap gap-2">
-              {allUsers
+            <input
+              type="text"
+              value={query}
+              onChange={(e) => setQuery(e.target.value)}
+              placeholder="Search users"
+              className="w-full border rounded p-2 mb-2 text-sm"
+            />
+            <div className="flex flex-wrap gap-2 max-h-48 overflow-y-auto">
+              {users
                 .filter((u) => u !== currentUser.name)
                 .map((user) => (
                   <label key={user} className="flex items-center space-x-1">
@@ -81,6 +112,15 @@ const CreateGroupModal = ({
                   </label>
                 ))}
             </div>
+            {nextCursor && (
+              <button
+                type="button"
+                className="text-sm text-blue-600 hover:underline mt-2"
+                onClick={() => fetchPage(nextCursor)}
+              >
+                Load more
+              </button>
+            )}
           </div>
           {error && <div className="text-red-500 text-sm mb-2">{error}</div>}
           <div className="flex justify-end gap-2 mt-4">
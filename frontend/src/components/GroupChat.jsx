@@ -1,16 +1,22 @@
 import { useState, useEffect, useRef } from "react";
 import { useUser } from "../context/UserContext";
+import { useAuth } from "../context/AuthContext";
 import { useGroup } from "../context/GroupContext";
 import { useWebSocket } from "../context/WebSocketContext";
+import authFetch from "../utils/authFetch";
 
 const GROUP_ID = "g1"; // Hardcoded for demo
 const ALL_USERS = ["Alice", "Bob", "Charlie", "David"];
+// Messages per history page (the server's default page size)
+const PAGE_SIZE = 50;
 
 const GroupChat = ({ selectedGroup }) => {
   // All hooks at the top
   const { currentUser } = useUser();
+  // Sends the bearer token so messages the viewer deleted for themselves stay hidden
+  const { token } = useAuth();
   const { isAdmin, isMember, isBlocked, getGroupById } = useGroup();
-  const { sendMessage, subscribe } = useWebSocket();
+  const { sendMessage, subscribe, syncEpoch } = useWebSocket();
   const [messages, setMessages] = useState([]);
   const [newMessage, setNewMessage] = useState("");
   const [group, setGroup] = useState({
@@ -21,6 +27,8 @@ const GroupChat = ({ selectedGroup }) => {
     banned: [],
   });
   const [eventLog, setEventLog] = useState([]);
+  // Cursor for the page before the oldest loaded message; null once all is loaded
+  const [olderCursor, setOlderCursor] = useState(null);
   const messagesEndRef = useRef(null);
   const backendURL = import.meta.env.VITE_BACKEND_URL || "http://localhost:8000";
 
@@ -53,14 +61,29 @@ const GroupChat = ({ selectedGroup }) => {
     return undefined;
   }
 
-  // Clear input field and messages when switching groups
+  // Clear input field when switching groups
   useEffect(() => {
     setNewMessage("");
+  }, [selectedGroup]);
+
+  // Reload messages when switching groups or after a sync_reset
+  useEffect(() => {
     setMessages([]);
+    setOlderCursor(null);
     setGroup(selectedGroup);
     if (selectedGroup && selectedGroup.id) {
-      fetch(`${backendURL}/api/groups/${selectedGroup.id}/messages`)
-        .then((res) => (res.ok ? res.json() : []))
+      authFetch(`${backendURL}/api/groups/${selectedGroup.id}/messages`, token)
+        .then((res) => {
+          if (!res.ok) return [];
+          return res.json().then((msgs) => {
+            setOlderCursor(
+              Array.isArray(msgs) && msgs.length === PAGE_SIZE
+                ? res.headers.get("X-Before-Cursor")
+                : null
+            );
+            return msgs;
+          });
+        })
         .then((msgs) => {
           console.log("[FETCHED FROM BACKEND]", msgs);
           const normalized = Array.isArray(msgs)
@@ -88,10 +111,16 @@ const GroupChat = ({ selectedGroup }) => {
             isValidObjectId(msg._id)
           );
           setMessages(realMessages);
+          // Opening the group reads it: clear its unread count
+          sendMessage({
+            type: "mark_read",
+            chat_id: selectedGroup.id,
+            is_group: true,
+          });
         })
         .catch(() => setMessages([]));
     }
-  }, [currentUser, selectedGroup]);
+  }, [currentUser, selectedGroup, token, syncEpoch]);
 
   // Listen for group events and update group/members/admins state
   useEffect(() => {
@@ -114,6 +143,14 @@ const GroupChat = ({ selectedGroup }) => {
           groupId: data.groupId || data.group_id || selectedGroup.id,
           _id: id,
         };
+        if (normalized.from !== currentUser.name.trim().toLowerCase()) {
+          // Arrived while this group is open, so it is already read
+          sendMessage({
+            type: "mark_read",
+            chat_id: selectedGroup.id,
+            is_group: true,
+          });
+        }
         setMessages((prev) => {
           // If this is a real message, replace any optimistic one with same sender/content/timestamp
           if (isValidObjectId(normalized._id)) {
@@ -219,7 +256,7 @@ const GroupChat = ({ selectedGroup }) => {
     setNewMessage("");
     // Immediately fetch latest messages after sending
     setTimeout(() => {
-      fetch(`${backendURL}/api/groups/${selectedGroup.id}/messages`)
+      authFetch(`${backendURL}/api/groups/${selectedGroup.id}/messages`, token)
         .then((res) => (res.ok ? res.json() : []))
         .then((msgs) => {
           console.log("[FETCHED FROM BACKEND]", msgs);
@@ -247,12 +284,45 @@ const GroupChat = ({ selectedGroup }) => {
           const realMessages = normalized.filter((msg) =>
             isValidObjectId(msg._id)
           );
-          setMessages(realMessages);
+          // This is the latest page only: keep older pages already loaded
+          setMessages((prev) => {
+            if (realMessages.length === 0) return prev;
+            const oldest = new Date(realMessages[0].timestamp);
+            const older = prev.filter(
+              (msg) =>
+                isValidObjectId(msg._id) && new Date(msg.timestamp) < oldest
+            );
+            return [...older, ...realMessages];
+          });
         })
-        .catch(() => setMessages([]));
+        .catch(() => {});
     }, 800);
   };
 
+  const loadOlder = () => {
+    if (!olderCursor) return;
+    const params = new URLSearchParams({ before: olderCursor });
+    authFetch(
+      `${backendURL}/api/groups/${selectedGroup.id}/messages?${params}`,
+      token
+    )
+      .then((res) => {
+        if (!res.ok) return;
+        return res.json().then((msgs) => {
+          setOlderCursor(
+            msgs.length === PAGE_SIZE ? res.headers.get("X-Before-Cursor") : null
+          );
+          const older = msgs.map((msg) => ({
+            ...msg,
+            from: msg.from || msg.sender_id,
+            groupId: msg.groupId || msg.group_id || selectedGroup.id,
+            _id: normalizeId(msg._id) || msg.id,
+          }));
+          setMessages((prev) => [...older, ...prev]);
+        });
+      });
+  };
+
   const handleAddMember = (userId) => {
     sendMessage({
       type: "add_member",
@@ -347,6 +417,14 @@ const GroupChat = ({ selectedGroup }) => {
         </div>
       </div>
       <div className="flex-1 overflow-y-auto p-4 space-y-2 bg-gray-50">
+        {olderCursor && (
+          <button
+            className="w-full text-sm text-blue-500 hover:underline"
+            onClick={loadOlder}
+          >
+            Load older messages
+          </button>
+        )}
         {messages.map((msg, idx) => {
           // Debug: log message details
           console.log("Message:", {
@@ -10,19 +10,40 @@ const GroupList = ({ onSelectGroup, selectedGroup }) => {
   const { groups, isMember, addGroup, addAllGroups } = useGroup();
   const { currentUser } = useUser();
   const { token } = useAuth();
-  const { subscribe } = useWebSocket();
+  const { subscribe, syncEpoch } = useWebSocket();
   const [showModal, setShowModal] = useState(false);
-  const [allUsers, setAllUsers] = useState([]);
+  // Unread counts of groups, from the inbox and live updates
+  const [unread, setUnread] = useState({});
 
   const backendURL = import.meta.env.VITE_BACKEND_URL || "http://localhost:8000";
 
-  // Fetch all users for member selection in modal
+  // Unread counts for the most recent chats
   useEffect(() => {
     if (!token) return;
-    authFetch(`${backendURL}/api/auth/users`, token)
+    authFetch(`${backendURL}/api/inbox`, token)
       .then((res) => (res.ok ? res.json() : []))
-      .then((data) => setAllUsers(Array.isArray(data) ? data : []));
-  }, [token]);
+      .then((entries) => {
+        const counts = {};
+        entries
+          .filter((e) => e.is_group)
+          .forEach((e) => (counts[e.chat_id] = e.unread));
+        setUnread(counts);
+      });
+  }, [token, currentUser, syncEpoch]);
+
+  useEffect(() => {
+    const me = currentUser?.name?.trim().toLowerCase();
+    return subscribe((data) => {
+      if (data.type === "inbox_update" && data.entry.is_group) {
+        setUnread((prev) => ({ ...prev, [data.entry.chat_id]: data.entry.unread }));
+      } else if (data.type === "group_message") {
+        const groupId = data.groupId || data.group_id;
+        if (data.sender_id !== me && groupId !== selectedGroup?.id) {
+          setUnread((prev) => ({ ...prev, [groupId]: (prev[groupId] || 0) + 1 }));
+        }
+      }
+    });
+  }, [currentUser, selectedGroup, subscribe]);
 
   // Defensive: if currentUser is not loaded, show loading
   if (!currentUser || !currentUser.name) {
@@ -108,6 +129,11 @@ const GroupList = ({ onSelectGroup, selectedGroup }) => {
               {group.name[0].toUpperCase()}
             </div>
             <span className="font-medium">{group.name}</span>
+            {unread[group.id] > 0 && (
+              <span className="ml-1 px-2 rounded-full bg-blue-500 text-white text-xs">
+                {unread[group.id]}
+              </span>
+            )}
           </div>
           <div className="text-sm text-gray-500">
             {group.members.length} members
@@ -124,7 +150,6 @@ const GroupList = ({ onSelectGroup, selectedGroup }) => {
       <CreateGroupModal
         isOpen={showModal}
         onClose={() => setShowModal(false)}
-        allUsers={allUsers}
         currentUser={currentUser}
         token={token}
       />
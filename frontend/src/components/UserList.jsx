@@ -5,25 +5,77 @@ import authFetch from "../utils/authFetch";
 
 const UserList = ({ onSelectUser, selectedUser }) => {
   const { user, token } = useAuth();
-  const { onlineUsers } = useWebSocket();
+  const { onlineUsers, subscribe, syncEpoch } = useWebSocket();
   const [users, setUsers] = useState([]);
+  // Unread counts of direct chats, from the inbox and live updates
+  const [unread, setUnread] = useState({});
+  const [query, setQuery] = useState("");
+  const [nextCursor, setNextCursor] = useState(null);
 
   const backendURL = import.meta.env.VITE_BACKEND_URL || "http://localhost:8000"
 
-  // Fetch users initially and whenever onlineUsers changes
+  // The directory is paginated: fetch one page, appending when a cursor is given
+  const fetchPage = (after) => {
+    const params = new URLSearchParams({ q: query.trim().toLowerCase() });
+    if (after) params.set("after", after);
+    return authFetch(`${backendURL}/api/auth/users?${params}`, token).then((res) => {
+      if (!res.ok) return;
+      setNextCursor(res.headers.get("X-Next-Cursor"));
+      return res.json().then((data) => {
+        // Exclude the currently logged-in user
+        const page = data.filter((u) => u !== user.username);
+        setUsers((prev) => (after ? [...prev, ...page] : page));
+      });
+    });
+  };
+
+  // Refetch the first page when the search changes (debounced)
+  useEffect(() => {
+    if (!token) return;
+    const timer = setTimeout(() => fetchPage(null), 250);
+    return () => clearTimeout(timer);
+  }, [token, user, query]);
+
+  // Unread counts for the most recent chats
   useEffect(() => {
     if (!token) return;
-    authFetch(`${backendURL}/api/auth/users`, token)
+    authFetch(`${backendURL}/api/inbox`, token)
       .then((res) => (res.ok ? res.json() : []))
-      .then((data) => {
-        // Exclude the currently logged-in user
-        setUsers(data.filter((u) => u !== user.username));
+      .then((entries) => {
+        const counts = {};
+        entries
+          .filter((e) => !e.is_group)
+          .forEach((e) => (counts[e.chat_id] = e.unread));
+        setUnread(counts);
       });
-  }, [token, user, onlineUsers]);
+  }, [token, user, syncEpoch]);
+
+  useEffect(() => {
+    const me = user?.username.trim().toLowerCase();
+    return subscribe((data) => {
+      if (data.type === "inbox_update" && !data.entry.is_group) {
+        setUnread((prev) => ({ ...prev, [data.entry.chat_id]: data.entry.unread }));
+      } else if (
+        data.type === "message" &&
+        data.receiver_id === me &&
+        data.sender_id !== me &&
+        data.sender_id !== selectedUser?.name.trim().toLowerCase()
+      ) {
+        setUnread((prev) => ({ ...prev, [data.sender_id]: (prev[data.sender_id] || 0) + 1 }));
+      }
+    });
+  }, [user, selectedUser, subscribe]);
 
   return (
     <div className="space-y-2">
       <div className="font-semibold text-gray-700 mb-2">Direct Messages</div>
+      <input
+        type="text"
+        value={query}
+        onChange={(e) => setQuery(e.target.value)}
+        placeholder="Search users"
+        className="w-full p-2 border rounded-lg text-sm"
+      />
       {users.map((u) => {
         const normU = u.trim().toLowerCase();
         return (
@@ -41,6 +93,11 @@ const UserList = ({ onSelectUser, selectedUser }) => {
                 {u[0].toUpperCase()}
               </div>
               <span className="font-medium">{u}</span>
+              {unread[normU] > 0 && (
+                <span className="ml-1 px-2 rounded-full bg-blue-500 text-white text-xs">
+                  {unread[normU]}
+                </span>
+              )}
             </div>
             <span
               className={`ml-2 w-3 h-3 rounded-full ${
@@ -56,6 +113,14 @@ const UserList = ({ onSelectUser, selectedUser }) => {
       {users.length === 0 && (
         <div className="text-sm text-gray-500 p-3">No other users found</div>
       )}
+      {nextCursor && (
+        <button
+          className="w-full text-sm text-blue-600 hover:underline p-2"
+          onClick={() => fetchPage(nextCursor)}
+        >
+          Load more
+        </button>
+      )}
     </div>
   );
 };
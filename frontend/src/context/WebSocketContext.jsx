@@ -9,11 +9,16 @@ import { useAuth } from "./AuthContext";
 
 const WebSocketContext = createContext();
 
+// Event seqs remembered per tab to drop events delivered twice
+const MAX_SEEN_SEQS = 1000;
+
 export const WebSocketProvider = ({ children }) => {
   const { user, token } = useAuth();
   const [ws, setWs] = useState(null);
   const subscribers = useRef([]);
   const [onlineUsers, setOnlineUsers] = useState(new Set());
+  // Bumped on sync_reset; components reload history and inbox when it changes
+  const [syncEpoch, setSyncEpoch] = useState(0);
 
   // Open WebSocket when user logs in
   useEffect(() => {
@@ -25,6 +30,34 @@ export const WebSocketProvider = ({ children }) => {
       `${wsProtocol}://${backendURL.replace(/^https?:\/\//, "")}/ws/${normUsername}?token=${token}`
     );
     setWs(socket);
+    // Last change log seq applied, kept across reconnects in this tab
+    const seqKey = `lastSeq:${normUsername}`;
+    const storedSeq = sessionStorage.getItem(seqKey);
+    let lastSeq = storedSeq === null ? null : Number(storedSeq);
+    const setLastSeq = (seq) => {
+      lastSeq = seq;
+      sessionStorage.setItem(seqKey, String(seq));
+    };
+    // Only sync replies move lastSeq: a live event's seq may be ahead of
+    // entries the server has not committed yet. Events can then arrive both
+    // live and replayed, so recently seen seqs are remembered and skipped.
+    const seenKey = `seenSeqs:${normUsername}`;
+    const seenSeqs = JSON.parse(sessionStorage.getItem(seenKey) || "[]");
+    const seen = new Set(seenSeqs);
+    const dispatch = (data) => {
+      if (
+        typeof data.seq === "number" &&
+        data.type !== "initial_status" &&
+        data.type !== "sync_reset"
+      ) {
+        if (seen.has(data.seq)) return;
+        seen.add(data.seq);
+        seenSeqs.push(data.seq);
+        if (seenSeqs.length > MAX_SEEN_SEQS) seen.delete(seenSeqs.shift());
+        sessionStorage.setItem(seenKey, JSON.stringify(seenSeqs));
+      }
+      subscribers.current.forEach((cb) => cb(data));
+    };
 
     socket.onopen = () => {
       // Optionally notify subscribers
@@ -42,10 +75,56 @@ export const WebSocketProvider = ({ children }) => {
           }
           return newSet;
         });
-      } else if (data.type === "initial_status") {
-        setOnlineUsers(new Set(data.online_users));
+      } else if (data.type === "presence") {
+        // Batched delta for our contacts
+        setOnlineUsers((prev) => {
+          const newSet = new Set(prev);
+          data.online.forEach((u) => newSet.add(u));
+          data.offline.forEach((u) => newSet.delete(u));
+          return newSet;
+        });
+      } else if (data.type === "sync_batch") {
+        // Events missed while disconnected, oldest first
+        data.changes.forEach(dispatch);
+        setLastSeq(data.seq);
+        if (data.more) {
+          socket.send(JSON.stringify({ type: "sync", since: data.seq }));
+        }
+        return;
+      } else if (data.type === "sync_reset") {
+        // Missed too much to replay; components reload history instead
+        setLastSeq(data.seq);
+        setSyncEpoch((epoch) => epoch + 1);
+      } else if (
+        data.type === "initial_status" ||
+        data.type === "presence_snapshot"
+      ) {
+        // Online contacts arrive in pages; ask for the next one if any
+        setOnlineUsers((prev) => {
+          const newSet =
+            data.type === "initial_status" ? new Set() : new Set(prev);
+          data.online_users.forEach((u) => newSet.add(u));
+          return newSet;
+        });
+        if (data.next_cursor) {
+          socket.send(
+            JSON.stringify({
+              type: "presence_snapshot",
+              cursor: data.next_cursor,
+            })
+          );
+        }
+        if (data.type === "initial_status") {
+          // Catch up on what happened since we were last connected
+          if (lastSeq === null || lastSeq > data.seq) {
+            // First connection in this tab, or the server's log was reset
+            setLastSeq(data.seq);
+          } else if (lastSeq < data.seq) {
+            socket.send(JSON.stringify({ type: "sync", since: lastSeq }));
+          }
+        }
       }
-      subscribers.current.forEach((cb) => cb(data));
+      dispatch(data);
     };
     socket.onclose = () => {
       setWs(null);
@@ -86,7 +165,14 @@ export const WebSocketProvider = ({ children }) => {
 
   return (
     <WebSocketContext.Provider
-      value={{ ws, sendMessage, subscribe, onlineUsers, disconnectWebSocket }}
+      value={{
+        ws,
+        sendMessage,
+        subscribe,
+        onlineUsers,
+        syncEpoch,
+        disconnectWebSocket,
+      }}
     >
       {children}
     </WebSocketContext.Provider>